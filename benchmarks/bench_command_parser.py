@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Command parser micro benchmark.
+
+Measures the per-message cost of ignoring group messages that are not
+addressed to the bot, and of parsing messages that are, comparing the
+single-pass CommandParser with the previous two-scan implementation.
+
+Every group message is also recorded in RecentMessages before it is parsed,
+so the second table reports that hot path (record + parse) per message,
+comparing a record encoded on arrival (to_dict + marshal + zlib, the first
+version of the buffer) with the current record that only keeps references.
+
+Usage:
+    python benchmarks/bench_command_parser.py [iterations]
+"""
+
+import marshal
+import os
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from napcat import NapCatEvent, GroupMessageEvent, PrivateMessageEvent, At, Text
+from command_dispatch.command_ctx import CommandContext
+from command_dispatch.command_parser import CommandParser
+from command_dispatch.recent_messages import RecentMessages
+
+BOT_ID = 10000
+
+
+def make_group_event(segments):
+    return NapCatEvent.from_dict({
+        "time": 0,
+        "self_id": BOT_ID,
+        "post_type": "message",
+        "message_type": "group",
+        "sub_type": "normal",
+        "message_id": 1,
+        "message_seq": 1,
+        "real_id": 1,
+        "group_id": 123456,
+        "user_id": 20000,
+        "sender": {"user_id": 20000, "nickname": "tester"},
+        "raw_message": "",
+        "message": segments,
+    })
+
+
+def legacy_parse(event):
+    """旧实现：先扫描一遍检查@，再扫描一遍提取文本。"""
+    if isinstance(event, GroupMessageEvent):
+        has_at = any(isinstance(msg, At) and str(msg.qq) == str(CommandContext().user_info["user_id"])
+                     for msg in event.message)
+        if not has_at:
+            return None
+    elif not isinstance(event, PrivateMessageEvent):
+        return None
+
+    text_content = []
+    after_at = False
+    for msg_detail in event.message:
+        if isinstance(msg_detail, At):
+            if str(msg_detail.qq) == str(CommandContext().user_info["user_id"]):
+                after_at = True
+        elif isinstance(msg_detail, Text) and after_at:
+            text_content.append(msg_detail.text)
+
+    full_text = ''.join(text_content).strip()
+    if not full_text:
+        return None
+    parts = full_text.split()
+    return parts[0], parts[1:]
+
+
+def encoded_record(event):
+    """最近消息缓存的第一版：记录时把事件转换为 dict，用 marshal 编码消息段，较大时再压缩。"""
+    raw = event.to_dict()
+    content = marshal.dumps(raw.get("message", ""))
+    compressed = len(content) > 256
+    if compressed:
+        content = zlib.compress(content)
+    sender = raw.get("sender") or {}
+    return (
+        raw.get("message_id"), raw.get("message_seq", ""), raw.get("time", 0),
+        sender.get("user_id", ""), sender.get("nickname", ""), content, compressed
+    )
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    CommandContext().initialize({"user_id": BOT_ID, "nickname": "bot"})
+    parser = CommandParser()
+
+    cases = {
+        "unaddressed (plain text)": make_group_event([
+            {"type": "text", "data": {"text": "今天吃什么"}},
+        ]),
+        "unaddressed (@ someone else)": make_group_event([
+            {"type": "at", "data": {"qq": "30000"}},
+            {"type": "text", "data": {"text": " 在吗"}},
+            {"type": "face", "data": {"id": "1"}},
+            {"type": "text", "data": {"text": "快来"}},
+        ]),
+        "addressed command": make_group_event([
+            {"type": "reply", "data": {"id": "42"}},
+            {"type": "at", "data": {"qq": str(BOT_ID)}},
+            {"type": "text", "data": {"text": " 查看精华 2025.02 20"}},
+        ]),
+        "unaddressed (long text)": make_group_event([
+            {"type": "text", "data": {"text": "今天吃什么" * 100}},
+        ]),
+    }
+
+    print(f"{'case':<32}{'legacy ns/msg':>16}{'parser ns/msg':>16}{'speedup':>10}")
+    for name, event in cases.items():
+        legacy = timeit.timeit(lambda: legacy_parse(event), number=iterations) / iterations * 1e9
+        current = timeit.timeit(lambda: parser.parse(event), number=iterations) / iterations * 1e9
+        print(f"{name:<32}{legacy:>16.1f}{current:>16.1f}{legacy / current:>9.2f}x")
+
+    recent_messages = RecentMessages()
+    encoded_messages = {}
+
+    def encoded_hot_path(event):
+        record = encoded_record(event)
+        encoded_messages[record[0]] = record
+        parser.parse(event)
+
+    def current_hot_path(event):
+        recent_messages.add(event)
+        parser.parse(event)
+
+    print()
+    print(f"{'case (record + parse)':<32}{'parse only':>12}{'encoded ns/msg':>16}{'current ns/msg':>16}{'speedup':>10}")
+    for name, event in cases.items():
+        parse_only = timeit.timeit(lambda: parser.parse(event), number=iterations) / iterations * 1e9
+        encoded = timeit.timeit(lambda: encoded_hot_path(event), number=iterations) / iterations * 1e9
+        current = timeit.timeit(lambda: current_hot_path(event), number=iterations) / iterations * 1e9
+        print(f"{name:<32}{parse_only:>12.1f}{encoded:>16.1f}{current:>16.1f}{encoded / current:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
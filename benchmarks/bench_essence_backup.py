@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Essence backup benchmark.
+
+First compares the original per-row EssenceMessage.create path (one full copy
+of every message per backup, reproduced here with its own schema) with the
+current batched path: two backups of message_count messages, the second with
+half of the set carried over from the first.
+
+Then backs up synthetic essence messages into a temporary database over several
+generations and reports the time of each backup together with the size of
+the database file. In "incremental" mode (the default) only changed
+messages are written; "full" rewrites every message like 备份精华 全量.
+Backups beyond the retention window are only marked expired inside the
+backup transaction (EssenceMaintenance moves them to the cold archive later),
+so the members column and the database size keep growing here.
+
+Usage:
+    python benchmarks/bench_essence_backup.py [message_count] [generations] [incremental|full]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+from peewee import SqliteDatabase, Model, CharField, DateTimeField, IntegerField, BigIntegerField, TextField, ForeignKeyField
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from handlers.essence.essence_models import db, db_pragmas, init_database, EssenceMessage, BackupMembership
+from handlers.essence.essence_handler import EssenceHandler
+from fake_napcat import make_essence_list
+
+GROUP_ID = "123456"
+
+legacy_db = SqliteDatabase(None)
+
+
+class LegacyBackupRecord(Model):
+    """原来的备份记录表。"""
+    group_id = CharField()
+    backup_time = DateTimeField(default=datetime.datetime.now)
+    is_current = IntegerField(default=0)
+
+    class Meta:
+        database = legacy_db
+        table_name = "backuprecord"
+
+
+class LegacyEssenceMessage(Model):
+    """原来的精华消息表，每份备份保存所有消息的完整副本。"""
+    backup = ForeignKeyField(LegacyBackupRecord, backref="messages")
+    group_id = CharField()
+    message_id = CharField()
+    message_seq = CharField()
+    sender_id = CharField()
+    sender_nick = CharField()
+    operator_id = CharField()
+    operator_nick = CharField()
+    operator_time = BigIntegerField()
+    content = TextField()
+
+    class Meta:
+        database = legacy_db
+        table_name = "essencemessage"
+
+
+def legacy_backup(group_id, essence_list):
+    """原来的备份方式：逐条 EssenceMessage.create 写入当前列表，再逐条复制上一份备份中不在列表里的消息。"""
+    current_backup = LegacyBackupRecord.select().where(
+        (LegacyBackupRecord.group_id == group_id) & (LegacyBackupRecord.is_current == 1)
+    ).order_by(LegacyBackupRecord.backup_time.desc()).first()
+    LegacyBackupRecord.update(is_current=0).where(LegacyBackupRecord.group_id == group_id).execute()
+    backup = LegacyBackupRecord.create(group_id=group_id, backup_time=datetime.datetime.now(), is_current=1)
+
+    essence_msg_ids = set()
+    for msg in essence_list:
+        message_id = str(msg.get("message_id", ""))
+        essence_msg_ids.add(message_id)
+        LegacyEssenceMessage.create(
+            backup=backup,
+            group_id=group_id,
+            message_id=message_id,
+            message_seq=msg.get("msg_seq", ""),
+            sender_id=msg.get("sender_id", ""),
+            sender_nick=msg.get("sender_nick", ""),
+            operator_id=msg.get("operator_id", ""),
+            operator_nick=msg.get("operator_nick", ""),
+            operator_time=msg.get("operator_time", 0),
+            content=msg.get("content", ""),
+        )
+
+    if not current_backup:
+        return
+    for msg in LegacyEssenceMessage.select().where(LegacyEssenceMessage.backup == current_backup):
+        if msg.message_id not in essence_msg_ids:
+            LegacyEssenceMessage.create(
+                backup=backup,
+                group_id=group_id,
+                message_id=msg.message_id,
+                message_seq=msg.message_seq,
+                sender_id=msg.sender_id,
+                sender_nick=msg.sender_nick,
+                operator_id=msg.operator_id,
+                operator_nick=msg.operator_nick,
+                operator_time=msg.operator_time,
+                content=msg.content,
+            )
+
+
+def run_legacy(db_file, essence_lists):
+    legacy_db.init(db_file, pragmas=db_pragmas)
+    legacy_db.create_tables([LegacyBackupRecord, LegacyEssenceMessage])
+    timings = []
+    for essence_list in essence_lists:
+        started = time.perf_counter()
+        with legacy_db.atomic():
+            legacy_backup(GROUP_ID, essence_list)
+        timings.append(time.perf_counter() - started)
+    row_count = LegacyEssenceMessage.select().count()
+    legacy_db.close()
+    return timings, row_count
+
+
+def run_batched(db_file, essence_lists):
+    db.init(db_file, pragmas=db_pragmas)
+    init_database()
+    handler = EssenceHandler()
+    timings = []
+    for essence_list in essence_lists:
+        started = time.perf_counter()
+        with db.atomic():
+            handler._backup_essence_messages(GROUP_ID, essence_list)
+        timings.append(time.perf_counter() - started)
+    row_count = EssenceMessage.select().count()
+    db.close()
+    return timings, row_count
+
+
+def compare_paths(tmp_dir, count):
+    # 第一次全新备份；第二次一半消息仍是精华，另一半从上一份备份中继承
+    essence_lists = (make_essence_list(count), make_essence_list(count, start=count // 2))
+
+    print(f"[baseline] backing up {count} synthetic essence messages twice, per-row create vs batched")
+    print(f"{'path':<10}{'first (s)':>12}{'second (s)':>12}{'rows':>10}")
+    results = {}
+    for name, run in (("legacy", run_legacy), ("batched", run_batched)):
+        timings, row_count = run(os.path.join(tmp_dir, f"{name}.db"), essence_lists)
+        results[name] = timings
+        print(f"{name:<10}{timings[0]:>12.3f}{timings[1]:>12.3f}{row_count:>10}")
+    print(f"{'speedup':<10}{results['legacy'][0] / results['batched'][0]:>11.1f}x"
+          f"{results['legacy'][1] / results['batched'][1]:>11.1f}x")
+    print()
+
+
+def database_size(db_file):
+    # WAL 模式下未合并的数据在 -wal 文件中，先做检查点再统计
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(db_file)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    generations = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    full = len(sys.argv) > 3 and sys.argv[3] == "full"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        compare_paths(tmp_dir, count)
+
+        db_file = os.path.join(tmp_dir, "essence_backup.db")
+        db.init(db_file, pragmas=db_pragmas)
+        init_database()
+        handler = EssenceHandler()
+
+        print(f"[generations] backing up {count} synthetic essence messages, {generations} generations, "
+              f"1% of the set replaced per generation, {'full' if full else 'incremental'} mode")
+        print(f"{'generation':<12}{'time (s)':>10}{'messages':>10}{'members':>10}{'db size (KiB)':>16}")
+        for generation in range(generations):
+            essence_list = make_essence_list(count, start=generation * count // 100)
+            started = time.perf_counter()
+            with db.atomic():
+                handler._backup_essence_messages(GROUP_ID, essence_list, full)
+            elapsed = time.perf_counter() - started
+            print(f"{generation + 1:<12}{elapsed:>10.3f}{EssenceMessage.select().count():>10}"
+                  f"{BackupMembership.select().count():>10}{database_size(db_file) / 1024:>16.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Essence read path benchmark.
+
+Compares building the 查看精华 forward payload from full EssenceMessage model
+instances (the previous read path, reproduced here) with the current path
+that selects only the needed columns as tuples. Reports the best time of
+several runs and the peak memory traced by tracemalloc for 100, 1k and 10k
+rows.
+
+Usage:
+    python benchmarks/bench_essence_rows.py [--repeat N] [--payload N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from handlers.essence.essence_models import db, db_pragmas, init_database, decode_content, EssenceMessage, BackupMembership
+from handlers.essence.essence_handler import EssenceHandler
+from fake_napcat import make_essence_list
+
+GROUP_ID = "123456"
+ROW_COUNTS = (100, 1000, 10000)
+
+
+def model_path(handler, backup, limit):
+    """之前的读取方式：查询所有字段并创建模型实例，再逐个读取属性。"""
+    messages = list(EssenceMessage.select().join(BackupMembership).where(
+        (BackupMembership.backup == backup) & (EssenceMessage.group_id == GROUP_ID)
+    ).order_by(EssenceMessage.operator_time.desc()).limit(limit))
+    return [{
+        "type": "node",
+        "data": {
+            "name": msg.sender_nick,
+            "uin": msg.sender_id,
+            "content": decode_content(msg.content, msg.content_format),
+            "time": msg.operator_time
+        }
+    } for msg in messages]
+
+
+def tuple_path(handler, backup, limit):
+    """当前的读取方式：只查询需要的字段，按元组读取。"""
+    messages = handler._query_essence_messages(GROUP_ID, backup, (None, None, None, limit))
+    return handler._prepare_forward_messages(messages)
+
+
+def measure(path, handler, backup, limit, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = path(handler, backup, limit)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = path(handler, backup, limit)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model and tuple read paths for 查看精华")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case, the best is reported")
+    parser.add_argument("--payload", type=int, default=200, help="text length of each essence message")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.init(os.path.join(tmp_dir, "essence_backup.db"), pragmas=db_pragmas)
+        init_database()
+        handler = EssenceHandler()
+        with db.atomic():
+            handler._backup_essence_messages(GROUP_ID, make_essence_list(max(ROW_COUNTS), payload_size=args.payload))
+        backup = handler._get_current_backup(GROUP_ID)
+
+        print(f"[rows] 查看精华 forward payload from {max(ROW_COUNTS)} essence messages, "
+              f"{args.payload} characters each, best of {args.repeat}")
+        print(f"{'rows':>8}{'path':>8}{'time (ms)':>12}{'peak (KiB)':>12}{'speedup':>10}{'memory':>10}")
+        for limit in ROW_COUNTS:
+            model_time, model_peak, model_result = measure(model_path, handler, backup, limit, args.repeat)
+            tuple_time, tuple_peak, tuple_result = measure(tuple_path, handler, backup, limit, args.repeat)
+            if model_result != tuple_result:
+                raise Exception(f"{limit} 行时两种读取方式的结果不一致")
+            print(f"{limit:>8}{'model':>8}{model_time * 1000:>12.2f}{model_peak / 1024:>12.1f}")
+            print(f"{limit:>8}{'tuple':>8}{tuple_time * 1000:>12.2f}{tuple_peak / 1024:>12.1f}"
+                  f"{model_time / tuple_time:>9.1f}x{tuple_peak / model_peak:>9.0%}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Startup benchmark.
+
+Boots the command cache in fresh interpreters and reports how long
+initialization takes, comparing:
+
+    legacy  every handler module is imported and instantiated at startup
+    lazy    handler files are parsed with ast into the command manifest and
+            handler modules are imported on first use of their commands
+
+For each boot the script also reports how long parsing the handler files
+took and whether peewee (pulled in by the essence handler) was imported.
+
+Usage:
+    python benchmarks/bench_startup.py [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+BOOT_SCRIPT = r"""
+import importlib
+import json
+import os
+import sys
+import time
+
+started = time.perf_counter()
+sys.path.insert(0, {src_dir!r})
+from command_dispatch import command_manifest
+from command_dispatch.command_ctx import CommandCache
+from command_dispatch.handler_registry import HandlerRegistry
+
+mode = {mode!r}
+if mode == "legacy":
+    # 旧的启动流程：遍历 handlers 目录导入所有模块，并创建所有处理器实例
+    from handlers.essence.essence_models import db, db_pragmas, init_database
+    db.init({db_file!r}, pragmas=db_pragmas)
+    init_database()
+    handlers_dir = command_manifest.HANDLERS_DIR
+    sys.path.append(handlers_dir)
+    for root, dirs, files in os.walk(handlers_dir):
+        for file in files:
+            if file.endswith('.py') and not file.startswith('__'):
+                relative_path = os.path.relpath(os.path.join(root, file), handlers_dir)
+                importlib.import_module(relative_path[:-len('.py')].replace(os.sep, '.'))
+    instances = [handler_class() for handler_class in HandlerRegistry.get_all_handlers()]
+    parse = 0.0
+else:
+    # 记录 initialize 中解析处理器文件的耗时
+    from command_dispatch import command_ctx
+    parse_times = []
+
+    def timed_load_command_manifest():
+        parse_started = time.perf_counter()
+        result = command_manifest.load_command_manifest()
+        parse_times.append(time.perf_counter() - parse_started)
+        return result
+
+    command_ctx.load_command_manifest = timed_load_command_manifest
+    CommandCache().initialize()
+    parse = sum(parse_times)
+
+elapsed = time.perf_counter() - started
+print(json.dumps({{"elapsed": elapsed, "parse": parse, "peewee": "peewee" in sys.modules}}))
+"""
+
+
+def boot(mode, db_file):
+    script = BOOT_SCRIPT.format(src_dir=SRC_DIR, mode=mode, db_file=db_file)
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "essence_backup.db")
+
+        results = {"legacy": [], "lazy": []}
+        for _ in range(runs):
+            for mode in results:
+                results[mode].append(boot(mode, db_file))
+
+    print(f"{runs} boots per mode, time measured inside the interpreter (imports + initialization)")
+    print(f"{'mode':<10}{'median (ms)':>14}{'min (ms)':>12}{'parse (ms)':>12}{'peewee imported':>18}")
+    for mode, boots in results.items():
+        elapsed = sorted(result["elapsed"] * 1000 for result in boots)
+        parse = sorted(result["parse"] * 1000 for result in boots)
+        print(f"{mode:<10}{elapsed[len(elapsed) // 2]:>14.1f}{elapsed[0]:>12.1f}{parse[len(parse) // 2]:>12.1f}"
+              f"{str(any(result['peewee'] for result in boots)):>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""End-to-end benchmark suite.
+
+Runs the real dispatcher and handlers against FakeNapCatClient and a
+temporary database, fully offline, and prints:
+
+    dispatch    throughput of a synthetic event stream through EventWorkerPool
+    latency     end-to-end handling time of help / 查看精华 / 备份精华
+    db size     database size while 备份精华 runs many times with churn
+
+Random inputs are seeded, so numbers from two runs on the same machine can
+be compared to catch regressions.
+
+Usage:
+    python benchmarks/bench_suite.py [--events N] [--iterations N] [--backups N]
+                                     [--essence N] [--latency SECONDS] [--payload BYTES]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from command_dispatch.command_ctx import CommandContext
+from command_dispatch.command_dispatcher import CommandDispatcher
+from command_dispatch.command_throttle import CommandThrottle
+from command_dispatch.event_worker_pool import EventWorkerPool
+from handlers.essence.essence_models import db, db_pragmas
+from fake_napcat import FakeNapCatClient
+
+GROUP_ID = 100000
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def ljust_display(text, width):
+    # 中文字符在终端中占两列
+    display_width = sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+    return text + " " * max(0, width - display_width)
+
+
+def database_size(db_file):
+    # WAL 模式下未合并的数据在 -wal 文件中，先做检查点再统计
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(db_file)
+
+
+async def bench_dispatch(dispatcher, client, events):
+    stream = list(client.event_stream(events, command_ratio=0.05, commands=("help",)))
+    sent_before = len(client.sent)
+    pool = EventWorkerPool(dispatcher._try_handle_command_msg, max_concurrency=8, max_pending=1000)
+
+    started = time.perf_counter()
+    for event in stream:
+        await pool.submit(event)
+    await pool.drain()
+    elapsed = time.perf_counter() - started
+
+    print(f"\n[dispatch] {events} events, 5% commands (help), 8 concurrent")
+    print(f"{'events/s':>12}{'us/event':>12}{'replies':>10}")
+    print(f"{events / elapsed:>12.0f}{elapsed / events * 1e6:>12.1f}{len(client.sent) - sent_before:>10}")
+
+
+async def bench_latency(dispatcher, client, iterations):
+    cases = {
+        "help": lambda: client.group_event("help"),
+        "help 精华": lambda: client.group_event("help 精华"),
+        "查看精华": lambda: client.group_event("查看精华"),
+        "查看精华 <QQ号>": lambda: client.group_event("查看精华 20001"),
+        "备份精华": lambda: client.group_event("备份精华"),
+    }
+
+    print(f"\n[latency] {iterations} runs per command, NapCat latency {client.latency * 1000:.1f}ms, "
+          f"{client.essence_count} essence messages (查看精华 results are cached after the first run)")
+    print(f"{'command':<18}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}")
+    for name, make_event in cases.items():
+        runs = iterations if name != "备份精华" else max(1, iterations // 10)
+        elapsed = []
+        for _ in range(runs):
+            event = make_event()
+            started = time.perf_counter()
+            await dispatcher._try_handle_command_msg(event)
+            elapsed.append(time.perf_counter() - started)
+        elapsed.sort()
+        print(f"{ljust_display(name, 18)}{percentile(elapsed, 0.5) * 1000:>10.2f}"
+              f"{percentile(elapsed, 0.95) * 1000:>10.2f}{elapsed[-1] * 1000:>10.2f}")
+
+
+async def bench_db_size(dispatcher, client, backups, db_file):
+    print(f"\n[db size] {backups} backups of {client.essence_count} essence messages, "
+          f"{client.essence_churn} replaced per backup")
+    print(f"{'backups':>8}{'db size (KiB)':>16}{'last backup (ms)':>18}")
+    checkpoints = {backups} | {backups * i // 5 for i in range(1, 5)}
+    for backup in range(1, backups + 1):
+        started = time.perf_counter()
+        await dispatcher._try_handle_command_msg(client.group_event("备份精华", group_id=GROUP_ID + 1))
+        elapsed = time.perf_counter() - started
+        if backup in checkpoints:
+            print(f"{backup:>8}{database_size(db_file) / 1024:>16.1f}{elapsed * 1000:>18.2f}")
+
+
+async def run(args, db_file):
+    client = FakeNapCatClient(
+        latency=args.latency,
+        essence_count=args.essence,
+        essence_churn=max(1, args.essence // 100),
+        payload_size=args.payload,
+    )
+    CommandContext().initialize(await client.get_login_info(), client)
+    dispatcher = CommandDispatcher()
+    # 测量的是指令本身的开销，关闭限流，否则重复的备份精华和查看精华会被拒绝
+    CommandThrottle().set_enabled(False)
+
+    await bench_dispatch(dispatcher, client, args.events)
+    # 先备份一次，查看精华才有数据
+    await dispatcher._try_handle_command_msg(client.group_event("备份精华"))
+    await bench_latency(dispatcher, client, args.iterations)
+    await bench_db_size(dispatcher, client, args.backups, db_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark suite")
+    parser.add_argument("--events", type=int, default=20000, help="events in the dispatch throughput run")
+    parser.add_argument("--iterations", type=int, default=200, help="runs per command in the latency run")
+    parser.add_argument("--backups", type=int, default=50, help="backups in the db size run")
+    parser.add_argument("--essence", type=int, default=1000, help="essence messages returned by the fake client")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated NapCat API latency in seconds")
+    parser.add_argument("--payload", type=int, default=40, help="text bytes per essence message")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "essence_backup.db")
+        db.init(db_file, pragmas=db_pragmas)
+        asyncio.run(run(args, db_file))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
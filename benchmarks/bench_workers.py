@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Worker process benchmark.
+
+Runs the same stream of 查看精华 commands (random sender and limit, so most
+results miss the cache and the forward payload has to be built), with one in
+four replaced by 精华统计, through the
+in-process EventWorkerPool and through ProcessWorkerPool with 1..N worker
+processes, against FakeNapCatClient and a temporary database. Prints the
+throughput of each mode and checks that every group received its replies in
+the order its commands were sent.
+
+Usage:
+    python benchmarks/bench_workers.py [--workers N] [--events N] [--groups N] [--essence N]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from command_dispatch.command_ctx import CommandCache, CommandContext
+from command_dispatch.command_dispatcher import CommandDispatcher
+from command_dispatch.command_throttle import CommandThrottle
+from command_dispatch.event_worker_pool import EventWorkerPool
+from command_dispatch.process_worker_pool import ProcessWorkerPool
+from handlers.essence.essence_models import db, db_pragmas
+from fake_napcat import FakeNapCatClient, make_essence_list
+
+GROUP_ID = 100000
+
+
+def init_worker(db_file):
+    """工作进程初始化：使用临时数据库，关闭限流。"""
+    db.init(db_file, pragmas=db_pragmas)
+    CommandThrottle().set_enabled(False)
+
+
+def make_events(client, count, groups, seed=0):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        if rng.random() < 0.25:
+            text = "精华统计"
+        else:
+            text = f"查看精华 {20000 + rng.randrange(50)} {rng.randint(1, 100)}"
+        events.append(client.group_event(
+            text, group_id=GROUP_ID + rng.randrange(groups), user_id=20000 + rng.randrange(200)
+        ))
+    return events
+
+
+def replies_in_order(client):
+    """检查每个群聊的回复顺序与指令顺序一致（精华统计的回复中引用的消息 ID 递增）。"""
+    last_reply = {}
+    for api, group_id, message in client.sent:
+        if api != "send_group_msg":
+            continue
+        # 主进程中直接发送的是消息段对象，工作进程转发回来的是 dict
+        segments = [dict(segment) for segment in message]
+        reply_id = next(int(segment["data"]["id"]) for segment in segments if segment["type"] == "reply")
+        if reply_id < last_reply.get(group_id, 0):
+            return False
+        last_reply[group_id] = reply_id
+    return True
+
+
+async def run_mode(name, client, pool, events):
+    sent_before = len(client.sent)
+    started = time.perf_counter()
+    for event in events:
+        await pool.submit(event)
+    await pool.drain()
+    elapsed = time.perf_counter() - started
+    forwards = sum(1 for api, _, _ in client.sent[sent_before:] if api == "send_group_forward_msg")
+    replies = sum(1 for api, _, _ in client.sent[sent_before:] if api == "send_group_msg")
+    print(f"{name:<12}{len(events) / elapsed:>12.0f}{elapsed:>12.2f}{forwards:>12}{replies:>12}")
+
+
+async def run(args, db_file):
+    client = FakeNapCatClient(essence_count=args.essence, essence_churn=0, payload_size=200)
+    user_info = await client.get_login_info()
+    CommandContext().initialize(user_info, client)
+    CommandThrottle().set_enabled(False)
+    dispatcher = CommandDispatcher()
+
+    # 每个群聊先备份一次，查看精华才有数据
+    from handlers.essence.essence_handler import EssenceHandler
+    handler = CommandCache().get_handler_instance(EssenceHandler)
+    for group_index in range(args.groups):
+        await handler._db.write(
+            handler._backup_essence_messages, GROUP_ID + group_index, make_essence_list(args.essence, payload_size=200)
+        )
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    print(f"\n[workers] {args.events} x 查看精华 <QQ号> <数量> over {args.groups} groups, "
+          f"{args.essence} essence messages per group")
+    print(f"{'mode':<12}{'events/s':>12}{'seconds':>12}{'forwards':>12}{'replies':>12}")
+
+    events = make_events(client, args.events, args.groups)
+    await run_mode("in-process", client, EventWorkerPool(dispatcher._try_handle_command_msg), events)
+    ordered = replies_in_order(client)
+    worker_counts = sorted({1, args.workers} | {n for n in (2, 4) if n < args.workers})
+    for worker_count in worker_counts:
+        client.sent.clear()
+        pool = ProcessWorkerPool(client, user_info, worker_count, worker_options={
+            "initializer": init_worker,
+            "initargs": (db_file,),
+        })
+        await pool.start()
+        events = make_events(client, args.events, args.groups)
+        await run_mode(f"{worker_count} workers", client, pool, events)
+        ordered = ordered and replies_in_order(client)
+    print(f"per-group reply order preserved: {ordered}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare in-process and multi-process event handling")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="largest number of worker processes")
+    parser.add_argument("--events", type=int, default=2000, help="commands in the stream")
+    parser.add_argument("--groups", type=int, default=16, help="groups the commands are spread over")
+    parser.add_argument("--essence", type=int, default=1000, help="essence messages per group")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "essence_backup.db")
+        init_worker(db_file)
+        asyncio.run(run(args, db_file))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
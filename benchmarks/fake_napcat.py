@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Local NapCat stand-in for benchmarks.
+
+FakeNapCatClient implements the NapCat API calls used by the handlers with
+a configurable latency and payload size, records every message the bot
+sends, and builds synthetic group and private message events bound to
+itself, so the whole command path can run offline.
+"""
+
+import asyncio
+import itertools
+import random
+
+from napcat import NapCatEvent
+
+BOT_ID = 10000
+
+
+def make_essence_list(count, start=0, payload_size=40):
+    """生成 count 条精华消息，消息 ID 从 start 开始连续编号。"""
+    return [{
+        "message_id": 1000000 + i,
+        "msg_seq": i,
+        "sender_id": str(20000 + i % 50),
+        "sender_nick": f"user{i % 50}",
+        "operator_id": "30000",
+        "operator_nick": "admin",
+        "operator_time": 1700000000 + i * 60,
+        "content": [{"type": "text", "data": {"text": f"精华消息 {i} " + "x" * payload_size}}],
+    } for i in range(start, start + count)]
+
+
+class FakeNapCatClient:
+    """NapCat 客户端替身。
+
+    每个 API 调用先等待 latency 秒（模拟网络往返），发送的消息记录在 sent 中。
+    精华列表在每次 get_essence_msg_list 后向前滚动 essence_churn 条，模拟群里新增和移除精华。
+    """
+
+    def __init__(self, latency=0.0, essence_count=1000, essence_churn=10, payload_size=40, seed=0):
+        self.latency = latency
+        self.essence_count = essence_count
+        self.essence_churn = essence_churn
+        self.payload_size = payload_size
+        self.self_id = BOT_ID
+        self.sent = []  # 格式: [(api, target_id, message)]
+        self.calls = {}  # 格式: {api: count}
+        self._essence_start = 0
+        self._message_ids = itertools.count(1)
+        self._random = random.Random(seed)
+
+    async def _call(self, api):
+        self.calls[api] = self.calls.get(api, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_login_info(self):
+        await self._call("get_login_info")
+        return {"user_id": BOT_ID, "nickname": "bench-bot"}
+
+    async def get_group_list(self):
+        await self._call("get_group_list")
+        return [{"group_id": group_id, "group_name": f"group{group_id}"} for group_id in range(100000, 100010)]
+
+    async def get_essence_msg_list(self, group_id):
+        await self._call("get_essence_msg_list")
+        essence_list = make_essence_list(self.essence_count, self._essence_start, self.payload_size)
+        self._essence_start += self.essence_churn
+        return essence_list
+
+    async def get_msg(self, message_id):
+        await self._call("get_msg")
+        return {
+            "message_id": int(message_id),
+            "message_seq": int(message_id),
+            "time": 1700000000,
+            "sender": {"user_id": 20000, "nickname": "user0"},
+            "message": [{"type": "text", "data": {"text": "x" * self.payload_size}}],
+        }
+
+    async def send_group_msg(self, group_id, message):
+        await self._call("send_group_msg")
+        self.sent.append(("send_group_msg", group_id, message))
+        return {"message_id": next(self._message_ids)}
+
+    async def send_private_msg(self, user_id, message):
+        await self._call("send_private_msg")
+        self.sent.append(("send_private_msg", user_id, message))
+        return {"message_id": next(self._message_ids)}
+
+    async def send_group_forward_msg(self, group_id, messages):
+        await self._call("send_group_forward_msg")
+        self.sent.append(("send_group_forward_msg", group_id, messages))
+        return {"message_id": next(self._message_ids), "res_id": ""}
+
+    def group_event(self, text, group_id=100000, user_id=20000, at_bot=True, reply_id=None, role="member"):
+        segments = []
+        if reply_id is not None:
+            segments.append({"type": "reply", "data": {"id": str(reply_id)}})
+        if at_bot:
+            segments.append({"type": "at", "data": {"qq": str(BOT_ID)}})
+        segments.append({"type": "text", "data": {"text": (" " if at_bot else "") + text}})
+        return self._event({
+            "message_type": "group",
+            "sub_type": "normal",
+            "group_id": group_id,
+            "user_id": user_id,
+            "sender": {"user_id": user_id, "nickname": f"user{user_id}", "role": role},
+            "message": segments,
+        })
+
+    def private_event(self, text, user_id=20000):
+        return self._event({
+            "message_type": "private",
+            "sub_type": "friend",
+            "user_id": user_id,
+            "sender": {"user_id": user_id, "nickname": f"user{user_id}"},
+            "message": [{"type": "text", "data": {"text": text}}],
+        })
+
+    def _event(self, payload):
+        message_id = next(self._message_ids)
+        return NapCatEvent.from_dict({
+            "time": 1700000000,
+            "self_id": BOT_ID,
+            "post_type": "message",
+            "message_id": message_id,
+            "message_seq": message_id,
+            "real_id": message_id,
+            "raw_message": "",
+            **payload,
+        }, client=self)
+
+    def event_stream(self, count, groups=10, users=200, command_ratio=0.05, commands=("help",)):
+        """生成合成的消息流：大部分是未@机器人的群聊消息，command_ratio 比例的消息是指令。"""
+        for _ in range(count):
+            group_id = 100000 + self._random.randrange(groups)
+            user_id = 20000 + self._random.randrange(users)
+            if self._random.random() < command_ratio:
+                command = self._random.choice(commands)
+                if self._random.random() < 0.2:
+                    yield self.private_event(command, user_id=user_id)
+                else:
+                    yield self.group_event(command, group_id=group_id, user_id=user_id)
+            else:
+                yield self.group_event("今天吃什么" + "x" * self._random.randrange(20),
+                                       group_id=group_id, user_id=user_id, at_bot=False)
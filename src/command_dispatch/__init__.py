@@ -4,4 +4,10 @@
 
 from command_dispatch.command_ctx import CommandCache, CommandContext
 from command_dispatch.command_dispatcher import CommandDispatcher
+from command_dispatch.command_parser import CommandParser, ParsedCommand, get_current_command
+from command_dispatch.command_throttle import CommandThrottle
+from command_dispatch.event_worker_pool import EventWorkerPool
 from command_dispatch.handler_registry import register_handler
+from command_dispatch.metrics import CommandMetrics
+from command_dispatch.napcat_api import NapCatApi
+from command_dispatch.recent_messages import RecentMessages
@@ -1,13 +1,28 @@
 import importlib
 import os
-import sys
 
+from command_dispatch.command_manifest import HANDLERS_DIR, load_command_manifest
 from command_dispatch.handler_registry import HandlerRegistry
 
+
+class LazyRoute:
+    """尚未导入的处理函数，第一次分发到该指令时替换为处理器实例的绑定方法。"""
+    
+    __slots__ = ("module", "class_name", "method_name", "__qualname__")
+    
+    def __init__(self, module, class_name, method_name):
+        self.module = module
+        self.class_name = class_name
+        self.method_name = method_name
+        self.__qualname__ = f"{class_name}.{method_name}"
+
 # 指令缓存单例类
 class CommandCache:
     _instance = None
     _commands = {}  # 格式: {command_name: {"usage": "", "description": "", "category": "", "chat_type": ""}}
+    _handler_instances = {}  # 格式: {handler_class: handler_instance}
+    _category_index = {}  # 格式: {category: {command_name: info}}
+    _routes = {}  # 路由表，格式: {(command_name, chat_type): bound_method 或 LazyRoute}，chat_type 为 "group" 或 "private"
     _initialized = False
     
     def __new__(cls):
@@ -19,35 +34,134 @@ class CommandCache:
         if self._initialized:
             return
         
-        self._discover_handlers()
-
         self._commands = {}
+        self._category_index = {}
+        self._handler_instances = {}
+        self._routes = {}
+        
+        # 清单中的处理器只登记指令信息，模块在第一次使用其指令时才导入
+        handler_entries, eager_modules = load_command_manifest()
+        manifest_handlers = set()
+        for entry in handler_entries:
+            module_file = os.path.join(HANDLERS_DIR, *entry["module"].split('.')[1:]) + '.py'
+            manifest_handlers.add((os.path.abspath(module_file), entry["class_name"]))
+            route_chat_types = self._route_chat_types(entry["chat_type"])
+            for command in entry["commands"]:
+                lazy_route = LazyRoute(entry["module"], entry["class_name"], command["method"])
+                self._register_command(command["names"], route_chat_types, lazy_route, {
+                    "usage": command["usage"],
+                    "description": command["description"],
+                    "category": entry["category"],
+                    "chat_type": entry["chat_type"]
+                })
         
+        # 无法静态解析的处理器文件仍然在启动时导入，并通过反射注册
+        self._import_modules(eager_modules)
         for handler_class in HandlerRegistry.get_all_handlers():
+            if HandlerRegistry._handler_key(handler_class) in manifest_handlers:
+                continue
             handler = handler_class()
+            self._handler_instances[handler_class] = handler
             category = getattr(handler_class, "_category", "通用")
             chat_type = getattr(handler_class, "_chat_type", "both")
+            route_chat_types = self._route_chat_types(chat_type)
             
             # 获取所有方法，检查哪些是命令处理函数
             for attr_name in dir(handler):
                 attr = getattr(handler, attr_name)
                 if hasattr(attr, "_command_names"):
-                    command_names = attr._command_names
-                    usage = getattr(attr, "_usage", "")
-                    description = getattr(attr, "_description", "")
-                    
-                    for command_name in command_names:
-                        normalized_name = command_name.lower()
-                        self._commands[normalized_name] = {
-                            "usage": usage,
-                            "description": description,
-                            "category": category,
-                            "chat_type": chat_type
-                        }
+                    self._register_command(attr._command_names, route_chat_types, attr, {
+                        "usage": getattr(attr, "_usage", ""),
+                        "description": getattr(attr, "_description", ""),
+                        "category": category,
+                        "chat_type": chat_type
+                    })
         
         self._initialized = True
         print(f"指令缓存已初始化，共缓存 {len(self._commands)} 个指令")
     
+    @staticmethod
+    def _route_chat_types(chat_type):
+        return ("group", "private") if chat_type == "both" else (chat_type,)
+    
+    def _register_command(self, command_names, route_chat_types, handler_func, info):
+        for command_name in command_names:
+            normalized_name = command_name.lower()
+            if not self._add_route(normalized_name, route_chat_types, handler_func):
+                continue
+            if normalized_name in self._commands:
+                continue
+            self._commands[normalized_name] = dict(info)
+            self._category_index.setdefault(info["category"], {})[normalized_name] = self._commands[normalized_name]
+    
+    def _add_route(self, command_name, chat_types, handler_func):
+        """将指令加入路由表，指令冲突时保留先注册的处理函数。
+        
+        Returns:
+            bool: 是否至少有一个聊天类型注册成功
+        """
+        added = False
+        for chat_type in chat_types:
+            route_key = (command_name, chat_type)
+            existing = self._routes.get(route_key)
+            if existing is None:
+                self._routes[route_key] = handler_func
+                added = True
+            elif existing != handler_func:
+                print(
+                    f"指令冲突: {command_name} ({chat_type}) 已由 "
+                    f"{existing.__qualname__} 注册，忽略 {handler_func.__qualname__}"
+                )
+        return added
+    
+    def get_route(self, command, chat_type):
+        """根据指令名称和聊天类型获取处理函数，未找到时返回 None"""
+        if not self._initialized:
+            raise Exception("command cache is not initialized")
+        handler_func = self._routes.get((command.lower(), chat_type))
+        if isinstance(handler_func, LazyRoute):
+            handler_func = self._resolve_lazy_route(handler_func, command.lower(), chat_type)
+        return handler_func
+    
+    def _resolve_lazy_route(self, lazy_route, command_name, chat_type):
+        """导入处理器模块并创建处理器实例，将该处理器的所有延迟路由替换为绑定方法。"""
+        try:
+            module = importlib.import_module(lazy_route.module)
+            handler_class = getattr(module, lazy_route.class_name)
+        except Exception as e:
+            print(f"导入处理器 {lazy_route.__qualname__} 时出错: {e}")
+            self._routes.pop((command_name, chat_type), None)
+            return None
+        
+        self._load_handler(handler_class, lazy_route.module, lazy_route.class_name)
+        return self._routes[(command_name, chat_type)]
+    
+    def _load_handler(self, handler_class, module_path, class_name):
+        handler = self._handler_instances.get(handler_class)
+        if handler is None:
+            handler = handler_class()
+            self._handler_instances[handler_class] = handler
+        
+        for route_key, route in self._routes.items():
+            if isinstance(route, LazyRoute) and route.module == module_path and route.class_name == class_name:
+                self._routes[route_key] = getattr(handler, route.method_name)
+        return handler
+    
+    def get_handler_instance(self, handler_class):
+        """获取处理器实例，所有分发共享同一个实例。
+        
+        处理器还没有被使用过（只在指令清单中登记）时，在这里创建实例。
+        """
+        if not self._initialized:
+            raise Exception("command cache is not initialized")
+        handler = self._handler_instances.get(handler_class)
+        if handler is None:
+            module_path, class_name = handler_class.__module__, handler_class.__qualname__
+            if any(isinstance(route, LazyRoute) and route.module == module_path and route.class_name == class_name
+                   for route in self._routes.values()):
+                handler = self._load_handler(handler_class, module_path, class_name)
+        return handler
+    
     def get_all_commands(self):
         if not self._initialized:
             raise Exception("command cache is not initialized")
@@ -57,37 +171,20 @@ class CommandCache:
         """根据类别获取命令"""
         if not self._initialized:
             raise Exception("command cache is not initialized")
-        return {cmd: info for cmd, info in self._commands.items() if info["category"] == category}
+        return self._category_index.get(category, {})
     
     def get_categories(self):
         """获取所有命令类别"""
         if not self._initialized:
             raise Exception("command cache is not initialized")
-        return set(info["category"] for info in self._commands.values())
+        return set(self._category_index)
     
-    def _discover_handlers(self):
-        # TODO: 这里为了简单起见，直接假设了 handlers 目录的位置，后续需要修改一下 
-        handlers_dir = os.path.join(os.path.dirname(__file__), '..', 'handlers')
-
-        root_dir = os.path.abspath(handlers_dir)
-
-        if root_dir not in sys.path:
-            sys.path.append(root_dir)
-
-        for root, dirs, files in os.walk(handlers_dir):
-            for file in files:
-                if file.endswith('.py') and not file.startswith('__'):
-                    try:
-                        file_abs_path = os.path.abspath(os.path.join(root, file))
-                        relative_path = os.path.relpath(file_abs_path, root_dir)
-                        module_path = relative_path.replace('.py', '').replace(os.sep, '.')
-                        
-                        if module_path.startswith('.'):
-                            module_path = module_path[1:]
-
-                        importlib.import_module(module_path)
-                    except Exception as e:
-                        print(f"导入文件 {os.path.join(root, file)} 时出错: {e}")
+    def _import_modules(self, module_paths):
+        for module_path in module_paths:
+            try:
+                importlib.import_module(module_path)
+            except Exception as e:
+                print(f"导入模块 {module_path} 时出错: {e}")
 
 
 # 上下文单例类，用于管理user_info和client实例
@@ -100,14 +197,16 @@ class CommandContext:
             cls._instance = super().__new__(cls)
         return cls._instance
     
-    def initialize(self, user_info, client=None):
+    def initialize(self, user_info, client=None, admin_user_ids=()):
         self._user_info = user_info
         self._client = client
+        self._admin_user_ids = {str(user_id) for user_id in admin_user_ids}
         self._initialized = True
     
     def cleanup(self):
         self._user_info = None
         self._client = None
+        self._admin_user_ids = set()
         self._initialized = False
     
     @property
@@ -122,5 +221,11 @@ class CommandContext:
             raise Exception("command context is not initialized")
         return self._client
     
+    def is_admin(self, user_id):
+        """判断用户是否为机器人管理员（在 admin_user_ids 中配置）"""
+        if not self._initialized:
+            raise Exception("command context is not initialized")
+        return str(user_id) in self._admin_user_ids
+    
     def is_initialized(self):
         return self._initialized
\ No newline at end of file
@@ -1,86 +1,78 @@
-from napcat import GroupMessageEvent, PrivateMessageEvent
-from napcat import At, Text
-from command_dispatch.handler_registry import HandlerRegistry
-from command_dispatch.command_ctx import CommandCache, CommandContext
+from napcat import Text, GroupMessageEvent
+from command_dispatch.command_ctx import CommandCache
+from command_dispatch.command_parser import CommandParser, set_current_command
+from command_dispatch.command_throttle import CommandThrottle, COALESCED_MESSAGE, throttled_message
+from command_dispatch.metrics import CommandMetrics
+from command_dispatch.recent_messages import RecentMessages
+
+
+async def run_command(handler_func, event, parsed):
+    """检查限流后执行处理函数并记录耗时，分发器和 CommandHandlerBase.handle 共用。
+    
+    Args:
+        handler_func: 指令处理函数
+        event: 消息事件
+        parsed: ParsedCommand 解析结果
+    """
+    command_name = _command_name(handler_func, parsed)
+    retry_after, notify = CommandThrottle().acquire(command_name, handler_func, event)
+    if retry_after:
+        # 每轮限流只提示一次，避免刷屏
+        if notify:
+            await event.reply([Text(text=throttled_message(parsed.command, retry_after))])
+        return
+    
+    # 处理函数可以通过 get_current_command() 复用解析结果
+    set_current_command(parsed)
+    chat_type = "group" if isinstance(event, GroupMessageEvent) else "private"
+    with CommandMetrics().timer("command", command_name, chat_type):
+        await handler_func(event, parsed.args)
+
+
+def _command_name(handler_func, parsed):
+    # 同一处理函数的别名记在第一个指令名下，限流、合并和统计都按该名称计算
+    return getattr(handler_func, "_command_names", (parsed.command,))[0].lower()
+
 
 # 指令分发器
 class CommandDispatcher:
     def __init__(self):
-        self._handler_instances = {}
-        self._all_commands = None
-        
-        # 初始化指令缓存
-        command_cache = CommandCache()
-        command_cache.initialize()
-
+        # 初始化指令缓存（同时构建指令路由表）
+        self._command_cache = CommandCache()
+        self._command_cache.initialize()
+        self._command_parser = CommandParser()
+        self._metrics = CommandMetrics()
+        self._recent_messages = RecentMessages()
     
-    def _extract_command_and_args(self, message_list, is_private=False):
-        text_content = []
-        
-        if is_private:
-            # 私聊消息：直接提取所有文本内容
-            for msg_detail in message_list:
-                if isinstance(msg_detail, Text):
-                    text_content.append(msg_detail.text)
-        else:
-            # 群消息：找到@之后的文本内容
-            after_at = False
-            for msg_detail in message_list:
-                if isinstance(msg_detail, At):
-                    if str(msg_detail.qq) == str(CommandContext().user_info["user_id"]):
-                        after_at = True
-                elif isinstance(msg_detail, Text) and after_at:
-                    text_content.append(msg_detail.text)
-        
-        # 合并文本内容并分割指令和参数
-        full_text = ''.join(text_content).strip()
-        if not full_text:
-            return None, []
-        
-        parts = full_text.split()
-        command = parts[0]
-        args = parts[1:] if len(parts) > 1 else []
-        
-        return command, args
+    def _route(self, event):
+        # 一次遍历完成@检查和指令解析，未@机器人的群消息和不支持的事件类型直接返回 (None, None)
+        parsed = self._command_parser.parse(event)
+        if parsed is None:
+            return None, None
+        # 通过路由表查找处理函数
+        chat_type = "group" if isinstance(event, GroupMessageEvent) else "private"
+        return parsed, self._command_cache.get_route(parsed.command, chat_type)
+    
+    def coalesce_key(self, event):
+        """供 EventWorkerPool 在事件进入串行队列之前调用，返回可以合并的请求的键，其他事件返回 None。"""
+        parsed, handler_func = self._route(event)
+        if handler_func is None:
+            return None
+        return CommandThrottle().coalesce_key(_command_name(handler_func, parsed), handler_func, event, parsed)
+    
+    async def reply_coalesced(self, event):
+        """合并进来的请求在第一个请求处理完成后收到一条提示。"""
+        self._metrics.increment("commands_coalesced")
+        await event.reply([Text(text=COALESCED_MESSAGE)])
     
     async def _try_handle_command_msg(self, event):
-        # 检查消息类型并确定是否需要@检查
-        if isinstance(event, GroupMessageEvent):
-            # 群消息需要检查是否@了机器人
-            has_at = any(isinstance(msg, At) and str(msg.qq) == str(CommandContext().user_info["user_id"]) 
-                        for msg in event.message)
-            
-            if not has_at:
-                return False
-        elif isinstance(event, PrivateMessageEvent):
-            # 私聊消息直接处理，不需要@检查
-            pass
-        else:
-            # 不支持的事件类型
-            return False
+        self._metrics.increment("events")
+        # 所有群消息（包括不是指令的）都记录下来，之后引用这条消息的指令不需要再调用 get_msg
+        self._recent_messages.add(event)
         
-        # 提取指令和参数
-        is_private = isinstance(event, PrivateMessageEvent)
-        command, args = self._extract_command_and_args(event.message, is_private)
-        if not command:
+        parsed, handler_func = self._route(event)
+        if handler_func is None:
             return False
         
-        # 尝试使用所有注册的处理器处理指令
-        for handler_class in HandlerRegistry.get_all_handlers():
-            # 检查处理器的聊天类型是否与当前事件匹配
-            handler_chat_type = getattr(handler_class, "_chat_type", "both")
-            if handler_chat_type == "group" and not isinstance(event, GroupMessageEvent):
-                continue
-            if handler_chat_type == "private" and not isinstance(event, PrivateMessageEvent):
-                continue
-            
-            handler_key = handler_class.__name__
-            if handler_key not in self._handler_instances:
-                self._handler_instances[handler_key] = handler_class()
-            
-            handler = self._handler_instances[handler_key]
-            
-            if await handler.handle(event, command, args):
-                return True
-        
-        return False
\ No newline at end of file
+        await run_command(handler_func, event, parsed)
+        return True
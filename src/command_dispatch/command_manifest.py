@@ -0,0 +1,129 @@
+import ast
+import os
+
+# 指令清单：启动时静态解析 handlers 目录下的处理器文件，记录每个处理器的指令信息，不需要导入处理器模块
+# 解析所有处理器文件约需 35 毫秒（见 benchmarks/bench_startup.py），缓存到文件并不能加快启动，因此每次启动都重新解析
+
+HANDLERS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'handlers'))
+
+
+class ManifestParseError(Exception):
+    pass
+
+
+# 清单中的处理器信息，格式:
+# {"module": "handlers.help.help_handler", "class_name": "HelpHandler", "category": "帮助", "chat_type": "both",
+#  "commands": [{"method": "_handle_help", "names": ["help"], "usage": "", "description": ""}]}
+def load_command_manifest(handlers_dir=None):
+    """解析处理器文件，生成指令清单。
+
+    Returns:
+        tuple: (处理器信息列表, 需要在启动时直接导入的模块列表)
+            无法静态解析的处理器文件会放到第二个列表中，按原来的方式导入后注册
+    """
+    handlers_dir = handlers_dir or HANDLERS_DIR
+    handlers = []
+    eager_modules = []
+
+    for root, dirs, filenames in os.walk(handlers_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.py') or filename.startswith('__'):
+                continue
+
+            file_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(file_path, handlers_dir)
+            module = "handlers." + relative_path[:-len('.py')].replace(os.sep, '.')
+            try:
+                handlers.extend(_scan_handler_file(file_path, module))
+            except ManifestParseError as e:
+                print(f"无法静态解析 {file_path}，启动时直接导入: {e}")
+                eager_modules.append(module)
+
+    return handlers, eager_modules
+
+
+def _scan_handler_file(file_path, module):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        source = f.read()
+
+    try:
+        tree = ast.parse(source, filename=file_path)
+    except SyntaxError as e:
+        raise ManifestParseError(str(e))
+
+    handlers = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        register_call = _find_decorator(node, "register_handler")
+        if register_call is None:
+            continue
+
+        category, chat_type = _call_arguments(register_call, ("category", "chat_type"), ("通用", "both"))
+        handlers.append({
+            "module": module,
+            "class_name": node.name,
+            "category": category,
+            "chat_type": chat_type,
+            "commands": _scan_commands(node),
+        })
+
+    # 没有使用装饰器、而是直接调用 HandlerRegistry.register 的文件无法静态解析
+    if not handlers and "HandlerRegistry.register(" in source:
+        raise ManifestParseError("handler is registered without @register_handler")
+    return handlers
+
+
+def _scan_commands(class_node):
+    commands = []
+    for node in class_node.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        command_call = _find_decorator(node, "command")
+        if command_call is None:
+            continue
+
+        names = [_literal(arg) for arg in command_call.args]
+        usage, description = _call_arguments(command_call, ("usage", "description"), ("", ""), skip_positional=True)
+        commands.append({
+            "method": node.name,
+            "names": names,
+            "usage": usage,
+            "description": description,
+        })
+
+    # 从其他处理器继承得到的指令无法从当前类的定义中看出
+    if any(not (isinstance(base, ast.Name) and base.id == "CommandHandlerBase") for base in class_node.bases):
+        raise ManifestParseError(f"{class_node.name} inherits from a class other than CommandHandlerBase")
+    return commands
+
+
+def _find_decorator(node, name):
+    for decorator in node.decorator_list:
+        if not isinstance(decorator, ast.Call):
+            continue
+        func = decorator.func
+        if isinstance(func, ast.Name) and func.id == name:
+            return decorator
+        if isinstance(func, ast.Attribute) and func.attr == name:
+            return decorator
+    return None
+
+
+def _call_arguments(call, names, defaults, skip_positional=False):
+    values = dict(zip(names, defaults))
+    if not skip_positional:
+        for name, arg in zip(names, call.args):
+            values[name] = _literal(arg)
+    for keyword in call.keywords:
+        if keyword.arg in values:
+            values[keyword.arg] = _literal(keyword.value)
+    return tuple(values[name] for name in names)
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        raise ManifestParseError(f"decorator argument is not a literal at line {node.lineno}")
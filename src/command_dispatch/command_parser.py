@@ -0,0 +1,90 @@
+import contextvars
+
+from napcat import GroupMessageEvent, PrivateMessageEvent
+from napcat import At, Reply, Text
+from command_dispatch.command_ctx import CommandContext
+
+# 解析后的指令
+class ParsedCommand:
+    __slots__ = ("command", "args", "reply_id", "mentions")
+
+    def __init__(self, command, args, reply_id=None, mentions=()):
+        self.command = command
+        self.args = args
+        self.reply_id = reply_id      # 引用的消息ID，没有引用时为 None
+        self.mentions = mentions      # 除机器人以外被@的QQ号（字符串）
+
+    def __repr__(self):
+        return (f"ParsedCommand(command={self.command!r}, args={self.args!r}, "
+                f"reply_id={self.reply_id!r}, mentions={self.mentions!r})")
+
+
+# 当前正在处理的指令，由分发器在调用处理函数前设置，每个任务独立
+_current_command = contextvars.ContextVar("current_command", default=None)
+
+
+def get_current_command():
+    """获取当前正在处理的指令，不在分发流程中时返回 None"""
+    return _current_command.get()
+
+
+def set_current_command(parsed_command):
+    return _current_command.set(parsed_command)
+
+
+# 指令解析器：一次遍历消息段完成@检查、文本提取、引用和@列表收集
+class CommandParser:
+    def __init__(self):
+        self._self_id = None
+
+    def _get_self_id(self):
+        # 机器人QQ号在运行期间不变，只在第一次使用时读取并转换为字符串
+        if self._self_id is None:
+            self._self_id = str(CommandContext().user_info["user_id"])
+        return self._self_id
+
+    def parse(self, event):
+        """解析消息事件。
+
+        群消息只处理@了机器人的消息，并且只提取@之后的文本；私聊消息提取全部文本。
+
+        Returns:
+            ParsedCommand: 解析结果，消息不是发给机器人的或者没有指令时返回 None
+        """
+        if isinstance(event, GroupMessageEvent):
+            is_private = False
+        elif isinstance(event, PrivateMessageEvent):
+            is_private = True
+        else:
+            return None
+
+        self_id = self._get_self_id()
+        after_at = is_private
+        text_content = []
+        reply_id = None
+        mentions = []
+
+        for msg_detail in event.message:
+            if isinstance(msg_detail, Text):
+                if after_at:
+                    text_content.append(msg_detail.text)
+            elif isinstance(msg_detail, At):
+                qq = str(msg_detail.qq)
+                if qq == self_id:
+                    after_at = True
+                else:
+                    mentions.append(qq)
+            elif isinstance(msg_detail, Reply):
+                if reply_id is None:
+                    reply_id = msg_detail.id
+
+        # 群消息没有@机器人，直接忽略
+        if not after_at:
+            return None
+
+        # 合并文本内容并分割指令和参数
+        parts = ''.join(text_content).split()
+        if not parts:
+            return None
+
+        return ParsedCommand(parts[0], parts[1:], reply_id, tuple(mentions))
@@ -0,0 +1,155 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+from napcat import GroupMessageEvent
+
+from command_dispatch.metrics import CommandMetrics
+
+# 令牌桶最多保存的键数，超过后淘汰最久未使用的键
+MAX_LIMITER_KEYS = 10000
+
+
+# 合并执行时，其他请求在结果发送后收到的提示（结果只发送一次，由 EventWorkerPool 在第一个请求处理完成后回复）
+COALESCED_MESSAGE = "相同的请求正在处理，已合并执行，结果见上方"
+
+
+def throttled_message(command, retry_after):
+    return f"指令 {command} 使用过于频繁，请 {math.ceil(retry_after)} 秒后再试"
+
+
+class TokenBucketLimiter:
+    """按键限流的令牌桶。
+
+    每个键的桶容量为 capacity，每 period 秒补满一次。桶按最后使用时间排序，
+    闲置超过 period 秒的桶已经补满，与不存在的桶等价，可以直接删除，因此每次操作均摊 O(1)。
+    """
+
+    def __init__(self, capacity, period, max_keys=MAX_LIMITER_KEYS):
+        self._capacity = capacity
+        self._period = period
+        self._rate = capacity / period
+        self._max_keys = max_keys
+        self._buckets = OrderedDict()  # 格式: {key: [剩余令牌数, 更新时间, 是否已提示过用户]}
+
+    def acquire(self, key):
+        """尝试取一个令牌。
+
+        Returns:
+            tuple: (需要等待的秒数，取到令牌时为 0, 是否为本轮限流的第一次拒绝)
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self._capacity, now, False]
+        else:
+            bucket[0] = min(self._capacity, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        self._evict(now)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return 0.0, False
+
+        first_rejection = not bucket[2]
+        bucket[2] = True
+        return (1 - bucket[0]) / self._rate, first_rejection
+
+    def _evict(self, now):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self._max_keys and now - bucket[1] < self._period:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SingleFlight:
+    """合并并发的相同请求：同一个键同时只执行一次，执行期间到达的请求等待并共享同一个结果。"""
+
+    def __init__(self):
+        self._in_flight = {}  # 格式: {key: asyncio.Future}
+
+    def __contains__(self, key):
+        return key in self._in_flight
+
+    async def run(self, key, func, *args, **kwargs):
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他请求等待时，取出异常避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+
+# 指令限流单例类，处理 @CommandHandlerBase.command 中声明的限流、冷却，并为合并执行计算请求的键
+class CommandThrottle:
+    _instance = None
+    _limiters = {}  # 格式: {(command_name, scope, capacity, period): TokenBucketLimiter}
+    _enabled = True
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def set_enabled(self, enabled):
+        """开启或关闭限流（例如在基准测试中关闭），合并执行不受影响。"""
+        self._enabled = enabled
+        self._limiters.clear()
+
+    def acquire(self, command_name, handler_func, event):
+        """检查处理函数声明的所有限流规则。
+
+        Returns:
+            tuple: (需要等待的秒数，未被限流时为 0, 是否需要提示用户)
+        """
+        if not self._enabled:
+            return 0.0, False
+        for scope, capacity, period in getattr(handler_func, "_rate_limits", ()):
+            # 每条规则一个令牌桶，同一范围的频率限制和冷却（例如群聊限流和群聊冷却）分别计算
+            limiter_key = (command_name, scope, capacity, period)
+            limiter = self._limiters.get(limiter_key)
+            if limiter is None:
+                limiter = self._limiters[limiter_key] = TokenBucketLimiter(capacity, period)
+
+            retry_after, first_rejection = limiter.acquire(self._scope_key(scope, event))
+            if retry_after:
+                CommandMetrics().increment("commands_throttled")
+                return retry_after, first_rejection
+        return 0.0, False
+
+    def coalesce_key(self, command_name, handler_func, event, parsed):
+        """声明了 coalesce 的指令返回请求的键（同一群聊/私聊用户、参数和引用的消息都相同时键相同），其他指令返回 None。
+
+        同一群聊的事件在 EventWorkerPool 中串行处理，合并必须在事件进入队列之前进行，由分发器在提交事件时调用。
+        """
+        if not getattr(handler_func, "_coalesce", False):
+            return None
+        return (command_name, self._scope_key("group", event), tuple(parsed.args), parsed.reply_id)
+
+    @staticmethod
+    def _scope_key(scope, event):
+        # 私聊没有群号，按用户限流
+        if scope == "group" and isinstance(event, GroupMessageEvent):
+            return ("group", event.group_id)
+        return ("user", event.user_id)
@@ -0,0 +1,98 @@
+import asyncio
+from collections import deque
+
+from napcat import GroupMessageEvent, PrivateMessageEvent
+
+# 事件工作池：有界并发处理消息事件
+# - 同一群聊（私聊按用户）的事件按到达顺序串行处理
+# - 不同群聊/用户之间并发处理，总并发数受 max_concurrency 限制
+# - 待处理事件数达到 max_pending 时 submit 会阻塞，从而对事件读取形成背压
+# - 提供 coalesce_key 时，在事件进入串行队列之前合并相同的请求（同一群聊的事件串行处理，到了处理函数中已经无法合并）：
+#   与排队中或处理中的事件键相同时，该事件在队列中轮到时不调用 handler，而是调用 on_coalesced，回复仍按到达顺序发送
+class EventWorkerPool:
+    def __init__(self, handler, max_concurrency=8, max_pending=1000, coalesce_key=None, on_coalesced=None):
+        self._handler = handler
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._pending_slots = asyncio.Semaphore(max_pending)
+        self._key_queues = {}  # 格式: {ordering_key: deque[(event, coalesce_key, 是否合并到之前的请求)]}
+        self._coalesce_key = coalesce_key
+        self._on_coalesced = on_coalesced
+        self._in_flight_keys = set()  # 排队中或处理中、会被执行的请求的 coalesce_key
+        self._tasks = set()
+        self._closed = False
+
+    @staticmethod
+    def _ordering_key(event):
+        if isinstance(event, GroupMessageEvent):
+            return ("group", event.group_id)
+        if isinstance(event, PrivateMessageEvent):
+            return ("private", event.user_id)
+        return ("other", None)
+
+    async def submit(self, event):
+        """提交事件，队列已满时等待空位。"""
+        if self._closed:
+            raise Exception("event worker pool is closed")
+
+        await self._pending_slots.acquire()
+
+        coalesce_key = self._coalesce_key(event) if self._coalesce_key is not None else None
+        coalesced = coalesce_key in self._in_flight_keys
+        if coalesce_key is not None and not coalesced:
+            self._in_flight_keys.add(coalesce_key)
+
+        # 请求的合并范围与排队的范围相同（同一群聊或同一私聊用户），合并进来的事件排在被合并的请求之后
+        key = self._ordering_key(event)
+        queue = self._key_queues.get(key)
+        if queue is not None:
+            # 该群聊/用户已有事件在处理，排队等待以保证顺序
+            queue.append((event, coalesce_key, coalesced))
+            return
+
+        self._key_queues[key] = deque([(event, coalesce_key, coalesced)])
+        task = asyncio.create_task(self._drain_key(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain_key(self, key):
+        queue = self._key_queues[key]
+        try:
+            while queue:
+                event, coalesce_key, coalesced = queue.popleft()
+                try:
+                    if coalesced:
+                        # 被合并的请求已经处理完成（它排在前面），只回复提示
+                        await self._on_coalesced(event)
+                    else:
+                        async with self._concurrency:
+                            await self._handler(event)
+                except Exception as e:
+                    print(f"处理事件时出错: {e}")
+                finally:
+                    if coalesce_key is not None and not coalesced:
+                        self._in_flight_keys.discard(coalesce_key)
+                    self._pending_slots.release()
+        finally:
+            del self._key_queues[key]
+
+    def pending_count(self):
+        return sum(len(queue) for queue in self._key_queues.values()) + len(self._tasks)
+
+    async def drain(self, timeout=None):
+        """停止接收新事件，并等待已提交的事件全部处理完成。"""
+        self._closed = True
+        if not self._tasks:
+            return
+
+        try:
+            await asyncio.wait_for(self._wait_all(), timeout)
+        except asyncio.TimeoutError:
+            print(f"等待事件处理超时，取消剩余 {len(self._tasks)} 个任务")
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _wait_all(self):
+        # 处理过程中可能有任务结束、新任务产生，循环直到全部完成
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -1,7 +1,11 @@
+import os
+import sys
+
 # 全局处理器注册器
 class HandlerRegistry:
     _instance = None
     _handlers = []
+    _handler_keys = set()  # 已注册处理器的 (源文件, 类名)
     
     def __new__(cls):
         if cls._instance is None:
@@ -14,8 +18,21 @@ class HandlerRegistry:
         handler_class._category = category
         handler_class._chat_type = chat_type
         
-        if handler_class not in cls._handlers:
-            cls._handlers.append(handler_class)
+        # 同一个处理器文件可能以不同的模块名被导入两次
+        # （例如 essence.essence_handler 和 handlers.essence.essence_handler），只注册第一次导入的类
+        handler_key = cls._handler_key(handler_class)
+        if handler_key in cls._handler_keys:
+            return
+        
+        cls._handler_keys.add(handler_key)
+        cls._handlers.append(handler_class)
+    
+    @staticmethod
+    def _handler_key(handler_class):
+        module = sys.modules.get(handler_class.__module__)
+        module_file = getattr(module, "__file__", None)
+        source = os.path.abspath(module_file) if module_file else handler_class.__module__
+        return source, handler_class.__qualname__
     
     @classmethod
     def get_all_handlers(cls):
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+
+# 耗时直方图的桶上界（秒），从 0.1ms 到 100s，每个数量级 6 个桶
+LATENCY_BUCKETS = tuple(
+    round(mantissa * 10.0 ** exponent, 6)
+    for exponent in range(-4, 2)
+    for mantissa in (1, 1.5, 2, 3, 5, 7)
+) + (100.0,)
+
+# 指标族，格式: {family: (Prometheus 指标名前缀, 标签名, 说明)}
+METRIC_FAMILIES = {
+    "command": ("yww_command", ("command", "chat_type"), "指令处理耗时"),
+    "napcat_api": ("yww_napcat_api", ("api",), "NapCat API 调用耗时"),
+    "db": ("yww_db", ("operation",), "数据库操作耗时（含排队时间）"),
+}
+
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图，记录一次观测只需要一次二分查找和几次加法。"""
+
+    __slots__ = ("bucket_counts", "count", "errors", "total", "max")
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, elapsed, error=False):
+        self.bucket_counts[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """根据分桶估算分位数，在所在桶内线性插值。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(LATENCY_BUCKETS):
+                    return self.max
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = min(LATENCY_BUCKETS[index], self.max)
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+
+
+class MetricTimer:
+    """计时上下文管理器，退出时记录耗时，代码块抛出异常时同时记为一次错误。"""
+
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._started, exc_type is not None)
+        return False
+
+
+# 指标单例类，所有观测都在事件循环线程中进行，不需要加锁
+class CommandMetrics:
+    _instance = None
+    _histograms = {}  # 格式: {family: {labels: LatencyHistogram}}
+    _counters = {}  # 格式: {name: count}
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def histogram(self, family, *labels):
+        """获取（必要时创建）指定指标族和标签值的直方图。"""
+        histograms = self._histograms.setdefault(family, {})
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = LatencyHistogram()
+        return histogram
+
+    def observe(self, family, labels, elapsed, error=False):
+        self.histogram(family, *labels).observe(elapsed, error)
+
+    def timer(self, family, *labels):
+        """用法: with CommandMetrics().timer("napcat_api", "get_msg"): ..."""
+        return MetricTimer(self.histogram(family, *labels))
+
+    def increment(self, name, amount=1):
+        self._counters[name] = self._counters.get(name, 0) + amount
+
+    def reset(self):
+        self._histograms.clear()
+        self._counters.clear()
+
+    def snapshot(self):
+        """获取所有指标的汇总信息。
+
+        Returns:
+            dict: {"counters": {name: count}, "histograms": {family: {labels: {count, errors, avg, p50, p95, p99, max}}}}
+        """
+        histograms = {}
+        for family, series in self._histograms.items():
+            histograms[family] = {
+                labels: {
+                    "count": histogram.count,
+                    "errors": histogram.errors,
+                    "avg": histogram.total / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                    "max": histogram.max,
+                }
+                for labels, histogram in series.items()
+            }
+        return {"counters": dict(self._counters), "histograms": histograms}
+
+    def render_prometheus(self):
+        """按 Prometheus 文本格式导出所有指标。"""
+        lines = []
+        for name in sorted(self._counters):
+            metric_name = f"yww_{name}_total"
+            lines.append(f"# TYPE {metric_name} counter")
+            lines.append(f"{metric_name} {self._counters[name]}")
+
+        for family, (prefix, label_names, help_text) in METRIC_FAMILIES.items():
+            series = self._histograms.get(family)
+            if not series:
+                continue
+            duration_name = f"{prefix}_duration_seconds"
+            errors_name = f"{prefix}_errors_total"
+            lines.append(f"# HELP {duration_name} {help_text}")
+            lines.append(f"# TYPE {duration_name} histogram")
+            for labels, histogram in sorted(series.items()):
+                label_text = ",".join(
+                    f'{label_name}="{_escape_label(value)}"' for label_name, value in zip(label_names, labels)
+                )
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{duration_name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                lines.append(f'{duration_name}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+                lines.append(f"{duration_name}_sum{{{label_text}}} {histogram.total:.6f}")
+                lines.append(f"{duration_name}_count{{{label_text}}} {histogram.count}")
+            lines.append(f"# TYPE {errors_name} counter")
+            for labels, histogram in sorted(series.items()):
+                label_text = ",".join(
+                    f'{label_name}="{_escape_label(value)}"' for label_name, value in zip(label_names, labels)
+                )
+                lines.append(f"{errors_name}{{{label_text}}} {histogram.errors}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+async def dump_metrics_periodically(path, interval):
+    """定期导出指标，先写入临时文件再替换，避免读到不完整的内容。"""
+    metrics = CommandMetrics()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(metrics.render_prometheus())
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"导出指标到 {path} 时出错: {e}")
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
+
+from napcat.exceptions import NapCatStateError
+
+from command_dispatch.command_ctx import CommandContext
+from command_dispatch.command_throttle import SingleFlight
+from command_dispatch.metrics import CommandMetrics
+
+# 一次 API 调用的总时限（秒），包括排队、所有重试和重试前的等待
+API_TIMEOUT = 30
+# 单次尝试的时限（秒），超时后读接口会重试
+API_ATTEMPT_TIMEOUT = 10
+# 同时进行中的 API 调用数上限，超过时排队等待
+API_MAX_CONCURRENCY = 16
+# 读接口（get_ 开头）失败后的重试次数，发送消息等写接口不重试，避免重复发送
+API_READ_RETRIES = 2
+# 重试等待时间：在 [0, min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * 2^n)) 中随机选取，错开同时失败的请求
+API_RETRY_BASE_DELAY = 0.5
+API_RETRY_MAX_DELAY = 5
+# 需要缓存结果的接口，格式: {api: 有效期（秒）}
+API_CACHE_TTL = {
+    "get_msg": 300,
+    "get_login_info": 3600,
+}
+# 缓存最多保存的结果数，超过后淘汰最久未使用的结果
+API_CACHE_MAX_ENTRIES = 2048
+
+# 可以重试的错误：超时、连接断开和客户端尚未连接（正在重连）
+RETRYABLE_ERRORS = (asyncio.TimeoutError, ConnectionError, NapCatStateError)
+
+
+# NapCat API 访问层单例类，处理器通过它调用 NapCat API，不直接使用 CommandContext().client
+# - 每次调用有总时限，单次尝试超时或连接出错时，读接口按指数退避加随机抖动重试
+# - 限制同时进行中的调用数，避免大量指令同时到达时压垮 NapCat
+# - API_CACHE_TTL 中的接口缓存结果，并发的相同请求只调用一次
+# - 所有调用共用 CommandContext 中的同一个客户端（同一条 WebSocket 连接）
+# - 用法与客户端相同: await NapCatApi().get_msg(message_id=message_id)
+class NapCatApi:
+    _instance = None
+    _semaphore = None
+    _semaphore_loop = None
+    _cache = OrderedDict()  # 格式: {(api, params): (过期时间, 结果)}
+    _cache_stats = {}  # 格式: {api: [命中次数, 未命中次数]}
+    _in_flight = SingleFlight()
+    _metrics = CommandMetrics()
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __getattr__(self, action):
+        if action.startswith("_"):
+            raise AttributeError(action)
+
+        async def api_call(**params):
+            return await self.call(action, params)
+
+        return api_call
+
+    async def call(self, action, params=None, timeout=None):
+        """调用 NapCat API。
+
+        Args:
+            action: API 名称，例如 get_msg
+            params: API 参数
+            timeout: 总时限（秒），默认为 API_TIMEOUT
+
+        Returns:
+            API 返回的数据，缓存的结果由所有调用方共享，不要修改
+        """
+        params = params or {}
+        timeout = API_TIMEOUT if timeout is None else timeout
+        ttl = API_CACHE_TTL.get(action)
+        if ttl is None:
+            return await self._call(action, params, timeout)
+
+        key = (action, tuple(sorted(params.items())))
+        stats = self._cache_stats.setdefault(action, [0, 0])
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            stats[0] += 1
+            self._metrics.increment("napcat_api_cache_hits")
+            return entry[1]
+        stats[1] += 1
+
+        # 并发的相同请求只调用一次，共享同一个结果
+        result = await self._in_flight.run(key, self._call, action, params, timeout)
+        if result is not None:
+            self._cache[key] = (time.monotonic() + ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > API_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+        return result
+
+    def invalidate(self, action=None):
+        """清除指定接口（默认所有接口）的缓存结果。"""
+        for key in [key for key in self._cache if action is None or key[0] == action]:
+            del self._cache[key]
+
+    def cache_stats(self):
+        """获取各接口缓存的命中情况。
+
+        Returns:
+            dict: {api: {"hits": 命中次数, "misses": 未命中次数}}
+        """
+        return {action: {"hits": hits, "misses": misses} for action, (hits, misses) in self._cache_stats.items()}
+
+    async def _call(self, action, params, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        retries = API_READ_RETRIES if action.startswith("get_") else 0
+        with self._metrics.timer("napcat_api", action):
+            for attempt in range(retries + 1):
+                try:
+                    return await self._attempt(action, params, deadline, retries > 0)
+                except RETRYABLE_ERRORS as e:
+                    delay = random.uniform(0, min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * 2 ** attempt))
+                    if attempt == retries or loop.time() + delay >= deadline:
+                        if isinstance(e, asyncio.TimeoutError):
+                            raise Exception(f"调用 NapCat API {action} 超时") from e
+                        raise
+                    self._metrics.increment("napcat_api_retries")
+                    print(f"调用 NapCat API {action} 失败，{delay:.1f} 秒后重试: {type(e).__name__}")
+                    await asyncio.sleep(delay)
+
+    async def _attempt(self, action, params, deadline, limit_attempt):
+        # 排队等待只受总时限限制，取得名额后单次尝试的时限才开始计算
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
+        await asyncio.wait_for(semaphore.acquire(), max(deadline - loop.time(), 0))
+        try:
+            remaining = deadline - loop.time()
+            timeout = min(API_ATTEMPT_TIMEOUT, remaining) if limit_attempt else remaining
+            return await asyncio.wait_for(getattr(CommandContext().client, action)(**params), max(timeout, 0))
+        finally:
+            semaphore.release()
+
+    def _get_semaphore(self):
+        # 信号量与事件循环绑定，事件循环变化时（例如测试中多次 asyncio.run）重新创建
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(API_MAX_CONCURRENCY)
+            self._semaphore_loop = loop
+        return self._semaphore
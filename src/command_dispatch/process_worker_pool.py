@@ -0,0 +1,446 @@
+import asyncio
+import itertools
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from napcat import NapCatClient, NapCatEvent, GroupMessageEvent
+from napcat.exceptions import NapCatAPIError, NapCatStateError
+
+from command_dispatch.command_ctx import CommandContext
+from command_dispatch.command_dispatcher import CommandDispatcher
+from command_dispatch.event_worker_pool import EventWorkerPool
+from command_dispatch.metrics import CommandMetrics, dump_metrics_periodically
+
+# 工作进程退出时等待未完成指令的最长时间（秒）
+WORKER_SHUTDOWN_TIMEOUT = 30
+# 工作进程意外退出后，等待多久（秒）重新启动，期间分配给它的事件被丢弃
+WORKER_RESTART_DELAY = 5
+
+# 主进程执行 API 调用出错时，按异常类名在工作进程中重新抛出同类异常，NapCatApi 据此判断是否重试
+# 不在表中的异常统一抛出 Exception
+REMOTE_ERROR_TYPES = {
+    "TimeoutError": asyncio.TimeoutError,
+    "ConnectionError": ConnectionError,
+    "ConnectionResetError": ConnectionResetError,
+    "ConnectionRefusedError": ConnectionRefusedError,
+    "ConnectionAbortedError": ConnectionAbortedError,
+    "BrokenPipeError": BrokenPipeError,
+    "NapCatStateError": NapCatStateError,
+    "NapCatAPIError": NapCatAPIError,
+}
+
+# 通道已关闭（进程已退出）时发送消息抛出的异常
+CHANNEL_CLOSED_ERRORS = (OSError, EOFError, ValueError)
+
+
+def shard_index(event, worker_count):
+    """按群号（私聊按 QQ 号）选择工作进程，同一群聊的事件总是交给同一个进程，重启后也不变。"""
+    if isinstance(event, GroupMessageEvent):
+        return int(event.group_id) % worker_count
+    return int(event.user_id) % worker_count
+
+
+# 进程间通道：包装 multiprocessing 的 Pipe 连接，供 asyncio 使用
+# - 后台线程阻塞读取消息，通过 call_soon_threadsafe 交给事件循环，通道关闭时回调 None
+# - 发送在单独的线程中执行，大消息不会阻塞事件循环，单线程保证发送顺序与调用顺序一致
+class ProcessChannel:
+    def __init__(self, conn):
+        self._conn = conn
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+    def start(self, on_message):
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read_loop, args=(loop, on_message), daemon=True).start()
+
+    def _read_loop(self, loop, on_message):
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                message = None
+            try:
+                loop.call_soon_threadsafe(on_message, message)
+            except RuntimeError:
+                # 事件循环已经关闭
+                return
+            if message is None:
+                return
+
+    async def send(self, message):
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._writer, self._conn.send, message)
+        except RuntimeError:
+            # close() 之后发送线程已经停止，与连接已关闭时一样抛出 CHANNEL_CLOSED_ERRORS 中的异常
+            raise EOFError("通道已关闭")
+        await future
+
+    def close(self):
+        self._writer.shutdown(wait=False)
+        self._conn.close()
+
+
+# 工作进程中使用的 NapCat 客户端代理
+# 所有 API 调用（包括 event.reply）通过通道发给主进程，由主进程的 NapCatClient 执行后返回结果
+class ProxyNapCatClient:
+    def __init__(self, channel, self_id):
+        self.self_id = self_id
+        self._channel = channel
+        self._call_ids = itertools.count(1)
+        self._pending = {}  # 格式: {call_id: asyncio.Future}
+
+    def __getattr__(self, action):
+        if action.startswith("_"):
+            raise AttributeError(action)
+
+        async def proxy_call(**kwargs):
+            return await self.call_action(action, kwargs)
+
+        return proxy_call
+
+    async def call_action(self, action, params=None):
+        params = dict(params or {})
+        # 消息段对象转换为 dict 后再跨进程传递
+        for key in ("message", "messages"):
+            if key in params:
+                params[key] = NapCatClient._normalize_message_for_send(params[key])
+
+        call_id = next(self._call_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        try:
+            await self._channel.send(("call", call_id, action, params))
+            return await future
+        finally:
+            self._pending.pop(call_id, None)
+
+    def resolve(self, call_id, result, error):
+        """设置调用结果，error 为 (异常类名, 错误信息)，调用成功时为 None。"""
+        future = self._pending.get(call_id)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(_remote_error(*error))
+        else:
+            future.set_result(result)
+
+    def fail_all(self, error):
+        """主进程断开时，让所有等待中的调用失败。"""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(error))
+
+
+def _remote_error(error_name, message):
+    error_type = REMOTE_ERROR_TYPES.get(error_name)
+    if error_type is None:
+        return Exception(f"{error_name}: {message}")
+    return error_type(message)
+
+
+# 多进程事件工作池：主进程只接收事件，按群号分发给多个工作进程处理
+# - 每个工作进程有自己的 CommandDispatcher 和 EventWorkerPool，同一群聊的事件只会进入同一个进程，按到达顺序处理
+# - 工作进程中的 NapCat API 调用通过 ProxyNapCatClient 转发回主进程执行
+# - 每个工作进程未处理完的事件数达到 max_pending 时 submit 会阻塞，从而对事件读取形成背压
+# - 工作进程意外退出时，它未处理完的事件丢失，WORKER_RESTART_DELAY 秒后重新启动，期间分配给它的事件被丢弃
+# - 接口与 EventWorkerPool 相同（submit/drain），可以直接替换
+class ProcessWorkerPool:
+    def __init__(self, client, user_info, worker_count, max_pending=1000, worker_options=None):
+        """
+        Args:
+            client: 主进程的 NapCatClient
+            user_info: 机器人的登录信息
+            worker_count: 工作进程数
+            max_pending: 每个工作进程未处理完的事件数上限
+            worker_options: 传给工作进程的配置，见 run_worker
+        """
+        self._client = client
+        self._user_info = user_info
+        self._worker_count = worker_count
+        self._max_pending = max_pending
+        self._worker_options = dict(worker_options or {})
+        self._processes = [None] * worker_count
+        self._channels = [None] * worker_count
+        self._alive = [False] * worker_count
+        self._pending_slots = []
+        self._pending_counts = [0] * worker_count
+        self._call_tasks = set()
+        self._restart_tasks = set()
+        self._metrics = CommandMetrics()
+        self._closed = False
+
+    async def start(self):
+        self._pending_slots = [asyncio.Semaphore(self._max_pending) for _ in range(self._worker_count)]
+        for index in range(self._worker_count):
+            self._start_worker(index)
+        print(f"已启动 {self._worker_count} 个工作进程")
+
+    def _start_worker(self, index):
+        # 使用 spawn 启动，工作进程不会继承主进程的事件循环和网络连接
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=run_worker,
+            args=(child_conn, index, self._worker_count, self._user_info, self._worker_options),
+            name=f"yww-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+
+        channel = ProcessChannel(parent_conn)
+        channel.start(lambda message: self._on_worker_message(index, channel, message))
+        self._processes[index] = process
+        self._channels[index] = channel
+        self._alive[index] = True
+
+    async def submit(self, event):
+        """将事件交给对应的工作进程，该进程的待处理事件已满时等待空位。
+
+        对应的工作进程正在重启时丢弃事件，不抛出异常。
+        """
+        if self._closed:
+            raise Exception("process worker pool is closed")
+
+        index = shard_index(event, self._worker_count)
+        await self._pending_slots[index].acquire()
+        if not self._alive[index]:
+            self._pending_slots[index].release()
+            self._metrics.increment("worker_events_dropped")
+            return
+        self._pending_counts[index] += 1
+        try:
+            await self._channels[index].send(("event", event.to_dict()))
+        except CHANNEL_CLOSED_ERRORS:
+            # 进程刚刚退出，还没有收到通道关闭的通知
+            self._metrics.increment("worker_events_dropped")
+            self._worker_exited(index)
+
+    def _on_worker_message(self, index, channel, message):
+        if channel is not self._channels[index]:
+            # 已经退出的旧进程的消息
+            return
+        if message is None:
+            self._worker_exited(index)
+            return
+
+        kind = message[0]
+        if kind == "done":
+            self._pending_counts[index] -= 1
+            self._pending_slots[index].release()
+        elif kind == "call":
+            task = asyncio.create_task(self._proxy_call(self._channels[index], *message[1:]))
+            self._call_tasks.add(task)
+            task.add_done_callback(self._call_tasks.discard)
+
+    def _worker_exited(self, index):
+        """工作进程退出（或通道断开）时释放它占用的名额，未关闭时稍后重新启动。"""
+        if not self._alive[index]:
+            return
+        self._alive[index] = False
+        # 该进程未处理完的事件已经丢失，释放名额，避免 submit 一直等待
+        lost = self._pending_counts[index]
+        for _ in range(lost):
+            self._pending_slots[index].release()
+        self._pending_counts[index] = 0
+        if self._closed:
+            return
+
+        print(f"工作进程 {index} 意外退出，{lost} 个事件未处理完，{WORKER_RESTART_DELAY} 秒后重新启动")
+        self._schedule_restart(index)
+
+    def _schedule_restart(self, index):
+        task = asyncio.create_task(self._restart_worker(index))
+        self._restart_tasks.add(task)
+        task.add_done_callback(self._restart_tasks.discard)
+
+    async def _restart_worker(self, index):
+        await asyncio.sleep(WORKER_RESTART_DELAY)
+        if self._closed:
+            return
+        process, channel = self._processes[index], self._channels[index]
+        channel.close()
+        await asyncio.get_running_loop().run_in_executor(None, process.join)
+        try:
+            self._start_worker(index)
+        except Exception as e:
+            print(f"重新启动工作进程 {index} 失败，{WORKER_RESTART_DELAY} 秒后重试: {e}")
+            self._schedule_restart(index)
+            return
+        self._metrics.increment("worker_restarts")
+        print(f"工作进程 {index} 已重新启动")
+
+    async def _proxy_call(self, channel, call_id, action, params):
+        try:
+            result = await getattr(self._client, action)(**params)
+            reply = ("result", call_id, result, None)
+        except Exception as e:
+            # 只传递异常类名和信息，工作进程中按类名重新抛出同类异常
+            reply = ("result", call_id, None, (type(e).__name__, str(e)))
+        try:
+            await channel.send(reply)
+        except CHANNEL_CLOSED_ERRORS:
+            # 工作进程已经退出
+            pass
+
+    def pending_count(self):
+        return sum(self._pending_counts)
+
+    async def drain(self, timeout=None):
+        """停止接收新事件，通知工作进程处理完已收到的事件后退出，并等待其退出。"""
+        self._closed = True
+        loop = asyncio.get_running_loop()
+        for task in list(self._restart_tasks):
+            task.cancel()
+        for channel in self._channels:
+            try:
+                await channel.send(("stop", timeout))
+            except CHANNEL_CLOSED_ERRORS:
+                pass
+
+        # 等待期间主进程仍需处理工作进程的 API 调用，join 放到线程中执行
+        join_timeout = None if timeout is None else timeout + 5
+        for index, process in enumerate(self._processes):
+            await loop.run_in_executor(None, process.join, join_timeout)
+            if process.is_alive():
+                print(f"工作进程 {index} 没有按时退出，强制结束")
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+
+        if self._call_tasks:
+            await asyncio.gather(*self._call_tasks, return_exceptions=True)
+        for channel in self._channels:
+            channel.close()
+
+
+def run_worker(conn, index, worker_count, user_info, options):
+    """工作进程入口。
+
+    Args:
+        conn: 与主进程通信的 Pipe 连接
+        index: 工作进程编号
+        worker_count: 工作进程总数
+        user_info: 机器人的登录信息
+        options: 配置，可以包含 admin_user_ids、max_concurrency、max_pending、
+            metrics_dump_path、metrics_dump_interval、auto_backup_interval、
+            auto_backup_concurrency、auto_backup_jitter、db_maintenance_interval、db_max_size、cold_archive_max_per_group，
+            以及与 multiprocessing.Pool 相同的 initializer、initargs（启动时在工作进程中调用一次）
+    """
+    # Ctrl+C 由主进程处理，主进程会通知工作进程处理完已收到的事件后退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if options.get("initializer") is not None:
+        options["initializer"](*options.get("initargs", ()))
+    asyncio.run(_worker_main(conn, index, worker_count, user_info, options))
+
+
+async def _worker_main(conn, index, worker_count, user_info, options):
+    channel = ProcessChannel(conn)
+    client = ProxyNapCatClient(channel, user_info.get("user_id"))
+    inbox = asyncio.Queue()
+
+    def on_message(message):
+        if message is not None and message[0] == "result":
+            # API 调用结果直接交给等待的调用，不经过事件队列，避免与事件排队互相等待
+            client.resolve(*message[1:])
+            return
+        if message is None:
+            client.fail_all("主进程已断开")
+        inbox.put_nowait(message)
+
+    channel.start(on_message)
+    command_ctx = CommandContext()
+    command_ctx.initialize(user_info, client, admin_user_ids=options.get("admin_user_ids", ()))
+    command_dispatcher = CommandDispatcher()
+
+    async def send_done():
+        try:
+            await channel.send(("done",))
+        except CHANNEL_CLOSED_ERRORS:
+            pass
+
+    async def handle(event):
+        try:
+            await command_dispatcher._try_handle_command_msg(event)
+        finally:
+            await send_done()
+
+    async def reply_coalesced(event):
+        # 合并进来的事件没有经过 handle，同样需要通知主进程释放待处理名额
+        try:
+            await command_dispatcher.reply_coalesced(event)
+        finally:
+            await send_done()
+
+    event_pool = EventWorkerPool(
+        handle,
+        max_concurrency=options.get("max_concurrency", 8),
+        max_pending=options.get("max_pending", 1000),
+        coalesce_key=command_dispatcher.coalesce_key,
+        on_coalesced=reply_coalesced
+    )
+    background_tasks = _start_background_tasks(index, worker_count, options)
+
+    timeout = WORKER_SHUTDOWN_TIMEOUT
+    try:
+        while True:
+            message = await inbox.get()
+            if message is None:
+                break
+            if message[0] == "stop":
+                timeout = message[1]
+                break
+            await event_pool.submit(NapCatEvent.from_dict(message[1], client=client))
+    finally:
+        await event_pool.drain(timeout=timeout)
+        for task in background_tasks:
+            task.cancel()
+        command_ctx.cleanup()
+        channel.close()
+
+
+def _start_background_tasks(index, worker_count, options):
+    tasks = []
+    metrics_dump_path = options.get("metrics_dump_path")
+    if metrics_dump_path:
+        # 每个工作进程只统计自己处理的指令，分别写入各自的文件
+        tasks.append(asyncio.create_task(dump_metrics_periodically(
+            _worker_file_path(metrics_dump_path, index), options.get("metrics_dump_interval", 60)
+        )))
+
+    if options.get("auto_backup_interval"):
+        # 每个工作进程只定时备份分配给自己的群聊，与手动备份精华在同一个进程中执行
+        from handlers.essence.essence_scheduler import EssenceBackupScheduler
+        scheduler = EssenceBackupScheduler(
+            options["auto_backup_interval"],
+            max_concurrency=options.get("auto_backup_concurrency", 4),
+            jitter=options.get("auto_backup_jitter", 300),
+            group_filter=lambda group_id: int(group_id) % worker_count == index
+        )
+        tasks.append(asyncio.create_task(scheduler.run()))
+
+    if options.get("db_maintenance_interval") and index == 0:
+        # 所有工作进程共用一个数据库，只在第一个工作进程中维护
+        tasks.append(asyncio.create_task(_run_db_maintenance(options)))
+    return tasks
+
+
+async def _run_db_maintenance(options):
+    # 等待一个维护间隔后再导入数据库模块，工作进程启动时不加载 peewee 和数据库
+    interval = options["db_maintenance_interval"]
+    await asyncio.sleep(interval)
+    from handlers.essence.essence_maintenance import EssenceMaintenance
+    maintenance = EssenceMaintenance(
+        interval,
+        max_db_size=options.get("db_max_size"),
+        max_archives_per_group=options.get("cold_archive_max_per_group")
+    )
+    await maintenance.run(initial_delay=0)
+
+
+def _worker_file_path(path, index):
+    # metrics.prom -> metrics.worker0.prom
+    root, dot, extension = path.rpartition(".")
+    if not dot or "/" in extension or "\\" in extension:
+        return f"{path}.worker{index}"
+    return f"{root}.worker{index}.{extension}"
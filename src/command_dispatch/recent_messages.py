@@ -0,0 +1,152 @@
+from collections import OrderedDict
+
+from napcat import GroupMessageEvent, Text
+
+from command_dispatch.metrics import CommandMetrics
+from command_dispatch.napcat_api import NapCatApi
+
+# 每个群聊最多保存的最近消息数，超过后丢弃最早的消息
+RECENT_MESSAGES_PER_GROUP = 200
+# 所有群聊的最近消息估算大小之和的上限（字节），超过后从最久没有新消息的群聊开始丢弃
+RECENT_MESSAGES_MAX_BYTES = 16 * 1024 * 1024
+# 每条消息除消息段以外的估算占用（元组、字段和字典项，字节）
+RECENT_MESSAGE_OVERHEAD = 400
+# 每个消息段除文本以外的估算占用（字节）
+RECENT_SEGMENT_OVERHEAD = 150
+
+
+def _normalize_id(value):
+    # 事件中的群号和消息 ID 是整数，引用消息段中的 ID 是字符串，统一转换为整数作为键
+    if type(value) is int:
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _estimate_size(segments):
+    size = RECENT_MESSAGE_OVERHEAD + RECENT_SEGMENT_OVERHEAD * len(segments)
+    for segment in segments:
+        if type(segment) is Text:
+            size += len(segment.text) * 2
+    return size
+
+
+def _segment_to_dict(segment):
+    # 消息段对象转换为 dict 时包含所有可选字段，去掉值为 None 的字段，与 NapCat 返回的格式一致
+    segment = dict(segment)
+    return {"type": segment["type"], "data": {k: v for k, v in segment["data"].items() if v is not None}}
+
+
+def _to_msg_info(record):
+    """将缓存的消息转换为与 get_msg 返回值相同格式的 dict，消息段只在这里转换为 dict。"""
+    message_id, message_seq, time, sender_id, sender_nick, segments, _ = record
+    return {
+        "message_id": message_id,
+        "message_seq": message_seq,
+        "time": time,
+        "sender": {"user_id": sender_id, "nickname": sender_nick},
+        "message": [_segment_to_dict(segment) for segment in segments],
+    }
+
+
+# 最近消息缓存单例类，由分发器在解析指令之前记录每条群消息
+# - 每个群聊一个环形缓冲区（按到达顺序，满了丢弃最早的消息），同时限制所有群聊的总内存
+# - 每条消息保存为元组 (message_id, message_seq, time, sender_id, sender_nick, segments, 估算大小)，
+#   只保留 get_msg 结果中处理器用到的字段；segments 直接引用事件中已解析的消息段（不可变），
+#   记录时不复制也不编码，每条群消息（大多不是指令）只需几个字段读取，命中时才转换为 dict
+# - 引用消息的指令（例如添加精华）通过 get_msg 优先从这里取消息，未命中时才调用 NapCat 的 get_msg
+# - 所有操作都在事件循环线程中进行，不需要加锁
+class RecentMessages:
+    _instance = None
+    _groups = OrderedDict()  # 格式: {group_id: OrderedDict{message_id: 消息元组}}，按最后一条消息的到达时间排序
+    _total_bytes = 0
+    hits = 0
+    misses = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._metrics = CommandMetrics()
+        return cls._instance
+
+    def add(self, event):
+        """记录一条群消息，其他类型的事件直接忽略。"""
+        if not isinstance(event, GroupMessageEvent):
+            return
+        # 每条群消息都会经过这里，事件中的 ID 通常已经是整数，只在不是整数时才调用 _normalize_id
+        message_id = event.message_id
+        if type(message_id) is not int:
+            message_id = _normalize_id(message_id)
+        group_id = event.group_id
+        if type(group_id) is not int:
+            group_id = _normalize_id(group_id)
+        segments = event.message
+        size = _estimate_size(segments)
+        sender = event.sender
+        if sender is not None:
+            record = (message_id, event.message_seq, event.time, sender.user_id, sender.nickname or "", segments, size)
+        else:
+            record = (message_id, event.message_seq, event.time, "", "", segments, size)
+
+        groups = self._groups
+        messages = groups.get(group_id)
+        if messages is None:
+            messages = groups[group_id] = OrderedDict()
+        else:
+            groups.move_to_end(group_id)
+        previous = messages.pop(message_id, None)
+        messages[message_id] = record
+        total_bytes = self._total_bytes + size
+        if previous is not None:
+            total_bytes -= previous[6]
+        if len(messages) > RECENT_MESSAGES_PER_GROUP:
+            total_bytes -= messages.popitem(last=False)[1][6]
+        self._total_bytes = total_bytes
+
+        while self._total_bytes > RECENT_MESSAGES_MAX_BYTES and self._groups:
+            oldest_group_id, oldest_messages = next(iter(self._groups.items()))
+            self._total_bytes -= oldest_messages.popitem(last=False)[1][6]
+            if not oldest_messages:
+                del self._groups[oldest_group_id]
+
+    def find(self, group_id, message_id):
+        """从缓存中查找消息，返回与 get_msg 相同格式的 dict，未命中时返回 None。"""
+        messages = self._groups.get(_normalize_id(group_id))
+        record = messages.get(_normalize_id(message_id)) if messages is not None else None
+        if record is None:
+            self.misses += 1
+            self._metrics.increment("recent_messages_misses")
+            return None
+        self.hits += 1
+        self._metrics.increment("recent_messages_hits")
+        return _to_msg_info(record)
+
+    async def get_msg(self, group_id, message_id):
+        """获取群聊中的一条消息，缓存未命中时调用 NapCat 的 get_msg。"""
+        msg_info = self.find(group_id, message_id)
+        if msg_info is None:
+            msg_info = await NapCatApi().get_msg(message_id=message_id)
+        return msg_info
+
+    def stats(self):
+        """获取缓存的使用情况。
+
+        Returns:
+            dict: {"groups": 群聊数, "messages": 消息数, "bytes": 估算大小,
+                   "hits": 命中次数, "misses": 未命中次数, "hit_rate": 命中率}
+        """
+        lookups = self.hits + self.misses
+        return {
+            "groups": len(self._groups),
+            "messages": sum(len(messages) for messages in self._groups.values()),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        self._groups.clear()
+        self._total_bytes = 0
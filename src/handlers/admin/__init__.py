@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Admin handlers package.
+"""
+
+from handlers.admin.admin_handler import AdminHandler
@@ -0,0 +1,114 @@
+from handlers.base.command_handler_common import *
+
+from napcat import Text, GroupMessageEvent
+
+# 指令统计中各指标族的显示名称
+METRIC_FAMILY_TITLES = {
+    "command": "指令",
+    "napcat_api": "NapCat API",
+    "db": "数据库",
+}
+
+
+# 管理指令处理器，只有机器人管理员以及群主、群管理员可以使用
+@register_handler(category="管理", chat_type="both")
+class AdminHandler(CommandHandlerBase):
+    def _has_permission(self, event):
+        if CommandContext().is_admin(event.user_id):
+            return True
+        if isinstance(event, GroupMessageEvent):
+            return getattr(event.sender, "role", None) in ("owner", "admin")
+        return False
+
+    @CommandHandlerBase.command("指令统计", "metrics",
+                               usage="指令统计 [prometheus]",
+                               description="查看各指令的调用次数、错误次数和耗时分位数，加 prometheus 参数导出 Prometheus 文本格式")
+    async def _handle_metrics(self, event, args: list):
+        if not self._has_permission(event):
+            await event.reply([Text(text="只有管理员可以使用该指令")])
+            return
+
+        metrics = CommandMetrics()
+        if args and args[0].lower() == "prometheus":
+            await event.reply([Text(text=metrics.render_prometheus())])
+            return
+
+        await event.reply([Text(text=self._format_metrics(metrics.snapshot()))])
+
+    @CommandHandlerBase.command("数据库状态", "dbstat",
+                               usage="数据库状态 [整理]",
+                               description="查看精华备份数据库的大小、空闲页和已回收的空间，加“整理”参数时立即回收空闲页（仅机器人管理员）")
+    async def _handle_database_status(self, event, args: list):
+        if not self._has_permission(event):
+            await event.reply([Text(text="只有管理员可以使用该指令")])
+            return
+
+        # 只在使用时导入，加载管理指令时不打开数据库
+        from handlers.essence.essence_maintenance import EssenceMaintenance, database_status
+        from handlers.essence.essence_models import db_executor
+        try:
+            reply_text = ""
+            if args and args[0] == "整理":
+                if not CommandContext().is_admin(event.user_id):
+                    await event.reply([Text(text="只有机器人管理员可以整理数据库")])
+                    return
+                result = await EssenceMaintenance(0).run_once()
+                reply_text += f"整理完成，回收 {_format_bytes(result['reclaimed_bytes'])}\n\n"
+            status = await db_executor.read(database_status)
+            reply_text += self._format_database_status(status, CommandMetrics().snapshot()["counters"])
+        except Exception as e:
+            reply_text = f"获取数据库状态失败：{str(e)}"
+        await event.reply([Text(text=reply_text)])
+
+    def _format_database_status(self, status, counters):
+        return (
+            "精华备份数据库：\n"
+            f"- 文件大小：{_format_bytes(status['file_bytes'])}（WAL {_format_bytes(status['wal_bytes'])}）\n"
+            f"- 数据占用：{_format_bytes(status['used_bytes'])}，共 {status['page_count']} 页，"
+            f"每页 {status['page_size']} 字节\n"
+            f"- 空闲页：{status['free_pages']} 页（{_format_bytes(status['free_pages'] * status['page_size'])}）\n"
+            f"- 增量回收：{'已开启' if status['auto_vacuum'] else '未开启（下次整理时转换）'}\n"
+            f"- 本次运行已回收：{_format_bytes(counters.get('db_reclaimed_bytes', 0))}，"
+            f"归档旧备份 {counters.get('db_archived_backups', 0)} 份\n"
+            f"- 冷归档：{status['archive_files']} 个文件，{_format_bytes(status['archive_bytes'])}"
+        )
+
+    def _format_metrics(self, snapshot):
+        counters = snapshot["counters"]
+        metrics_text = f"指令统计（共收到 {counters.get('events', 0)} 条消息）：\n"
+        recent_lookups = counters.get("recent_messages_hits", 0) + counters.get("recent_messages_misses", 0)
+        if recent_lookups:
+            hit_rate = counters.get("recent_messages_hits", 0) / recent_lookups
+            metrics_text += f"引用消息缓存命中率：{hit_rate:.0%}（共 {recent_lookups} 次）\n"
+
+        for family, title in METRIC_FAMILY_TITLES.items():
+            series = snapshot["histograms"].get(family)
+            if not series:
+                continue
+            metrics_text += f"\n【{title}】\n"
+            for labels, summary in sorted(series.items(), key=lambda item: -item[1]["count"]):
+                if not summary["count"]:
+                    continue
+                metrics_text += (
+                    f"- {' '.join(str(label) for label in labels)}：{summary['count']} 次"
+                    f"，错误 {summary['errors']} 次"
+                    f"，p50 {_format_seconds(summary['p50'])}"
+                    f"，p95 {_format_seconds(summary['p95'])}"
+                    f"，p99 {_format_seconds(summary['p99'])}\n"
+                )
+
+        return metrics_text
+
+
+def _format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.2f}GiB"
+
+
+def _format_seconds(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.1f}ms"
+    return f"{seconds:.2f}s"
@@ -4,7 +4,9 @@
 This module provides the base class for command handlers.
 """
 
-from napcat import GroupMessageEvent, PrivateMessageEvent
+from napcat import Reply, GroupMessageEvent, PrivateMessageEvent
+from command_dispatch.command_dispatcher import run_command
+from command_dispatch.command_parser import ParsedCommand
 
 
 class CommandHandlerBase:
@@ -28,21 +30,39 @@ class CommandHandlerBase:
                     self._command_handlers[normalized_name] = attr
     
     @classmethod
-    def command(cls, *command_names, usage="", description=""):
+    def command(cls, *command_names, usage="", description="",
+                user_rate_limit=None, group_rate_limit=None, cooldown=0, coalesce=False):
         """装饰器，用于标记方法为指令处理函数。
         
         Args:
             *command_names: 指令名称列表
             usage: 指令使用方法
             description: 指令描述
+            user_rate_limit: 每个用户的调用频率上限，格式为 (次数, 秒数)
+            group_rate_limit: 每个群聊的调用频率上限，格式为 (次数, 秒数)，私聊按用户计算
+            cooldown: 同一群聊两次调用之间的最短间隔（秒），私聊按用户计算
+            coalesce: 是否合并同一群聊（私聊为同一用户）中参数相同的并发请求，只执行一次。
+                合并在事件进入 EventWorkerPool 的串行队列之前进行，排队中或处理中的相同请求不再排队，
+                也不计入限流；结果只发送一次，合并进来的请求只收到一条提示，因此只用于结果发送到当前聊天、
+                重复执行没有额外作用的指令
             
         Returns:
             装饰后的函数
         """
+        rate_limits = []
+        if user_rate_limit:
+            rate_limits.append(("user", *user_rate_limit))
+        if group_rate_limit:
+            rate_limits.append(("group", *group_rate_limit))
+        if cooldown:
+            rate_limits.append(("group", 1, cooldown))
+        
         def decorator(func):
             func._command_names = command_names
             func._usage = usage
             func._description = description
+            func._rate_limits = tuple(rate_limits)
+            func._coalesce = coalesce
             return func
         return decorator
     
@@ -63,7 +83,8 @@ class CommandHandlerBase:
             
         normalized_command = command.lower()
         if normalized_command in self._command_handlers:
-            handler_func = self._command_handlers[normalized_command]
-            await handler_func(event, args)
+            # 与分发器使用相同的限流和统计流程（直接调用时不经过 EventWorkerPool，不合并请求）
+            reply_id = next((segment.id for segment in event.message if isinstance(segment, Reply)), None)
+            await run_command(self._command_handlers[normalized_command], event, ParsedCommand(command, args, reply_id))
             return True
         return False
\ No newline at end of file
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Database executor module.
+
+This module runs blocking peewee calls off the asyncio event loop.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from command_dispatch.metrics import CommandMetrics
+
+
+class DatabaseExecutor:
+    """数据库执行器。
+
+    写操作在专用的单个线程中串行执行，并自动包裹在 BEGIN IMMEDIATE 事务中
+    （开始时就获取写锁，多个进程同时写入时按 busy_timeout 等待，不会在读升级为写时直接报错）；
+    读操作在线程池中并发执行（需要数据库开启 WAL 模式，读写才不会互相阻塞）。
+    peewee 的连接是线程本地的，每个工作线程第一次使用时打开连接，之后一直复用。
+    建表和迁移等初始化在第一次执行数据库操作时于工作线程中完成，不阻塞事件循环。
+    """
+
+    def __init__(self, database, max_readers=4, initializer=None):
+        """初始化数据库执行器。
+
+        Args:
+            database: peewee 数据库实例
+            max_readers: 并发读线程数
+            initializer: 执行第一个数据库操作之前在工作线程中调用一次（例如建表和迁移），为 None 时不调用
+        """
+        self._database = database
+        self._initializer = initializer
+        self._initialized = initializer is None
+        self._init_lock = threading.Lock()
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._read_executor = ThreadPoolExecutor(max_workers=max_readers, thread_name_prefix="db-reader")
+        self._metrics = CommandMetrics()
+
+    def _ensure_initialized(self):
+        # 第一个操作所在的线程执行初始化，其他线程上的操作等待其完成；初始化失败时下一个操作重试
+        if self._initialized:
+            return
+        with self._init_lock:
+            if not self._initialized:
+                self._initializer()
+                self._initialized = True
+
+    def _run(self, func, args, kwargs, atomic):
+        self._ensure_initialized()
+        self._database.connect(reuse_if_open=True)
+        if atomic:
+            with self._database.atomic("IMMEDIATE"):
+                return func(*args, **kwargs)
+        return func(*args, **kwargs)
+
+    async def write(self, func, *args, **kwargs):
+        """在写线程中以事务方式执行 func，返回其结果。"""
+        loop = asyncio.get_running_loop()
+        with self._metrics.timer("db", _operation_name("write", func)):
+            return await loop.run_in_executor(
+                self._write_executor,
+                functools.partial(self._run, func, args, kwargs, True)
+            )
+
+    async def maintenance(self, func, *args, **kwargs):
+        """在写线程中执行 func，不包裹事务（用于检查点等不能在事务中执行的操作），与其他写操作串行。"""
+        loop = asyncio.get_running_loop()
+        with self._metrics.timer("db", _operation_name("maintenance", func)):
+            return await loop.run_in_executor(
+                self._write_executor,
+                functools.partial(self._run, func, args, kwargs, False)
+            )
+
+    async def read(self, func, *args, **kwargs):
+        """在读线程池中执行 func，返回其结果。"""
+        loop = asyncio.get_running_loop()
+        with self._metrics.timer("db", _operation_name("read", func)):
+            return await loop.run_in_executor(
+                self._read_executor,
+                functools.partial(self._run, func, args, kwargs, False)
+            )
+
+    def shutdown(self, wait=True):
+        """关闭执行器，等待已提交的操作完成。"""
+        self._write_executor.shutdown(wait=wait)
+        self._read_executor.shutdown(wait=wait)
+
+
+def _operation_name(kind, func):
+    return f"{kind}:{getattr(func, '__name__', type(func).__name__)}"
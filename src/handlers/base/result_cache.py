@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Result cache module.
+
+This module provides an in-memory LRU cache with TTL and a memory cap for command results.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """粗略估算对象占用的内存字节数（递归统计 dict、list、tuple 和字符串）。"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += estimate_size(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+class ResultCache:
+    """指令结果缓存。
+
+    按 LRU 淘汰，同时限制条目数和估算的总内存，条目超过 TTL 后失效。
+    每个条目属于一个命名空间（例如群号），写操作通过 invalidate 使整个命名空间的缓存失效。
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=600):
+        """初始化结果缓存。
+
+        Args:
+            max_entries: 最多缓存的条目数
+            max_bytes: 所有条目估算大小之和的上限
+            ttl: 条目有效期（秒）
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries = OrderedDict()  # 格式: {key: (namespace, value, size, expire_time)}
+        self._namespace_keys = {}      # 格式: {namespace: set(key)}
+        self._generations = {}         # 格式: {namespace: 失效次数}
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self, namespace):
+        """获取命名空间当前的版本号，在查询数据之前调用，并在 put 时传回。"""
+        return self._generations.get(namespace, 0)
+
+    def get(self, key):
+        """获取缓存，未命中或已过期时返回 None。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry[3] < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, namespace, generation, size=None):
+        """写入缓存。
+
+        查询期间命名空间被 invalidate 过（版本号变化）时不写入，避免缓存过期的数据。
+        """
+        if generation != self.generation(namespace):
+            return
+
+        if size is None:
+            size = estimate_size(value)
+        if size > self._max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (namespace, value, size, time.monotonic() + self._ttl)
+        self._namespace_keys.setdefault(namespace, set()).add(key)
+        self._total_bytes += size
+
+        while len(self._entries) > self._max_entries or self._total_bytes > self._max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate(self, namespace):
+        """使命名空间下的所有缓存失效。"""
+        self._generations[namespace] = self.generation(namespace) + 1
+        for key in list(self._namespace_keys.get(namespace, ())):
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._namespace_keys.clear()
+        self._total_bytes = 0
+
+    def _remove(self, key):
+        namespace, _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        keys = self._namespace_keys.get(namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespace_keys[namespace]
+
+    def stats(self):
+        """获取缓存统计信息。"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
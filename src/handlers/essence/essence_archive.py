@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""Essence archive module.
+
+This module exports one group's current essence backup to a line-delimited JSON
+archive and imports such archives back, streaming in both directions so the
+archive never has to fit in memory. Backups that fall out of the retention
+window are moved to gzip-compressed files in the cold archive directory next
+to the database, from where they can be attached again as old backups.
+
+Usage (run from src/):
+    python -m handlers.essence.essence_archive export <group_id> <file> [--db PATH]
+    python -m handlers.essence.essence_archive import <file> [--group GROUP_ID] [--db PATH]
+    python -m handlers.essence.essence_archive list [--group GROUP_ID] [--db PATH]
+    python -m handlers.essence.essence_archive attach <file> [--db PATH]
+
+Files ending in .gz are gzip-compressed, files ending in .zst are
+zstd-compressed (requires the zstandard package), anything else is plain JSONL.
+"""
+
+import argparse
+import datetime
+import gzip
+import io
+import json
+import os
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from handlers.essence.essence_models import (
+    db, db_pragmas, init_database, encode_content, decode_content, index_essence_messages,
+    rebuild_backup_stats, CONTENT_FORMAT_JSON, BackupRecord, EssenceMessage, BackupMembership
+)
+from handlers.essence.essence_handler import ESSENCE_MESSAGE_FIELDS, ESSENCE_MESSAGE_UPSERT_SQL
+
+# 导出文件第一行的格式标识和版本
+ARCHIVE_FORMAT = "yww-essence-archive"
+ARCHIVE_VERSION = 1
+
+# 导入时每批写入的消息数，每批一个事务，不会长时间占用数据库写锁
+IMPORT_BATCH_SIZE = 1000
+
+# 冷归档目录（位于数据库文件所在目录）
+COLD_ARCHIVE_DIR_NAME = "essence_archive"
+COLD_ARCHIVE_SUFFIX = ".jsonl.gz"
+
+# 导出的消息字段（content 以外）
+ARCHIVE_FIELDS = [
+    "message_id", "message_seq", "sender_id", "sender_nick",
+    "operator_id", "operator_nick", "operator_time",
+]
+
+# 恢复归档时写入消息，已存在的消息保持不变（同一条消息在各份备份中共用一行，以最新的设精信息为准）
+ARCHIVE_MESSAGE_INSERT_SQL = (
+    'INSERT INTO "{table}" ({columns}) VALUES ({placeholders}) '
+    'ON CONFLICT ("group_id", "message_id") DO NOTHING'
+).format(
+    table=EssenceMessage._meta.table_name,
+    columns=", ".join(f'"{field.column_name}"' for field in ESSENCE_MESSAGE_FIELDS),
+    placeholders=", ".join("?" for _ in ESSENCE_MESSAGE_FIELDS)
+)
+
+# 将导入的消息加入备份，已在备份中的消息保持不变，配合 executemany 使用
+ARCHIVE_MEMBERSHIP_INSERT_SQL = (
+    'INSERT INTO "{membership}" ("backup_id", "message_id", "in_essence_list") '
+    'SELECT ?, "id", ? FROM "{message}" WHERE "group_id" = ? AND "message_id" = ? '
+    'ON CONFLICT ("backup_id", "message_id") DO NOTHING'
+).format(
+    membership=BackupMembership._meta.table_name,
+    message=EssenceMessage._meta.table_name
+)
+
+
+def open_archive(path: str, mode: str):
+    """按扩展名打开导出文件（文本模式），mode 为 "r" 或 "w"。"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise Exception("读写 .zst 文件需要安装 zstandard：pip install zstandard")
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def export_group(group_id, path: str):
+    """将群聊当前备份中的精华消息导出到文件。
+
+    Returns:
+        int: 导出的消息数
+    """
+    group_id = str(group_id)
+    backup = BackupRecord.select().where(
+        (BackupRecord.group_id == group_id) & (BackupRecord.is_current == 1)
+    ).order_by(BackupRecord.backup_time.desc()).first()
+    if backup is None:
+        raise Exception(f"群聊 {group_id} 没有备份记录")
+    return export_backup(backup, path)
+
+
+def export_backup(backup, path: str):
+    """将一份备份中的精华消息导出到文件。
+
+    第一行是文件头，之后每行一条消息。按游标逐行读取和写入，内存占用与消息数无关。
+    先写入临时文件，完成后再替换，中途失败不会留下不完整的文件；
+    临时文件名包含进程和线程 ID，同时导出同一份备份（例如两个进程同时维护）不会写同一个临时文件。
+
+    Returns:
+        int: 导出的消息数
+    """
+    rows = EssenceMessage.select(
+        *(getattr(EssenceMessage, field) for field in ARCHIVE_FIELDS),
+        EssenceMessage.content, EssenceMessage.content_format, BackupMembership.in_essence_list
+    ).join(BackupMembership).where(BackupMembership.backup == backup).order_by(EssenceMessage.id).tuples()
+
+    count = 0
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp{os.path.splitext(path)[1]}"
+    with open_archive(tmp_path, "w") as f:
+        f.write(_encode_line({
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "group_id": backup.group_id,
+            "backup_time": backup.backup_time.isoformat(),
+            "exported_at": datetime.datetime.now().isoformat(),
+        }))
+        for row in rows.iterator():
+            record = dict(zip(ARCHIVE_FIELDS, row))
+            content, content_format, in_essence_list = row[len(ARCHIVE_FIELDS):]
+            record["content"] = decode_content(content, content_format)
+            record["in_essence_list"] = in_essence_list
+            f.write(_encode_line(record))
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def import_archive(path: str, group_id=None):
+    """将导出文件中的精华消息导入到群聊的当前备份中（没有备份时创建一个）。
+
+    按 message_id 去重，已存在的消息只在设精信息变化时更新，重复导入同一个文件不会产生重复数据。
+    逐行读取，每 IMPORT_BATCH_SIZE 条写入一次，内存占用与文件大小无关。
+
+    Args:
+        path: 导出文件路径
+        group_id: 导入到的群号，默认为导出时的群号
+
+    Returns:
+        dict: {"group_id": 群号, "total": 文件中的消息数, "added": 新加入备份的消息数}
+    """
+    result = {"group_id": None, "total": 0, "added": 0}
+    with open_archive(path, "r") as f:
+        header = _read_header(f.readline())
+        group_id = str(group_id or header["group_id"])
+        result["group_id"] = group_id
+
+        with db.atomic("IMMEDIATE"):
+            backup_id = _get_or_create_current_backup(group_id)
+
+        batch = []
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                result["added"] += _import_batch(backup_id, group_id, batch)
+                result["total"] += len(batch)
+                batch = []
+        if batch:
+            result["added"] += _import_batch(backup_id, group_id, batch)
+            result["total"] += len(batch)
+
+    # 已有消息的设精信息可能被更新，统计从成员关系重新计算
+    with db.atomic("IMMEDIATE"):
+        rebuild_backup_stats(backup_id)
+    return result
+
+
+def cold_archive_dir(group_id=None):
+    """冷归档目录，位于数据库文件所在目录，每个群聊一个子目录。"""
+    path = os.path.join(os.path.dirname(os.path.abspath(db.database)), COLD_ARCHIVE_DIR_NAME)
+    return path if group_id is None else os.path.join(path, str(group_id))
+
+
+def list_cold_archives(group_id=None):
+    """列出冷归档文件，按群聊和备份时间排序。
+
+    Returns:
+        list: [(群号, 文件路径)]
+    """
+    root = cold_archive_dir()
+    if not os.path.isdir(root):
+        return []
+    group_ids = [str(group_id)] if group_id is not None else sorted(os.listdir(root))
+    archives = []
+    for archive_group_id in group_ids:
+        group_dir = os.path.join(root, archive_group_id)
+        if not os.path.isdir(group_dir):
+            continue
+        # 文件名以备份时间开头，按名称排序即按时间排序
+        for filename in sorted(os.listdir(group_dir)):
+            if filename.endswith(COLD_ARCHIVE_SUFFIX):
+                archives.append((archive_group_id, os.path.join(group_dir, filename)))
+    return archives
+
+
+def archive_backup(backup, max_files=None):
+    """将一份备份导出到冷归档（只读取数据库，在数据库读线程中执行），备份由调用者之后在写线程中删除。
+
+    同一份备份总是导出到同一个文件，恢复后再次归档不会产生重复的文件。
+    max_files 不为 None 时每个群聊最多保留 max_files 个归档文件，删除最早的归档并打印每个被删除的文件。
+
+    Returns:
+        str: 归档文件路径，备份已经被删除（例如其他进程已经归档）时为 None
+    """
+    group_dir = cold_archive_dir(backup.group_id)
+    os.makedirs(group_dir, exist_ok=True)
+    path = os.path.join(group_dir, backup.backup_time.strftime("%Y%m%d-%H%M%S-%f") + COLD_ARCHIVE_SUFFIX)
+    # 在同一个读事务中检查备份是否存在并导出，使用同一个快照，不会把已删除的备份导出为空文件覆盖原来的归档
+    with db.atomic():
+        if not BackupRecord.select().where(BackupRecord.id == backup.id).exists():
+            return None
+        export_backup(backup, path)
+
+    if max_files is not None:
+        archives = list_cold_archives(backup.group_id)
+        for _, expired_path in archives[:max(0, len(archives) - max_files)]:
+            try:
+                os.remove(expired_path)
+            except FileNotFoundError:
+                # 其他进程已经删除
+                continue
+            print(f"群聊 {backup.group_id} 的冷归档超过 {max_files} 个，删除最早的归档: {expired_path}")
+    return path
+
+
+def attach_archive(path: str):
+    """将冷归档（或导出文件）恢复为群聊的一份旧备份，备份时间与归档时相同。
+
+    恢复的备份不会成为当前备份；下次备份后如果超出保留份数，会再次移到冷归档中。
+
+    Returns:
+        dict: {"group_id": 群号, "backup_time": 备份时间, "total": 恢复的消息数}
+    """
+    with open_archive(path, "r") as f:
+        header = _read_header(f.readline())
+        group_id = str(header["group_id"])
+        backup_time = datetime.datetime.fromisoformat(header["backup_time"])
+
+        with db.atomic("IMMEDIATE"):
+            if BackupRecord.select().where(
+                (BackupRecord.group_id == group_id) & (BackupRecord.backup_time == backup_time)
+            ).exists():
+                raise Exception(f"群聊 {group_id} 在 {backup_time} 的备份已经存在，该归档已经恢复过")
+            backup_id = BackupRecord.create(group_id=group_id, backup_time=backup_time, is_current=0).id
+
+        total = 0
+        batch = []
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                _import_batch(backup_id, group_id, batch, ARCHIVE_MESSAGE_INSERT_SQL)
+                total += len(batch)
+                batch = []
+        if batch:
+            _import_batch(backup_id, group_id, batch, ARCHIVE_MESSAGE_INSERT_SQL)
+            total += len(batch)
+
+    with db.atomic("IMMEDIATE"):
+        rebuild_backup_stats(backup_id)
+    return {"group_id": group_id, "backup_time": backup_time, "total": total}
+
+
+def _encode_line(record: dict):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _read_header(line: str):
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != ARCHIVE_FORMAT:
+        raise Exception("不是精华消息导出文件")
+    if header.get("version", 0) > ARCHIVE_VERSION:
+        raise Exception(f"导出文件版本 {header['version']} 过新，请升级后再导入")
+    return header
+
+
+def _get_or_create_current_backup(group_id: str):
+    backup = BackupRecord.select(BackupRecord.id).where(
+        (BackupRecord.group_id == group_id) & (BackupRecord.is_current == 1)
+    ).order_by(BackupRecord.backup_time.desc()).first()
+    if backup is None:
+        backup = BackupRecord.create(group_id=group_id, backup_time=datetime.datetime.now(), is_current=1)
+    return backup.id
+
+
+def _import_batch(backup_id, group_id: str, records: list, message_sql=ESSENCE_MESSAGE_UPSERT_SQL):
+    """在一个事务中写入一批消息、成员关系和搜索索引。
+
+    Returns:
+        int: 新加入备份的消息数
+    """
+    rows, memberships, search_rows = [], [], []
+    for record in records:
+        message_id = str(record["message_id"])
+        content = record.get("content", "")
+        rows.append((
+            group_id,
+            message_id,
+            record.get("message_seq", ""),
+            record.get("sender_id", ""),
+            record.get("sender_nick", ""),
+            record.get("operator_id", ""),
+            record.get("operator_nick", ""),
+            int(record.get("operator_time") or 0),
+            encode_content(content),
+            CONTENT_FORMAT_JSON,
+        ))
+        memberships.append((backup_id, record.get("in_essence_list"), group_id, message_id))
+        search_rows.append((message_id, content))
+
+    with db.atomic("IMMEDIATE"):
+        cursor = db.cursor()
+        cursor.executemany(message_sql, rows)
+        cursor.executemany(ARCHIVE_MEMBERSHIP_INSERT_SQL, memberships)
+        added = cursor.rowcount
+        index_essence_messages(group_id, search_rows)
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出或导入群聊的精华消息备份")
+    parser.add_argument("--db", help="数据库文件路径，默认为机器人使用的数据库")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    export_parser = subparsers.add_parser("export", help="导出群聊当前备份中的精华消息")
+    export_parser.add_argument("group_id", help="群号")
+    export_parser.add_argument("path", help="导出文件路径，.gz/.zst 结尾时压缩")
+    import_parser = subparsers.add_parser("import", help="导入精华消息到群聊的当前备份")
+    import_parser.add_argument("path", help="导出文件路径")
+    import_parser.add_argument("--group", help="导入到的群号，默认为导出时的群号")
+    list_parser = subparsers.add_parser("list", help="列出冷归档中的旧备份")
+    list_parser.add_argument("--group", help="只列出该群聊的归档")
+    attach_parser = subparsers.add_parser("attach", help="将冷归档恢复为群聊的一份旧备份")
+    attach_parser.add_argument("path", help="归档文件路径")
+    args = parser.parse_args()
+
+    if args.db:
+        db.init(args.db, pragmas=db_pragmas)
+    init_database()
+    # 不使用 with db（会把整个导入包在一个事务中），每批单独提交
+    db.connect()
+    try:
+        if args.action == "export":
+            count = export_group(args.group_id, args.path)
+            print(f"已导出 {count} 条精华消息到 {args.path}")
+        elif args.action == "list":
+            for group_id, path in list_cold_archives(args.group):
+                print(f"{group_id}\t{os.path.getsize(path)}\t{path}")
+        elif args.action == "attach":
+            result = attach_archive(args.path)
+            print(f"已将 {result['total']} 条精华消息恢复为群聊 {result['group_id']} "
+                  f"在 {result['backup_time']} 的备份")
+        else:
+            result = import_archive(args.path, args.group)
+            print(f"已导入 {result['total']} 条精华消息到群聊 {result['group_id']}，"
+                  f"其中 {result['added']} 条是新加入备份的")
+    except Exception as e:
+        # 与参数错误一样输出错误信息并以非零状态退出，不打印调用栈
+        parser.error(str(e))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,364 @@
 # -*- coding: utf-8 -*-
 """Essence message handler module.
 
-This module provides functionality for backing up, adding, and viewing essence messages in groups.
+This module provides functionality for backing up, adding, viewing, searching and summarizing essence messages in groups.
 """
 
-import os
+import asyncio
 import datetime
-import ast
+import hashlib
 from peewee import *
-from napcat import Text, Reply, GroupMessageEvent, NapCatClient
+from napcat import Text, Reply, GroupMessageEvent
 from handlers.base.command_handler_common import *
+from handlers.base.result_cache import ResultCache
+from handlers.essence.essence_models import (
+    db, db_executor, convert_legacy_content, encode_content, decode_content,
+    index_essence_messages, has_backup_stats, update_backup_stats, move_backup_stats, rebuild_backup_stats,
+    CONTENT_FORMAT_JSON, SEARCH_MIN_KEYWORD_LENGTH, SEARCH_INDEX_AVAILABLE,
+    BackupRecord, EssenceMessage, BackupMembership, GroupBackupState, EssenceSearch, EssenceStat
+)
 
 
-db_path = os.path.join(os.path.dirname(__file__), "essence_backup.db")
-db = SqliteDatabase(db_path)
-
-# 表基类
-class BaseModel(Model):
-    class Meta:
-        database = db
-
-# 备份记录表
-class BackupRecord(BaseModel):
-    group_id = CharField()
-    backup_time = DateTimeField(default=datetime.datetime.now)
-    is_current = IntegerField(default=0)
-
-# 精华消息表
-class EssenceMessage(BaseModel):
-    backup = ForeignKeyField(BackupRecord, backref='messages')
-    group_id = CharField()
-    message_id = CharField()
-    message_seq = CharField()
-    sender_id = CharField()
-    sender_nick = CharField()
-    operator_id = CharField()
-    operator_nick = CharField()
-    operator_time = BigIntegerField()
-    content = TextField()
+# 查看精华结果缓存：最多缓存的查询数、估算内存上限和有效期（秒）
+ESSENCE_CACHE_MAX_ENTRIES = 1024
+ESSENCE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ESSENCE_CACHE_TTL = 600
+
+# 不限条数（-1）查看精华时分页发送：每条转发消息包含的节点数和两次发送之间的间隔（秒）
+FORWARD_PAGE_SIZE = 100
+FORWARD_SEND_INTERVAL = 1.0
+
+# 每个群聊保留的备份份数（包括当前备份），超出的旧备份标记为过期，由 EssenceMaintenance 移到冷归档
+BACKUP_RETENTION = 5
+
+# 搜索精华每页的结果数
+SEARCH_PAGE_SIZE = 20
+
+# 精华统计默认和最多显示的排名数，以及显示的月份数
+STATS_TOP_DEFAULT = 10
+STATS_TOP_MAX = 50
+STATS_MONTHS = 12
+
+# 查看和搜索精华时读取的字段，查询结果是按此顺序排列的元组，不创建模型实例
+ESSENCE_ROW_FIELDS = (
+    EssenceMessage.id,
+    EssenceMessage.sender_id,
+    EssenceMessage.sender_nick,
+    EssenceMessage.operator_time,
+    EssenceMessage.content,
+    EssenceMessage.content_format,
+)
+
+# 批量写入精华消息时的字段顺序
+ESSENCE_MESSAGE_FIELDS = [
+    EssenceMessage.group_id,
+    EssenceMessage.message_id,
+    EssenceMessage.message_seq,
+    EssenceMessage.sender_id,
+    EssenceMessage.sender_nick,
+    EssenceMessage.operator_id,
+    EssenceMessage.operator_nick,
+    EssenceMessage.operator_time,
+    EssenceMessage.content,
+    EssenceMessage.content_format,
+]
+
+# 批量写入精华消息，配合 executemany 使用，只需编译一次
+# 消息已存在时只在设精信息发生变化或内容仍是旧格式时更新，避免重复备份时改写所有行
+ESSENCE_MESSAGE_UPSERT_SQL = (
+    'INSERT INTO "{table}" ({columns}) VALUES ({placeholders}) '
+    'ON CONFLICT ("group_id", "message_id") DO UPDATE SET '
+    '"operator_id" = excluded."operator_id", '
+    '"operator_nick" = excluded."operator_nick", '
+    '"operator_time" = excluded."operator_time", '
+    '"content" = excluded."content", '
+    '"content_format" = excluded."content_format" '
+    'WHERE "operator_time" != excluded."operator_time" '
+    'OR "operator_id" != excluded."operator_id" '
+    'OR "content_format" != excluded."content_format"'
+).format(
+    table=EssenceMessage._meta.table_name,
+    columns=", ".join(f'"{field.column_name}"' for field in ESSENCE_MESSAGE_FIELDS),
+    placeholders=", ".join("?" for _ in ESSENCE_MESSAGE_FIELDS)
+)
+
+# 将精华列表中的消息加入备份并标记为仍在精华列表中，配合 executemany 使用
+BACKUP_MEMBERSHIP_UPSERT_SQL = (
+    'INSERT INTO "{membership}" ("backup_id", "message_id", "in_essence_list") '
+    'SELECT ?, "id", 1 FROM "{message}" WHERE "group_id" = ? AND "message_id" = ? '
+    'ON CONFLICT ("backup_id", "message_id") DO UPDATE SET "in_essence_list" = 1'
+).format(
+    membership=BackupMembership._meta.table_name,
+    message=EssenceMessage._meta.table_name
+)
+
+# 将已被移出精华列表的消息标记出来，配合 executemany 使用
+BACKUP_MEMBERSHIP_REMOVED_SQL = (
+    'UPDATE "{membership}" SET "in_essence_list" = 0 WHERE "backup_id" = ? AND "message_id" = ?'
+).format(membership=BackupMembership._meta.table_name)
+
 
 @register_handler(category="精华", chat_type="group")
 class EssenceHandler(CommandHandlerBase):
     """精华消息处理器。
     
-    提供备份、添加和查看精华消息的功能。
+    提供备份、添加、查看、搜索和统计精华消息的功能。
     """
     
     def __init__(self):
         super().__init__()
+        self._db = db_executor
+        self._metrics = CommandMetrics()
+        self._backups_in_flight = SingleFlight()
+        self._result_cache = ResultCache(
+            max_entries=ESSENCE_CACHE_MAX_ENTRIES,
+            max_bytes=ESSENCE_CACHE_MAX_BYTES,
+            ttl=ESSENCE_CACHE_TTL
+        )
         self._init_database()
     
     def _init_database(self):
-        """初始化数据库，创建必要的表。"""
-        with db:
-            db.create_tables([BackupRecord, EssenceMessage])
+        """在后台初始化数据库。
+        
+        建表和迁移由 db_executor 在第一次执行数据库操作之前于工作线程中完成（见 init_database），
+        之后的读写都会等待初始化完成，这里只启动后台任务，不阻塞事件循环。
+        """
+        # 旧格式的消息内容在后台逐批转换，第一批写入同时触发数据库初始化
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（例如基准测试脚本），调用方需要自行执行 init_database
+            return
+        self._content_migration_task = loop.create_task(self._convert_legacy_content())
+    
+    async def _convert_legacy_content(self):
+        """后台任务：将旧格式的消息内容逐批转换为 JSON。"""
+        try:
+            converted = 0
+            while True:
+                count = await self._db.write(convert_legacy_content)
+                if count == 0:
+                    break
+                converted += count
+            if converted:
+                print(f"已将 {converted} 条精华消息内容转换为 JSON 格式")
+        except Exception as e:
+            print(f"转换精华消息内容格式时出错: {e}")
     
     @CommandHandlerBase.command("备份精华", 
-                               usage="备份精华",
-                               description="备份当前群聊的所有精华消息，最多保存5份记录")
+                               usage="备份精华 [全量]",
+                               description="备份当前群聊的所有精华消息，最多保存5份记录，只写入有变化的消息，加上“全量”参数时重写所有消息",
+                               cooldown=60,
+                               coalesce=True)
     async def handle_essence_backup(self, event: GroupMessageEvent, args: list):
         """处理备份精华消息命令。"""
         group_id = event.group_id
+        full = bool(args) and args[0] == "全量"
         await event.reply([Text(text="正在备份精华消息...")])
         
         try:
-            # 获取当前群聊的精华消息列表
-            client: NapCatClient = CommandContext().client
-            essence_list = await client.get_essence_msg_list(group_id=group_id)
-            
-            if not essence_list:
+            result = await self.backup_group(group_id, full)
+            if result is None:
                 await event.reply([Text(text="当前群聊没有精华消息")])
                 return
+            if not result["created"]:
+                await event.reply([Text(text=f"精华消息没有变化，无需备份（共 {result['total']} 条消息）")])
+                return
             
-            # 开始事务
-            with db.atomic():
-                self._cleanup_old_backups(group_id)
-                current_backup = self._get_current_backup(group_id)
-                new_backup = self._create_new_backup(group_id)
-                essence_msg_ids = self._insert_current_essence_messages(
-                    new_backup, group_id, essence_list
-                )
-                self._insert_previous_essence_messages(
-                    new_backup, group_id, current_backup, essence_msg_ids
-                )
-            
-            await event.reply([Text(text=f"精华消息备份完成，共备份 {len(essence_list)} 条消息")])
+            await event.reply([Text(text=self._format_backup_result(result))])
         except Exception as e:
             await event.reply([Text(text=f"备份精华消息失败：{str(e)}")])
     
-    def _cleanup_old_backups(self, group_id: str):
-        """清理旧的备份记录，最多保留5份。"""
-        backup_count = BackupRecord.select().where(
-            BackupRecord.group_id == group_id
-        ).count()
-        
-        # 如果备份数量超过4（即第5份），删除最早的备份
-        if backup_count >= 5:
-            # 获取最早的备份记录
-            oldest_backup = BackupRecord.select().where(
-                BackupRecord.group_id == group_id
-            ).order_by(BackupRecord.backup_time.asc()).first()
-            if oldest_backup:
-                # 删除关联的精华消息
-                EssenceMessage.delete().where(
-                    EssenceMessage.backup == oldest_backup
-                ).execute()
-                # 删除备份记录
-                oldest_backup.delete_instance()
+    async def backup_group(self, group_id, full: bool = False):
+        """拉取群聊的精华列表并备份，备份精华指令和定时备份共用。
+        
+        同一群聊同时只会执行一次备份，并发的请求共享同一个结果。
+        
+        Returns:
+            dict: 同 _backup_essence_messages，群聊没有精华消息时返回 None
+        """
+        return await self._backups_in_flight.run((str(group_id), full), self._backup_group, group_id, full)
+    
+    async def _backup_group(self, group_id, full: bool):
+        # 获取当前群聊的精华消息列表
+        essence_list = await NapCatApi().get_essence_msg_list(group_id=group_id)
+        
+        if not essence_list:
+            return None
+        
+        # 在数据库写线程中以事务方式执行，不阻塞事件循环
+        result = await self._db.write(self._backup_essence_messages, group_id, essence_list, full)
+        if result["created"]:
+            self._result_cache.invalidate(group_id)
+        return result
+    
+    def _format_backup_result(self, result: dict):
+        reply_text = (
+            f"精华消息备份完成，共备份 {result['total']} 条消息，"
+            f"新增 {result['added']} 条，移除 {result['removed']} 条"
+        )
+        if result["updated"]:
+            reply_text += f"，重新设精 {result['updated']} 条"
+        return reply_text
+    
+    def _backup_essence_messages(self, group_id: str, essence_list: list, full: bool = False):
+        """与当前备份比较后创建新的备份（在数据库写线程中以事务方式执行）。
+        
+        只写入新增、重新设精（operator_time 变化）和被移出精华列表的消息，
+        精华列表没有变化时不创建新备份；full 为 True 时总是创建新备份并重写所有消息。
+        
+        Returns:
+            dict: {"created": 是否创建了新备份, "total": 精华列表中的消息数,
+                   "added": 新增数, "removed": 移出数, "updated": 重新设精数}
+        """
+        group_id = str(group_id)
+        essence_messages = {str(msg.get("message_id", "")): msg for msg in essence_list}
+        fingerprint = self._essence_fingerprint(essence_messages)
+        current_backup = self._get_current_backup(group_id)
+        result = {"created": False, "total": len(essence_messages), "added": 0, "removed": 0, "updated": 0}
+        
+        # 精华列表与上次备份时完全相同，不需要再和备份逐条比较
+        state = GroupBackupState.get_or_none(GroupBackupState.group_id == group_id)
+        if current_backup and not full and state is not None and state.essence_fingerprint == fingerprint:
+            self._save_backup_state(group_id, fingerprint)
+            return result
+        
+        new, readded, updated, relisted, removed = self._diff_essence_messages(current_backup, essence_messages)
+        added = readded + new
+        result.update(added=len(added), removed=len(removed), updated=len(updated))
+        if current_backup and not (added or updated or removed) and not full:
+            self._save_backup_state(group_id, fingerprint)
+            return result
+        
+        self._expire_old_backups(group_id)
+        new_backup = self._create_new_backup(group_id)
+        self._copy_previous_memberships(new_backup, current_backup)
+        if current_backup:
+            # 统计随当前备份转移，重新设精的消息先扣除旧的设精者和月份，写入后再按新值计入
+            move_backup_stats(current_backup.id, new_backup.id)
+            update_backup_stats(new_backup.id, group_id, updated, -1)
+        
+        if full:
+            written_ids = list(essence_messages)
+            listed_ids = written_ids
+        else:
+            written_ids = added + updated
+            listed_ids = written_ids + relisted
+        self._write_essence_messages(group_id, [essence_messages[message_id] for message_id in written_ids])
+        
+        cursor = db.cursor()
+        cursor.executemany(
+            BACKUP_MEMBERSHIP_UPSERT_SQL,
+            [(new_backup.id, group_id, message_id) for message_id in listed_ids]
+        )
+        cursor.executemany(
+            BACKUP_MEMBERSHIP_REMOVED_SQL,
+            [(new_backup.id, message_pk) for message_pk in removed]
+        )
+        
+        if current_backup:
+            # 被移出精华列表的消息仍保留在备份中，统计不变
+            update_backup_stats(new_backup.id, group_id, new + updated)
+        else:
+            rebuild_backup_stats(new_backup.id)
+        
+        self._save_backup_state(group_id, fingerprint)
+        result["created"] = True
+        return result
+    
+    @staticmethod
+    def _essence_fingerprint(essence_messages: dict):
+        """根据 message_id 和 operator_time 计算精华列表的指纹。"""
+        digest = hashlib.blake2b(digest_size=16)
+        for message_id in sorted(essence_messages):
+            operator_time = int(essence_messages[message_id].get("operator_time") or 0)
+            digest.update(f"{message_id}:{operator_time}\n".encode())
+        return digest.hexdigest()
+    
+    def _save_backup_state(self, group_id: str, fingerprint, error=None):
+        """记录群聊的备份时间、精华列表指纹和失败原因。"""
+        values = {"last_run_time": datetime.datetime.now(), "last_error": error}
+        if fingerprint is not None:
+            values["essence_fingerprint"] = fingerprint
+        GroupBackupState.insert(group_id=group_id, **values).on_conflict(
+            conflict_target=[GroupBackupState.group_id],
+            update=values
+        ).execute()
+    
+    async def record_backup_run(self, group_id, error=None):
+        """记录一次没有写入备份的运行（备份失败或群聊没有精华消息），指纹保持不变，下次备份时重新比较。"""
+        await self._db.write(self._save_backup_state, str(group_id), None, error)
+    
+    async def get_last_backup_times(self, group_ids: list):
+        """获取群聊最近一次备份的时间。
+        
+        Returns:
+            dict: {group_id: last_run_time}，从未备份过的群聊不在结果中
+        """
+        return await self._db.read(self._get_last_backup_times, group_ids)
+    
+    def _get_last_backup_times(self, group_ids: list):
+        """获取群聊最近一次备份的时间（在数据库读线程中执行）。"""
+        return dict(GroupBackupState.select(
+            GroupBackupState.group_id, GroupBackupState.last_run_time
+        ).where(GroupBackupState.group_id.in_([str(group_id) for group_id in group_ids])).tuples())
+    
+    def _diff_essence_messages(self, current_backup, essence_messages: dict):
+        """比较精华列表与当前备份。
+        
+        Returns:
+            tuple: (不在备份中的新 message_id 列表, 之前被移出精华列表后重新设为精华的 message_id 列表,
+                    重新设精的 message_id 列表, 已在备份中但需要标记为在精华列表中的 message_id 列表,
+                    被移出精华列表的消息主键列表)
+        """
+        if not current_backup:
+            return list(essence_messages), [], [], [], []
+        
+        backed_up = BackupMembership.select(
+            EssenceMessage.message_id,
+            EssenceMessage.operator_time,
+            BackupMembership.in_essence_list,
+            EssenceMessage.id
+        ).join(EssenceMessage).where(
+            BackupMembership.backup == current_backup
+        ).tuples()
+        
+        readded, updated, relisted, removed = [], [], [], []
+        seen_ids = set()
+        for message_id, operator_time, in_essence_list, message_pk in backed_up:
+            msg = essence_messages.get(message_id)
+            if msg is None:
+                if in_essence_list == 1:
+                    removed.append(message_pk)
+                continue
+            
+            seen_ids.add(message_id)
+            if int(msg.get("operator_time") or 0) != operator_time:
+                updated.append(message_id)
+            elif in_essence_list == 0:
+                # 之前被移出精华列表（或手动添加）的消息重新设为精华
+                readded.append(message_id)
+            elif in_essence_list is None:
+                # 旧版本的备份不知道是否在精华列表中，只补上标记，不算作变化
+                relisted.append(message_id)
+        
+        new = [message_id for message_id in essence_messages if message_id not in seen_ids]
+        return new, readded, updated, relisted, removed
+    
+    def _expire_old_backups(self, group_id: str):
+        """创建新备份之前，将超出保留份数的旧备份标记为过期，最多保留 BACKUP_RETENTION 份（包括即将创建的备份）。
+        
+        这里只更新备份记录，不导出也不删除数据，备份事务保持很短；
+        过期的备份由 EssenceMaintenance 在单独的数据库操作中导出到冷归档后删除。
+        """
+        retained_backups = BackupRecord.select(BackupRecord.id).where(
+            (BackupRecord.group_id == group_id) & (BackupRecord.expired == 0)
+        ).order_by(BackupRecord.backup_time.desc()).limit(BACKUP_RETENTION - 1)
+        BackupRecord.update(expired=1).where(
+            (BackupRecord.group_id == group_id) &
+            (BackupRecord.expired == 0) &
+            BackupRecord.id.not_in(retained_backups)
+        ).execute()
     
     def _get_current_backup(self, group_id: str):
         """获取当前最新的备份记录。"""
@@ -128,153 +380,435 @@ class EssenceHandler(CommandHandlerBase):
             is_current=1
         )
     
-    def _insert_current_essence_messages(self, backup, group_id: str, essence_list: list):
-        """插入当前精华列表中的消息。"""
-        essence_msg_ids = set()
-        
-        for msg in essence_list:
-            message_id = str(msg.get("message_id", ""))
-            essence_msg_ids.add(message_id)
-            
-            EssenceMessage.create(
-                backup=backup,
-                group_id=group_id,
-                message_id=message_id,
-                message_seq=msg.get("msg_seq", ""),
-                sender_id=msg.get("sender_id", ""),
-                sender_nick=msg.get("sender_nick", ""),
-                operator_id=msg.get("operator_id", ""),
-                operator_nick=msg.get("operator_nick", ""),
-                operator_time=msg.get("operator_time", 0),
-                content=msg.get("content", ""),
-            )
+    def _write_essence_messages(self, group_id: str, essence_list: list):
+        """批量写入精华消息并更新搜索索引，已保存过的消息只在设精信息变化时更新。"""
+        rows = [(
+            group_id,
+            str(msg.get("message_id", "")),
+            msg.get("msg_seq", ""),
+            msg.get("sender_id", ""),
+            msg.get("sender_nick", ""),
+            msg.get("operator_id", ""),
+            msg.get("operator_nick", ""),
+            msg.get("operator_time", 0),
+            encode_content(msg.get("content", "")),
+            CONTENT_FORMAT_JSON,
+        ) for msg in essence_list]
         
-        return essence_msg_ids
+        # 使用预编译语句批量写入
+        db.cursor().executemany(ESSENCE_MESSAGE_UPSERT_SQL, rows)
+        index_essence_messages(group_id, [
+            (msg.get("message_id", ""), msg.get("content", "")) for msg in essence_list
+        ])
     
-    def _insert_previous_essence_messages(self, backup, group_id: str, current_backup, essence_msg_ids: set):
-        """插入之前备份中存在但当前精华列表不存在的消息。"""
+    def _copy_previous_memberships(self, backup, current_backup):
+        """将当前备份中的所有消息复制到新备份。
+        
+        只复制成员关系（在数据库内部一条语句完成），消息本身不需要再写一次。
+        """
         if not current_backup:
             return
         
-        # 获取当前备份中的所有精华消息
-        current_backup_messages = EssenceMessage.select().where(
-            EssenceMessage.backup == current_backup
-        )
+        previous_memberships = BackupMembership.select(
+            Value(backup.id), BackupMembership.message, BackupMembership.in_essence_list
+        ).where(BackupMembership.backup == current_backup)
         
-        # 插入当前备份中存在但当前精华列表不存在的消息
-        for msg in current_backup_messages:
-            if msg.message_id not in essence_msg_ids:
-                EssenceMessage.create(
-                    backup=backup,
-                    group_id=group_id,
-                    message_id=msg.message_id,
-                    message_seq=msg.message_seq,
-                    sender_id=msg.sender_id,
-                    sender_nick=msg.sender_nick,
-                    operator_id=msg.operator_id,
-                    operator_nick=msg.operator_nick,
-                    operator_time=msg.operator_time,
-                    content=msg.content,
-                )
+        BackupMembership.insert_from(
+            previous_memberships,
+            [BackupMembership.backup, BackupMembership.message, BackupMembership.in_essence_list]
+        ).on_conflict_ignore().execute()
     
-
-
     @CommandHandlerBase.command("添加精华", 
                                usage="添加精华",
-                               description="将指定消息添加到当前最新备份的记录中")
+                               description="将指定消息添加到当前最新备份的记录中",
+                               user_rate_limit=(10, 60))
     async def handle_essence_add(self, event : GroupMessageEvent, args: list):
-        message_id = next((msg.id for msg in event.message if isinstance(msg, Reply)), None)
+        parsed = get_current_command()
+        if parsed is not None:
+            message_id = parsed.reply_id
+        else:
+            message_id = next((msg.id for msg in event.message if isinstance(msg, Reply)), None)
         if message_id is None:
             await event.reply([Text(text="请引用要添加的消息并@我~")])
             return
         
         group_id = event.group_id
         try:
-            # 获取当前最新的备份记录
-            current_backup = BackupRecord.select().where(
-                (BackupRecord.group_id == group_id) & (BackupRecord.is_current == 1)
-            ).order_by(BackupRecord.backup_time.desc()).first()
-            
-            if not current_backup:
+            # 没有备份时不需要获取消息详情，写入时会在事务中重新查找当前备份
+            if not await self._db.read(self._get_current_backup, group_id):
                 await event.reply([Text(text="没有找到当前备份记录，请先执行备份精华命令")])
                 return
             
-            # 获取消息详情
-            client:NapCatClient = CommandContext().client
-            msg_info = await client.get_msg(message_id=message_id)
+            # 获取消息详情，机器人最近收到过这条消息时直接使用，不需要调用 get_msg
+            msg_info = await RecentMessages().get_msg(group_id, message_id)
             
             # 插入到精华消息表
-            EssenceMessage.create(
-                backup=current_backup,
-                group_id=group_id,
-                message_id=msg_info.get("message_id", ""),
-                message_seq=msg_info.get("message_seq", ""),
-                sender_id=msg_info.get("sender").get("user_id", ""),
-                sender_nick=msg_info.get("sender").get("nickname", ""),
-                operator_id=msg_info.get("sender").get("user_id", ""),  # 操作者默认为消息发送者
-                operator_nick=msg_info.get("sender").get("nickname", ""),  # 操作者昵称默认为消息发送者昵称
-                operator_time=int(datetime.datetime.now().timestamp()),
-                content=msg_info.get("message", ""),
-            )
+            if not await self._db.write(self._insert_added_essence_message, group_id, msg_info):
+                await event.reply([Text(text="没有找到当前备份记录，请先执行备份精华命令")])
+                return
+            self._result_cache.invalidate(group_id)
             
             await event.reply([Text(text="消息已添加到精华备份中")])
         except Exception as e:
             await event.reply([Text(text=f"添加精华消息失败：{str(e)}")])
     
 
+    def _insert_added_essence_message(self, group_id: str, msg_info: dict):
+        """插入手动添加的精华消息并加入当前备份（在数据库写线程中执行）。
+
+        当前备份在写事务中查找，避免期间新建的备份覆盖后消息加入了旧备份。
+        没有当前备份时返回 False。
+        """
+        backup = self._get_current_backup(group_id)
+        if not backup:
+            return False
+        EssenceMessage.insert(
+            group_id=group_id,
+            message_id=msg_info.get("message_id", ""),
+            message_seq=msg_info.get("message_seq", ""),
+            sender_id=msg_info.get("sender").get("user_id", ""),
+            sender_nick=msg_info.get("sender").get("nickname", ""),
+            operator_id=msg_info.get("sender").get("user_id", ""),  # 操作者默认为消息发送者
+            operator_nick=msg_info.get("sender").get("nickname", ""),  # 操作者昵称默认为消息发送者昵称
+            operator_time=int(datetime.datetime.now().timestamp()),
+            content=encode_content(msg_info.get("message", "")),
+            content_format=CONTENT_FORMAT_JSON,
+        ).on_conflict_ignore().execute()
+        index_essence_messages(group_id, [(msg_info.get("message_id", ""), msg_info.get("message", ""))])
+        
+        message = EssenceMessage.get(
+            (EssenceMessage.group_id == group_id) &
+            (EssenceMessage.message_id == msg_info.get("message_id", ""))
+        )
+        if BackupMembership.select().where(
+            (BackupMembership.backup == backup) & (BackupMembership.message == message)
+        ).exists():
+            return True
+        BackupMembership.insert(backup=backup, message=message, in_essence_list=0).execute()
+        update_backup_stats(backup.id, group_id, [message.message_id])
+        return True
+    
+
     @CommandHandlerBase.command("查看精华", 
                                usage="查看精华 [日期/QQ号/数量] [数量]",
-                               description="查看精华消息，支持按日期、QQ号或数量筛选，默认显示前100条")
+                               description="查看精华消息，支持按日期、QQ号或数量筛选，默认显示前100条",
+                               user_rate_limit=(3, 60),
+                               group_rate_limit=(10, 60),
+                               coalesce=True)
     async def handle_essence_list(self, event : GroupMessageEvent, args: list):
         """处理查看精华消息命令。"""
         group_id = event.group_id
-        client:NapCatClient = CommandContext().client
         
         try:
+            params = self._parse_query_params(args)
+            
             # 获取当前最新的备份记录
-            current_backup = self._get_current_backup(group_id)
+            current_backup = await self._db.read(self._get_current_backup, group_id)
             
             if not current_backup:
                 await event.reply([Text(text="没有找到当前备份记录，请先执行备份精华命令")])
                 return
             
-            # 构建查询条件
-            query = EssenceMessage.select().where(
-                (EssenceMessage.backup == current_backup) & 
-                (EssenceMessage.group_id == group_id)
-            )
-            
-            # 处理参数并更新查询
-            query, limit_count = self._process_query_params(query, args)
-            
-            # 按时间倒序排列，最新的在前
-            query = query.order_by(EssenceMessage.operator_time.desc())
-            if limit_count is not None:
-                query = query.limit(limit_count)
-            
-            # 执行查询
-            messages = list(query)
-            
-            if not messages:
-                await event.reply([Text(text="没有找到匹配的精华消息")])
+            # 不限条数时分页读取、分批发送，内存占用与结果总数无关
+            if params[3] is None:
+                sent_count = await self._send_forward_messages_paged(group_id, current_backup, params)
+                if not sent_count:
+                    await event.reply([Text(text="没有找到匹配的精华消息")])
                 return
             
-            # 准备转发消息格式
-            forward_msgs = self._prepare_forward_messages(messages)
+            # 优先使用缓存，备份和添加精华时会使缓存失效
+            cache_key = (group_id, current_backup.id, params)
+            forward_msgs = self._result_cache.get(cache_key)
+            if forward_msgs is None:
+                generation = self._result_cache.generation(group_id)
+                
+                # 在数据库读线程中查询
+                messages = await self._db.read(
+                    self._query_essence_messages, group_id, current_backup, params
+                )
+                
+                if not messages:
+                    await event.reply([Text(text="没有找到匹配的精华消息")])
+                    return
+                
+                # 准备转发消息格式
+                forward_msgs = self._prepare_forward_messages(messages)
+                self._result_cache.put(cache_key, forward_msgs, group_id, generation)
             
             # 发送转发消息
-            await client.send_group_forward_msg(group_id=group_id, messages=forward_msgs)
+            await NapCatApi().send_group_forward_msg(group_id=group_id, messages=forward_msgs)
             
         except Exception as e:
             await event.reply([Text(text=f"查看精华消息失败：{str(e)}")])
     
-    def _process_query_params(self, query, args: list):
-        """处理查询参数，更新查询条件和限制条数。"""
+    async def _send_forward_messages_paged(self, group_id: str, backup, params: tuple):
+        """按页读取匹配的精华消息（不限条数），每页作为一条转发消息发送。
+        
+        Returns:
+            int: 发送的精华消息总数
+        """
+        sent_count = 0
+        page_cursor = None
+        while True:
+            messages = await self._db.read(
+                self._query_essence_page, group_id, backup, params, page_cursor
+            )
+            if not messages:
+                break
+            
+            if sent_count:
+                # 控制发送节奏，避免短时间内发送大量转发消息
+                await asyncio.sleep(FORWARD_SEND_INTERVAL)
+            await NapCatApi().send_group_forward_msg(
+                group_id=group_id, messages=self._prepare_forward_messages(messages)
+            )
+            sent_count += len(messages)
+            
+            if len(messages) < FORWARD_PAGE_SIZE:
+                break
+            # 元组中的字段顺序见 ESSENCE_ROW_FIELDS
+            last_id, _, _, last_time = messages[-1][:4]
+            page_cursor = (last_time, last_id)
+        
+        return sent_count
+    
+    def _query_essence_page(self, group_id: str, backup, params: tuple, page_cursor):
+        """查询一页精华消息（在数据库读线程中执行）。
+        
+        按 (operator_time, id) 倒序做键集分页，page_cursor 为上一页最后一条消息的 (operator_time, id)。
+        """
+        query = self._build_essence_query(group_id, backup, params).order_by(
+            EssenceMessage.operator_time.desc(), EssenceMessage.id.desc()
+        )
+        
+        if page_cursor is not None:
+            last_time, last_id = page_cursor
+            query = query.where(
+                (EssenceMessage.operator_time < last_time) |
+                ((EssenceMessage.operator_time == last_time) & (EssenceMessage.id < last_id))
+            )
+        
+        return list(query.limit(FORWARD_PAGE_SIZE))
+    
+    def _query_essence_messages(self, group_id: str, backup, params: tuple):
+        """查询备份中符合条件的精华消息（在数据库读线程中执行）。"""
+        return list(self._build_essence_query(group_id, backup, params))
+    
+    def _build_essence_query(self, group_id: str, backup, params: tuple):
+        """根据解析后的查询参数构建指定备份中精华消息的查询，结果为 ESSENCE_ROW_FIELDS 顺序的元组。"""
+        sender_id, start_timestamp, end_timestamp, limit_count = params
+        
+        # 构建查询条件，只读取生成转发消息需要的字段
+        query = EssenceMessage.select(*ESSENCE_ROW_FIELDS).join(BackupMembership).where(
+            (BackupMembership.backup == backup) & 
+            (EssenceMessage.group_id == group_id)
+        )
+        
+        if sender_id is not None:
+            query = query.where(EssenceMessage.sender_id == sender_id)
+        
+        # 直接比较 operator_time 时间戳，不对字段套用函数，这样可以使用索引
+        if start_timestamp is not None:
+            query = query.where(
+                (EssenceMessage.operator_time >= start_timestamp) &
+                (EssenceMessage.operator_time < end_timestamp)
+            )
+        
+        # 按时间倒序排列，最新的在前
+        query = query.order_by(EssenceMessage.operator_time.desc())
+        if limit_count is not None:
+            query = query.limit(limit_count)
+        
+        return query.tuples()
+
+    @CommandHandlerBase.command("搜索精华",
+                               usage="搜索精华 <关键词> [页码]",
+                               description="在当前备份的精华消息中搜索关键词，多个关键词用空格分隔，按相关度排序，每页20条",
+                               user_rate_limit=(5, 60),
+                               coalesce=True)
+    async def handle_essence_search(self, event: GroupMessageEvent, args: list):
+        """处理搜索精华消息命令。"""
+        keywords, page = self._parse_search_params(args)
+        if not keywords:
+            await event.reply([Text(text="请输入要搜索的关键词，例如：搜索精华 今天吃什么")])
+            return
+
+        group_id = event.group_id
+        try:
+            current_backup = await self._db.read(self._get_current_backup, group_id)
+            if not current_backup:
+                await event.reply([Text(text="没有找到当前备份记录，请先执行备份精华命令")])
+                return
+
+            cache_key = ("search", group_id, current_backup.id, keywords, page)
+            cached = self._result_cache.get(cache_key)
+            if cached is None:
+                generation = self._result_cache.generation(group_id)
+                total, messages = await self._db.read(
+                    self._search_essence_messages, current_backup, keywords, page
+                )
+                cached = (total, self._prepare_forward_messages(messages))
+                self._result_cache.put(cache_key, cached, group_id, generation)
+            total, forward_msgs = cached
+
+            if not total:
+                await event.reply([Text(text="没有找到匹配的精华消息")])
+                return
+            page_count = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+            if not forward_msgs:
+                await event.reply([Text(text=f"共找到 {total} 条精华消息，只有 {page_count} 页")])
+                return
+
+            reply_text = f"共找到 {total} 条精华消息，第 {page}/{page_count} 页"
+            if page < page_count:
+                reply_text += f"，发送“搜索精华 {' '.join(keywords)} {page + 1}”查看下一页"
+            await event.reply([Text(text=reply_text)])
+            await NapCatApi().send_group_forward_msg(group_id=group_id, messages=forward_msgs)
+        except Exception as e:
+            await event.reply([Text(text=f"搜索精华消息失败：{str(e)}")])
+
+    def _parse_search_params(self, args: list):
+        """解析搜索参数，有多个参数且最后一个是数字时作为页码。
+
+        Returns:
+            tuple: (关键词元组, 页码)
+        """
+        page = 1
+        if len(args) >= 2 and args[-1].isdigit():
+            page = max(1, int(args[-1]))
+            args = args[:-1]
+        # 去掉重复的关键词，保持顺序，相同的搜索使用同一个缓存键
+        return tuple(dict.fromkeys(args)), page
+
+    def _search_essence_messages(self, backup, keywords: tuple, page: int):
+        """在备份中搜索包含所有关键词的精华消息（在数据库读线程中执行）。
+
+        Returns:
+            tuple: (匹配总数, 当前页的消息列表)
+        """
+        query = self._build_search_query(backup, keywords)
+        total = query.count()
+        if total <= (page - 1) * SEARCH_PAGE_SIZE:
+            return total, []
+        return total, list(query.paginate(page, SEARCH_PAGE_SIZE))
+
+    def _build_search_query(self, backup, keywords: tuple):
+        """构建在指定备份中搜索关键词的查询，结果为 ESSENCE_ROW_FIELDS 顺序的元组。
+
+        长度不小于 3 的关键词通过 trigram 索引匹配，按 bm25 相关度排序；
+        更短的关键词无法使用索引，在匹配结果（或整个备份）中逐条比较纯文本。
+        SQLite 不支持 trigram 分词（没有搜索索引）时，所有关键词都逐条比较，按设精时间排序。
+        """
+        query = EssenceMessage.select(*ESSENCE_ROW_FIELDS).join(BackupMembership).where(
+            BackupMembership.backup == backup
+        )
+        if not SEARCH_INDEX_AVAILABLE:
+            plain_text = fn.lower(fn.essence_plain_text(EssenceMessage.content, EssenceMessage.content_format))
+            for keyword in keywords:
+                query = query.where(fn.instr(plain_text, keyword.lower()) > 0)
+            return query.tuples().order_by(EssenceMessage.operator_time.desc())
+
+        query = query.switch(EssenceMessage).join(
+            EssenceSearch, on=(EssenceSearch.rowid == EssenceMessage.id)
+        ).tuples()
+
+        for keyword in keywords:
+            if len(keyword) < SEARCH_MIN_KEYWORD_LENGTH:
+                # trigram 分词默认不区分大小写，这里保持一致
+                query = query.where(fn.instr(fn.lower(EssenceSearch.text), keyword.lower()) > 0)
+
+        indexed = [keyword for keyword in keywords if len(keyword) >= SEARCH_MIN_KEYWORD_LENGTH]
+        if not indexed:
+            return query.order_by(EssenceMessage.operator_time.desc())
+
+        # 每个关键词作为一个短语，用双引号括起来，短语之间是“与”的关系
+        match_expression = " ".join('"{}"'.format(keyword.replace('"', '""')) for keyword in indexed)
+        return query.where(EssenceSearch.match(match_expression)).order_by(
+            EssenceSearch.bm25(), EssenceMessage.operator_time.desc()
+        )
+
+    @CommandHandlerBase.command("精华统计",
+                               usage="精华统计 [数量]",
+                               description="统计当前备份中被设精最多的发送者、设精最多的管理员和每月的精华数，默认显示前10名",
+                               user_rate_limit=(5, 60),
+                               coalesce=True)
+    async def handle_essence_stats(self, event: GroupMessageEvent, args: list):
+        """处理精华统计命令。"""
+        top = STATS_TOP_DEFAULT
+        if args and args[0].isdigit():
+            top = min(max(1, int(args[0])), STATS_TOP_MAX)
+
+        group_id = event.group_id
+        try:
+            current_backup = await self._db.read(self._get_current_backup, group_id)
+            if not current_backup:
+                await event.reply([Text(text="没有找到当前备份记录，请先执行备份精华命令")])
+                return
+
+            stats = await self._db.read(self._query_backup_stats, current_backup, top)
+            if stats is None:
+                # 统计缺失（例如被手动删除），从成员关系重新计算一次
+                await self._db.write(rebuild_backup_stats, current_backup.id)
+                stats = await self._db.read(self._query_backup_stats, current_backup, top)
+
+            await event.reply([Text(text=self._format_backup_stats(stats))])
+        except Exception as e:
+            await event.reply([Text(text=f"统计精华消息失败：{str(e)}")])
+
+    def _query_backup_stats(self, backup, top: int):
+        """读取备份的统计（在数据库读线程中执行），只读取预先计算好的结果，与消息数量无关。
+
+        Returns:
+            dict: {"total": 总数, "sender": [(QQ号, 昵称, 条数)], "operator": [...], "month": [(月份, 条数)]}，
+                  备份还没有统计时返回 None
+        """
+        if not has_backup_stats(backup.id):
+            return None
+
+        def ranking(kind, limit):
+            return list(EssenceStat.select(EssenceStat.key, EssenceStat.name, EssenceStat.count).where(
+                (EssenceStat.backup == backup) & (EssenceStat.kind == kind)
+            ).order_by(EssenceStat.count.desc(), EssenceStat.key).limit(limit).tuples())
+
+        months = EssenceStat.select(EssenceStat.key, EssenceStat.count).where(
+            (EssenceStat.backup == backup) & (EssenceStat.kind == "month")
+        ).order_by(EssenceStat.key.desc()).limit(STATS_MONTHS).tuples()
+        total = EssenceStat.get((EssenceStat.backup == backup) & (EssenceStat.kind == "total")).count
+        return {
+            "total": total,
+            "sender": ranking("sender", top),
+            "operator": ranking("operator", top),
+            "month": list(months),
+        }
+
+    def _format_backup_stats(self, stats: dict):
+        lines = [f"精华统计（当前备份共 {stats['total']} 条）"]
+        for kind, title in (("sender", "被设精最多的成员"), ("operator", "设精最多的管理员")):
+            if stats[kind]:
+                lines.append(f"\n{title}：")
+                lines.extend(
+                    f"{rank}. {name or user_id}（{user_id}）：{count} 条"
+                    for rank, (user_id, name, count) in enumerate(stats[kind], 1)
+                )
+        if stats["month"]:
+            lines.append(f"\n最近 {len(stats['month'])} 个月：")
+            lines.extend(f"{month}：{count} 条" for month, count in stats["month"])
+        return "\n".join(lines)
+
+    def _parse_query_params(self, args: list):
+        """解析查询参数。
+        
+        Returns:
+            tuple: (QQ号, 开始时间戳, 结束时间戳, 限制条数)，未指定的条件为 None。
+                含义相同的参数解析结果相同，可以直接用作缓存键。
+        """
         # 设置默认显示条数
         limit_count = 10
+        sender_id = None
+        start_timestamp, end_timestamp = None, None
         
         if not args:
-            return query, limit_count
+            return sender_id, start_timestamp, end_timestamp, limit_count
         
         # 处理第一个参数
         param = args[0]
@@ -282,69 +816,57 @@ class EssenceHandler(CommandHandlerBase):
         # 检查参数类型：日期、QQ号、还是数字
         if param.count(".") == 2:
             # 完整日期格式 (2025.02.07)
-            query = self._process_date_param(query, param)
+            start_timestamp, end_timestamp = self._process_date_param(param)
             limit_count = 100
         elif param.count(".") == 1:
             # 年月格式 (2025.02)
-            query = self._process_year_month_param(query, param)
+            start_timestamp, end_timestamp = self._process_year_month_param(param)
             limit_count = 100
         elif param.isdigit() and len(param) == 4:
             # 仅年份格式 (2025)
-            query = self._process_year_param(query, param)
+            start_timestamp, end_timestamp = self._process_year_param(param)
             limit_count = 100
         elif param.isdigit() and 1 <= int(param) <= 100:
             # 单个数字参数，按条数查询
             limit_count = int(param)
         else:
             # QQ号
-            query = query.where(EssenceMessage.sender_id == param)
+            sender_id = param
             limit_count = 100
         
         # 处理第二个参数（数量）
         if len(args) >= 2:
             limit_count = self._process_limit_param(args[1], limit_count)
         
-        return query, limit_count
+        return sender_id, start_timestamp, end_timestamp, limit_count
     
-    def _process_date_param(self, query, date_param: str):
-        """处理日期参数。"""
+    def _process_date_param(self, date_param: str):
+        """处理日期参数，返回当天的时间戳范围。"""
         date_str = date_param.replace(".", "-")
-        target_date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+        target_date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
         # 精确到天的查询
-        query = query.where(
-            fn.DATE(fn.datetime(EssenceMessage.operator_time, 'unixepoch')) == target_date
-        )
-        return query
+        return self._timestamp_range(target_date, target_date + datetime.timedelta(days=1))
     
-    def _process_year_month_param(self, query, year_month_param: str):
-        """处理年月参数。"""
+    def _process_year_month_param(self, year_month_param: str):
+        """处理年月参数，返回当月的时间戳范围。"""
         year_month_str = year_month_param.replace(".", "-")
         year_month = datetime.datetime.strptime(year_month_str, "%Y-%m")
-        # 计算月份的开始和结束时间戳
-        start_timestamp = int(datetime.datetime(year_month.year, year_month.month, 1).timestamp())
+        # 按月查询
         if year_month.month == 12:
-            end_timestamp = int(datetime.datetime(year_month.year + 1, 1, 1, 23, 59, 59).timestamp())
+            next_month = datetime.datetime(year_month.year + 1, 1, 1)
         else:
-            end_timestamp = int(datetime.datetime(year_month.year, year_month.month + 1, 1, 23, 59, 59).timestamp())
-        # 按月查询
-        query = query.where(
-            (EssenceMessage.operator_time >= start_timestamp) &
-            (EssenceMessage.operator_time <= end_timestamp)
-        )
-        return query
+            next_month = datetime.datetime(year_month.year, year_month.month + 1, 1)
+        return self._timestamp_range(year_month, next_month)
     
-    def _process_year_param(self, query, year_param: str):
-        """处理年份参数。"""
+    def _process_year_param(self, year_param: str):
+        """处理年份参数，返回当年的时间戳范围。"""
         year = int(year_param)
-        # 计算年份的开始和结束时间戳
-        start_timestamp = int(datetime.datetime(year, 1, 1).timestamp())
-        end_timestamp = int(datetime.datetime(year, 12, 31, 23, 59, 59).timestamp())
         # 按年查询
-        query = query.where(
-            (EssenceMessage.operator_time >= start_timestamp) &
-            (EssenceMessage.operator_time <= end_timestamp)
-        )
-        return query
+        return self._timestamp_range(datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1))
+    
+    def _timestamp_range(self, start: datetime.datetime, end: datetime.datetime):
+        """返回 [start, end) 对应的时间戳范围。"""
+        return int(start.timestamp()), int(end.timestamp())
     
     def _process_limit_param(self, limit_param: str, default_limit: int):
         """处理限制条数参数。"""
@@ -357,17 +879,16 @@ class EssenceHandler(CommandHandlerBase):
         return default_limit
     
     def _prepare_forward_messages(self, messages: list):
-        """准备转发消息格式。"""
+        """准备转发消息格式，messages 为 ESSENCE_ROW_FIELDS 顺序的元组。"""
         forward_msgs = []
-        for msg in messages:
-            decoded_content = ast.literal_eval(msg.content)
+        for _, sender_id, sender_nick, operator_time, content, content_format in messages:
             forward_msgs.append({
                 "type": "node",
                 "data": {
-                    "name": msg.sender_nick,
-                    "uin": msg.sender_id,
-                    "content": decoded_content,
-                    "time": msg.operator_time
+                    "name": sender_nick,
+                    "uin": sender_id,
+                    "content": decode_content(content, content_format),
+                    "time": operator_time
                 }
             })
         return forward_msgs
\ No newline at end of file
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Essence database maintenance module.
+
+This module keeps essence_backup.db from growing without bound: it moves
+expired backups (beyond the retention window) to the cold archive, and more old
+backups when the database exceeds its size cap, then returns free pages to the
+file system with incremental vacuum, in small steps on the database writer
+thread.
+"""
+
+import asyncio
+import os
+
+from peewee import OperationalError
+
+from handlers.base.command_handler_common import *
+from handlers.essence.essence_archive import archive_backup, list_cold_archives
+from handlers.essence.essence_models import db, db_executor, delete_backup, AUTO_VACUUM_INCREMENTAL, BackupRecord
+
+# 每步增量回收的页数（默认页大小 4KiB 时约 1MiB），每步是一个短事务，步与步之间其他写操作可以继续执行
+VACUUM_STEP_PAGES = 256
+# 两步之间的等待时间（秒）
+VACUUM_STEP_INTERVAL = 0.05
+
+# 同一进程中同时只执行一次维护（定期维护和管理员的“数据库状态 整理”），后来的调用等待并共享正在执行的结果
+_maintenance_flight = SingleFlight()
+
+
+def database_status():
+    """获取数据库文件和空间的使用情况（在数据库读线程中执行）。
+
+    Returns:
+        dict: {"file_bytes": 数据库文件大小, "wal_bytes": WAL 文件大小, "page_size": 页大小,
+               "page_count": 总页数, "free_pages": 空闲页数, "used_bytes": 数据占用的大小,
+               "auto_vacuum": 是否开启了增量回收, "archive_files": 冷归档文件数, "archive_bytes": 冷归档大小}
+    """
+    page_size = db.pragma("page_size")
+    page_count = db.pragma("page_count")
+    free_pages = db.pragma("freelist_count")
+    archives = list_cold_archives()
+    return {
+        "file_bytes": _file_size(db.database),
+        "wal_bytes": _file_size(db.database + "-wal"),
+        "page_size": page_size,
+        "page_count": page_count,
+        "free_pages": free_pages,
+        "used_bytes": (page_count - free_pages) * page_size,
+        "auto_vacuum": db.pragma("auto_vacuum") == AUTO_VACUUM_INCREMENTAL,
+        "archive_files": len(archives),
+        "archive_bytes": sum(_file_size(path) for _, path in archives),
+    }
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _expired_backups():
+    return list(BackupRecord.select().where(BackupRecord.expired == 1).order_by(BackupRecord.backup_time))
+
+
+def _oldest_archivable_backup():
+    # 当前备份不会被归档，只从旧备份中选择最早的一份
+    return BackupRecord.select().where(BackupRecord.is_current == 0).order_by(BackupRecord.backup_time).first()
+
+
+def _delete_archived_backup(backup_id):
+    """删除已经导出到冷归档的备份（在数据库写线程中以事务方式执行），备份已被删除时不做任何事。"""
+    backup = BackupRecord.get_or_none(BackupRecord.id == backup_id)
+    if backup is not None:
+        delete_backup(backup)
+
+
+def _incremental_vacuum_step(pages):
+    """回收最多 pages 个空闲页（在数据库写线程中以事务方式执行）。
+
+    Returns:
+        int: 回收的页数
+    """
+    free_pages = db.pragma("freelist_count")
+    # 每回收一页返回一行，必须读完所有结果才会回收全部 pages 页
+    db.execute_sql(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return free_pages - db.pragma("freelist_count")
+
+
+def _enable_incremental_vacuum():
+    """旧数据库开启增量空间回收（在数据库写线程中执行，不包裹事务）。
+
+    设置后需要 VACUUM 一次才生效，VACUUM 会重写整个数据库文件，期间其他写操作等待，
+    所以只在维护时执行，不在启动时执行。
+
+    Returns:
+        int: 转换时回收的页数，已经开启或转换失败时为 None
+    """
+    if db.pragma("auto_vacuum") == AUTO_VACUUM_INCREMENTAL:
+        return None
+    print("正在转换数据库以开启增量空间回收，数据库较大时需要一些时间...")
+    free_pages = db.pragma("freelist_count")
+    try:
+        db.pragma("auto_vacuum", "incremental")
+        db.execute_sql("VACUUM")
+    except OperationalError as e:
+        # 多进程模式下其他进程可能正在读写数据库，下次维护时再试
+        print(f"转换数据库失败，下次维护时重试: {e}")
+        return None
+    return free_pages
+
+
+def _checkpoint():
+    # 回收的空间在检查点之后才会从数据库文件中截掉，TRUNCATE 同时清空 WAL 文件
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+class EssenceMaintenance:
+    """定期维护精华备份数据库。
+
+    先将过期的备份（超出保留份数，由备份时标记）移到冷归档；
+    数据库占用超过 max_db_size 时，再从最早的旧备份开始移到冷归档，直到低于上限（当前备份不会被归档）；
+    之后分步回收空闲页，每步回收 VACUUM_STEP_PAGES 页，最后做一次检查点使数据库文件变小。
+    没有开启增量空间回收的旧数据库在第一次维护时用 VACUUM 转换。
+    每份备份先在读线程中导出，再在写线程中用一个单独的事务删除；其他操作都在数据库写线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, interval, max_db_size=None, max_archives_per_group=None):
+        """初始化数据库维护。
+
+        Args:
+            interval: 两次维护之间的间隔（秒）
+            max_db_size: 数据库占用的上限（字节），为 None 时不限制
+            max_archives_per_group: 每个群聊最多保留的冷归档文件数，超过后删除最早的归档，为 None 时不限制
+        """
+        self._interval = interval
+        self._max_db_size = max_db_size
+        self._max_archives_per_group = max_archives_per_group
+        self._metrics = CommandMetrics()
+
+    async def run(self, initial_delay=None):
+        """持续运行，直到任务被取消。
+
+        Args:
+            initial_delay: 第一次维护之前等待的时间（秒），为 None 时等待一个维护间隔，
+                启动时不执行数据库转换和冷归档
+        """
+        await asyncio.sleep(self._interval if initial_delay is None else initial_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"维护精华备份数据库时出错: {e}")
+            await asyncio.sleep(self._interval)
+
+    async def run_once(self):
+        """执行一次维护，已有维护在执行时等待它完成并返回它的结果。
+
+        多进程模式下其他进程也可能同时维护：导出使用各自的临时文件，删除已不存在的备份时不做任何事，
+        空间回收在写事务中执行，互相之间不会冲突。
+
+        Returns:
+            dict: {"archived": 移到冷归档的备份数, "reclaimed_bytes": 回收的字节数}
+        """
+        return await _maintenance_flight.run("maintenance", self._run_once)
+
+    async def _run_once(self):
+        archived = await self._archive_expired_backups()
+        archived += await self._enforce_size_cap()
+        reclaimed_bytes = await self._vacuum()
+        if archived or reclaimed_bytes:
+            print(f"数据库维护完成：归档 {archived} 份旧备份，回收 {reclaimed_bytes} 字节")
+        return {"archived": archived, "reclaimed_bytes": reclaimed_bytes}
+
+    async def _archive(self, backup):
+        """导出一份备份后删除，备份已被其他进程归档时返回 False。"""
+        # 导出只读取数据库，在读线程中执行，不占用写线程；导出完成后再删除，中途失败时备份仍在数据库中
+        path = await db_executor.read(archive_backup, backup, self._max_archives_per_group)
+        if path is None:
+            return False
+        await db_executor.write(_delete_archived_backup, backup.id)
+        self._metrics.increment("db_archived_backups")
+        return True
+
+    async def _archive_expired_backups(self):
+        archived = 0
+        for backup in await db_executor.read(_expired_backups):
+            if await self._archive(backup):
+                archived += 1
+        return archived
+
+    async def _enforce_size_cap(self):
+        if not self._max_db_size:
+            return 0
+        archived = 0
+        status = await db_executor.read(database_status)
+        while status["used_bytes"] > self._max_db_size:
+            backup = await db_executor.read(_oldest_archivable_backup)
+            if backup is None:
+                print(f"数据库占用 {status['used_bytes']} 字节，超过上限 {self._max_db_size} 字节，但已经没有可以归档的旧备份")
+                break
+            if await self._archive(backup):
+                archived += 1
+            status = await db_executor.read(database_status)
+        return archived
+
+    async def _vacuum(self):
+        page_size = await db_executor.read(db.pragma, "page_size")
+        converted_pages = await db_executor.maintenance(_enable_incremental_vacuum)
+        reclaimed_pages = converted_pages or 0
+        while True:
+            pages = await db_executor.write(_incremental_vacuum_step, VACUUM_STEP_PAGES)
+            reclaimed_pages += pages
+            if pages < VACUUM_STEP_PAGES:
+                break
+            await asyncio.sleep(VACUUM_STEP_INTERVAL)
+
+        # 转换后整个数据库都写在 WAL 文件中，没有回收空闲页也需要检查点
+        if reclaimed_pages or converted_pages is not None:
+            await db_executor.maintenance(_checkpoint)
+        reclaimed_bytes = reclaimed_pages * page_size
+        self._metrics.increment("db_reclaimed_bytes", reclaimed_bytes)
+        return reclaimed_bytes
@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+"""Essence database models module.
+
+This module defines the SQLite database and tables used to store essence message backups.
+"""
+
+import os
+import ast
+import json
+import datetime
+import sqlite3
+from peewee import *
+from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
+from handlers.base.db_executor import DatabaseExecutor
+
+
+db_path = os.path.join(os.path.dirname(__file__), "essence_backup.db")
+# WAL 模式下读写互不阻塞，配合 DatabaseExecutor 的单写线程使用
+# 增量空间回收：删除数据后的空闲页由 EssenceMaintenance 分步归还给文件系统，
+# 必须在 journal_mode 之前设置，否则新建的数据库不会生效（已有的数据库由 EssenceMaintenance 转换）
+db_pragmas = {
+    "auto_vacuum": "incremental",
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+}
+db = SqliteDatabase(db_path, pragmas=db_pragmas)
+
+# 表基类
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+# 备份记录表
+class BackupRecord(BaseModel):
+    group_id = CharField()
+    backup_time = DateTimeField(default=datetime.datetime.now)
+    is_current = IntegerField(default=0)
+    # 超出保留份数后标记为过期，由 EssenceMaintenance 导出到冷归档后删除
+    expired = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            # 查找当前备份：group_id + is_current，按 backup_time 排序
+            (("group_id", "is_current", "backup_time"), False),
+            # 标记过期备份：按 group_id 和 backup_time 找出超出保留份数的旧备份
+            (("group_id", "backup_time"), False),
+        )
+
+# 消息内容的存储格式
+CONTENT_FORMAT_LEGACY = 0  # 旧版本写入的 Python repr 字符串，需要 ast.literal_eval 解析
+CONTENT_FORMAT_JSON = 1    # 紧凑 JSON
+
+
+def encode_content(content):
+    """将消息内容编码为紧凑 JSON，写入数据库时调用一次。"""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_content(content: str, content_format: int):
+    """解析数据库中保存的消息内容。"""
+    if content_format == CONTENT_FORMAT_JSON:
+        return json.loads(content)
+    return ast.literal_eval(content)
+
+
+def extract_plain_text(content):
+    """提取消息内容中的纯文本（所有文本消息段拼接），用于全文搜索。"""
+    if isinstance(content, str):
+        return content
+    if not isinstance(content, list):
+        return ""
+    return "".join(
+        str(segment.get("data", {}).get("text", ""))
+        for segment in content
+        if isinstance(segment, dict) and segment.get("type") == "text"
+    )
+
+
+@db.func("essence_plain_text")
+def _sql_plain_text(content, content_format):
+    """SQL 函数：数据库中保存的消息内容 -> 纯文本，供不支持搜索索引时逐条比较。"""
+    try:
+        return extract_plain_text(decode_content(content, content_format))
+    except (ValueError, SyntaxError):
+        return ""
+
+
+# 精华消息表，同一群聊中的同一条消息只保存一次，由各个备份通过 BackupMembership 引用
+class EssenceMessage(BaseModel):
+    group_id = CharField()
+    message_id = CharField()
+    message_seq = CharField()
+    sender_id = CharField()
+    sender_nick = CharField()
+    operator_id = CharField()
+    operator_nick = CharField()
+    operator_time = BigIntegerField()
+    content = TextField()
+    # 数据库层面默认为旧格式，这样迁移时直接复制或新增的列都会被标记为需要转换
+    content_format = IntegerField(default=CONTENT_FORMAT_JSON, constraints=[SQL(f"DEFAULT {CONTENT_FORMAT_LEGACY}")])
+
+    class Meta:
+        indexes = (
+            (("group_id", "message_id"), True),
+            # 查看精华：按时间倒序、按日期范围筛选
+            (("group_id", "operator_time"), False),
+            # 查看精华 <QQ号>：按发送者筛选后按时间倒序
+            (("group_id", "sender_id", "operator_time"), False),
+        )
+
+# 只索引旧格式的消息，后台转换时可以直接找到剩余的旧数据
+EssenceMessage.add_index(EssenceMessage.index(
+    EssenceMessage.id,
+    name="essencemessage_legacy_content",
+    where=(EssenceMessage.content_format == CONTENT_FORMAT_LEGACY)
+))
+
+# 备份与精华消息的对应关系，每个备份只保存它包含哪些消息
+class BackupMembership(BaseModel):
+    backup = ForeignKeyField(BackupRecord, backref='memberships')
+    message = ForeignKeyField(EssenceMessage, backref='memberships')
+    # 备份时该消息是否仍在群精华列表中：1 是，0 已被移出或是手动添加的消息，NULL 未知（版本 4 之前的备份）
+    in_essence_list = IntegerField(null=True)
+
+    class Meta:
+        indexes = (
+            (("backup", "message"), True),
+        )
+
+
+# 每个群聊的备份状态，定时备份根据 last_run_time 判断是否需要备份
+class GroupBackupState(BaseModel):
+    group_id = CharField(unique=True)
+    last_run_time = DateTimeField()
+    # 上次拉取到的精华列表的指纹（message_id 与 operator_time 的摘要），相同时说明精华列表没有变化
+    essence_fingerprint = CharField(null=True)
+    last_error = TextField(null=True)
+
+
+# 精华消息的全文搜索索引，rowid 与 EssenceMessage.id 相同，保存消息的纯文本
+# trigram 分词按每 3 个字符建立索引，不需要中文分词，关键词至少 3 个字符时可以直接使用索引匹配
+class EssenceSearch(FTS5Model):
+    rowid = RowIDField()
+    text = SearchField()
+
+    class Meta:
+        database = db
+        options = {"tokenize": "trigram"}
+
+
+# trigram 分词能匹配的最短关键词长度，更短的关键词只能逐条比较
+SEARCH_MIN_KEYWORD_LENGTH = 3
+
+# FTS5 的 trigram 分词需要 SQLite 3.34+，Python 3.8/3.9 自带的 SQLite 可能更旧；
+# 不支持时不创建搜索索引表，搜索精华逐条比较消息内容（结果相同，只是不能使用索引）
+SEARCH_INDEX_AVAILABLE = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+# 写入消息的搜索索引，配合 executemany 使用，参数为 (纯文本, group_id, message_id)
+# 消息内容变化时 REPLACE 会替换旧的索引
+SEARCH_INDEX_UPSERT_SQL = (
+    'INSERT OR REPLACE INTO "{search}" ("rowid", "text") '
+    'SELECT "id", ? FROM "{message}" WHERE "group_id" = ? AND "message_id" = ?'
+).format(search=EssenceSearch._meta.table_name, message=EssenceMessage._meta.table_name)
+
+
+def index_essence_messages(group_id: str, rows):
+    """更新消息的搜索索引（在数据库写线程中执行）。
+
+    Args:
+        group_id: 群号
+        rows: [(message_id, 消息内容)]，消息内容为解析后的消息段列表
+    """
+    if not SEARCH_INDEX_AVAILABLE:
+        return
+    db.cursor().executemany(
+        SEARCH_INDEX_UPSERT_SQL,
+        [(extract_plain_text(content), group_id, str(message_id)) for message_id, content in rows]
+    )
+
+
+# 当前备份的精华统计（精华统计指令使用），每个群聊只为当前备份保存一份
+# 写入备份和添加精华时按变化的消息增量更新，可以通过 rebuild_backup_stats 从成员关系重新计算
+class EssenceStat(BaseModel):
+    backup = ForeignKeyField(BackupRecord, backref='stats')
+    kind = CharField()   # sender 发送者, operator 设精者, month 月份, total 总数
+    key = CharField()    # QQ号或月份（YYYY-MM），total 为空字符串
+    name = CharField()   # 昵称，month 和 total 为空字符串
+    count = IntegerField()
+
+    class Meta:
+        indexes = (
+            (("backup", "kind", "key"), True),
+            # 排行：按 count 倒序取前几名
+            (("backup", "kind", "count"), False),
+        )
+
+
+# 各类统计的分组字段和名称字段，月份与查看精华的日期筛选一样按本地时间计算
+STAT_GROUPS = {
+    "sender": (EssenceMessage.sender_id, EssenceMessage.sender_nick),
+    "operator": (EssenceMessage.operator_id, EssenceMessage.operator_nick),
+    "month": (fn.strftime("%Y-%m", EssenceMessage.operator_time, "unixepoch", "localtime"), Value("")),
+    "total": (Value(""), Value("")),
+}
+
+# 按消息 ID 增量更新统计时每条语句包含的消息数，不超过 SQLite 的参数个数限制
+STAT_UPDATE_BATCH_SIZE = 500
+
+
+def _add_stats(backup_id, condition, sign=1):
+    """将满足 condition 的消息计入（sign 为 -1 时扣除）备份的统计。"""
+    for kind, (key, name) in STAT_GROUPS.items():
+        query = EssenceMessage.select(
+            Value(backup_id), Value(kind), key, fn.MAX(name), fn.COUNT(EssenceMessage.id) * sign
+        ).where(condition).group_by(key)
+        EssenceStat.insert_from(
+            query, [EssenceStat.backup, EssenceStat.kind, EssenceStat.key, EssenceStat.name, EssenceStat.count]
+        ).on_conflict(
+            conflict_target=[EssenceStat.backup, EssenceStat.kind, EssenceStat.key],
+            update={EssenceStat.count: EssenceStat.count + EXCLUDED.count, EssenceStat.name: EXCLUDED.name}
+        ).execute()
+
+
+def has_backup_stats(backup_id):
+    """备份是否已有统计（在数据库线程中执行）。"""
+    return EssenceStat.select().where(
+        (EssenceStat.backup == backup_id) & (EssenceStat.kind == "total")
+    ).exists()
+
+
+def update_backup_stats(backup_id, group_id: str, message_ids, sign=1):
+    """将群聊中指定 message_id 的消息计入（sign 为 -1 时扣除）备份的统计（在数据库写线程中执行）。
+
+    备份还没有统计时不做任何事，留到查询时重新计算。
+    """
+    if not message_ids or not has_backup_stats(backup_id):
+        return
+    message_ids = [str(message_id) for message_id in message_ids]
+    for start in range(0, len(message_ids), STAT_UPDATE_BATCH_SIZE):
+        _add_stats(backup_id, (EssenceMessage.group_id == group_id) & EssenceMessage.message_id.in_(
+            message_ids[start:start + STAT_UPDATE_BATCH_SIZE]
+        ), sign)
+    EssenceStat.delete().where((EssenceStat.backup == backup_id) & (EssenceStat.count <= 0)).execute()
+
+
+def move_backup_stats(from_backup_id, to_backup_id):
+    """创建新备份时，将上一份备份的统计转移给新备份（在数据库写线程中执行）。"""
+    EssenceStat.update(backup=to_backup_id).where(EssenceStat.backup == from_backup_id).execute()
+
+
+def rebuild_backup_stats(backup_id):
+    """根据备份的成员关系重新计算统计（在数据库写线程中执行）。"""
+    EssenceStat.delete().where(EssenceStat.backup == backup_id).execute()
+    _add_stats(backup_id, EssenceMessage.id.in_(
+        BackupMembership.select(BackupMembership.message).where(BackupMembership.backup == backup_id)
+    ))
+    # 空备份也写入总数，表示统计已经计算过
+    EssenceStat.insert(backup=backup_id, kind="total", key="", name="", count=0).on_conflict_ignore().execute()
+
+
+def delete_backup(backup):
+    """删除一份备份，以及只被这份备份引用的精华消息和它们的搜索索引。"""
+    other_memberships = BackupMembership.select().where(
+        (BackupMembership.message == EssenceMessage.id) &
+        (BackupMembership.backup != backup)
+    )
+    orphaned_messages = EssenceMessage.select(EssenceMessage.id).where(
+        EssenceMessage.id.in_(
+            BackupMembership.select(BackupMembership.message).where(
+                BackupMembership.backup == backup
+            )
+        ) & ~fn.EXISTS(other_memberships)
+    )
+    if SEARCH_INDEX_AVAILABLE:
+        EssenceSearch.delete().where(EssenceSearch.rowid.in_(orphaned_messages)).execute()
+    EssenceMessage.delete().where(EssenceMessage.id.in_(orphaned_messages)).execute()
+    # 删除这份备份的成员关系、统计和备份记录
+    BackupMembership.delete().where(BackupMembership.backup == backup).execute()
+    EssenceStat.delete().where(EssenceStat.backup == backup).execute()
+    backup.delete_instance()
+
+
+# 当前数据库结构版本，保存在 SQLite 的 user_version 中
+SCHEMA_VERSION = 7
+
+# PRAGMA auto_vacuum 的返回值：2 表示已开启增量空间回收
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def init_database():
+    """创建数据表，并将旧版本的数据库迁移到当前结构。
+
+    运行中的机器人由 db_executor 在工作线程中调用，不要在事件循环中直接调用。
+    """
+    # 多进程模式下多个工作进程会同时初始化，开始时就获取写锁，避免读取版本号后升级为写事务时冲突
+    with db.connection_context():
+        with db.atomic("IMMEDIATE"):
+            version = db.pragma("user_version")
+            for migration in _MIGRATIONS[version:]:
+                migration()
+            db.create_tables([BackupRecord, EssenceMessage, BackupMembership, GroupBackupState, EssenceStat])
+            if SEARCH_INDEX_AVAILABLE and not EssenceSearch.table_exists():
+                # 新数据库，或者之前在不支持 trigram 的 SQLite 上迁移过（跳过了搜索索引）的数据库
+                _migrate_add_search_index()
+            db.pragma("user_version", SCHEMA_VERSION)
+
+
+def _migrate_to_deduplicated_messages():
+    """版本 0 -> 1：每个备份完整复制一份消息的旧结构，迁移为消息去重 + 备份成员关系。"""
+    if not db.table_exists("essencemessage"):
+        return
+    columns = [column.name for column in db.get_columns("essencemessage")]
+    if "backup_id" not in columns:
+        return
+
+    db.execute_sql('ALTER TABLE "essencemessage" RENAME TO "essencemessage_v0"')
+    db.create_tables([BackupRecord, EssenceMessage, BackupMembership])
+    # 同一条消息在多个备份中都存在时，保留最新备份中的内容
+    db.execute_sql(
+        'INSERT OR IGNORE INTO "essencemessage" '
+        '("group_id", "message_id", "message_seq", "sender_id", "sender_nick", '
+        '"operator_id", "operator_nick", "operator_time", "content") '
+        'SELECT "group_id", "message_id", "message_seq", "sender_id", "sender_nick", '
+        '"operator_id", "operator_nick", "operator_time", "content" '
+        'FROM "essencemessage_v0" ORDER BY "backup_id" DESC, "id" DESC'
+    )
+    db.execute_sql(
+        'INSERT OR IGNORE INTO "backupmembership" ("backup_id", "message_id") '
+        'SELECT old."backup_id", new."id" FROM "essencemessage_v0" AS old '
+        'JOIN "essencemessage" AS new '
+        'ON new."group_id" = old."group_id" AND new."message_id" = old."message_id"'
+    )
+    db.execute_sql('DROP TABLE "essencemessage_v0"')
+
+
+def _migrate_add_query_indexes():
+    """版本 1 -> 2：为已有的表创建查询用的组合索引，并更新统计信息供查询优化器使用。"""
+    if not EssenceMessage.table_exists():
+        return
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "backuprecord_group_id_is_current_backup_time" '
+        'ON "backuprecord" ("group_id", "is_current", "backup_time")'
+    )
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "backuprecord_group_id_backup_time" '
+        'ON "backuprecord" ("group_id", "backup_time")'
+    )
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "essencemessage_group_id_operator_time" '
+        'ON "essencemessage" ("group_id", "operator_time")'
+    )
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "essencemessage_group_id_sender_id_operator_time" '
+        'ON "essencemessage" ("group_id", "sender_id", "operator_time")'
+    )
+    db.execute_sql("ANALYZE")
+
+
+def _migrate_add_content_format():
+    """版本 2 -> 3：增加 content_format 列，已有消息标记为旧格式，由后台任务逐批转换为 JSON。"""
+    if not EssenceMessage.table_exists():
+        return
+    columns = [column.name for column in db.get_columns("essencemessage")]
+    if "content_format" not in columns:
+        db.execute_sql(
+            'ALTER TABLE "essencemessage" ADD COLUMN "content_format" INTEGER NOT NULL '
+            f'DEFAULT {CONTENT_FORMAT_LEGACY}'
+        )
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "essencemessage_legacy_content" ON "essencemessage" ("id") '
+        f'WHERE "content_format" = {CONTENT_FORMAT_LEGACY}'
+    )
+
+
+def _migrate_add_in_essence_list():
+    """版本 3 -> 4：备份成员关系增加 in_essence_list 列，已有的记录保持未知（NULL）。"""
+    if not BackupMembership.table_exists():
+        return
+    columns = [column.name for column in db.get_columns("backupmembership")]
+    if "in_essence_list" not in columns:
+        db.execute_sql('ALTER TABLE "backupmembership" ADD COLUMN "in_essence_list" INTEGER')
+
+
+def _migrate_add_search_index(batch_size=1000):
+    """版本 4 -> 5：创建全文搜索索引，并为已有的消息建立索引。
+
+    SQLite 不支持 trigram 分词时跳过，升级 SQLite 后由 init_database 补建。
+    """
+    if not SEARCH_INDEX_AVAILABLE or not EssenceMessage.table_exists():
+        return
+    EssenceSearch.create_table()
+    cursor = db.execute_sql('SELECT "id", "content", "content_format" FROM "essencemessage"')
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        db.cursor().executemany(
+            'INSERT OR REPLACE INTO "essencesearch" ("rowid", "text") VALUES (?, ?)',
+            [(message_pk, _plain_text_or_raw(content, content_format)) for message_pk, content, content_format in rows]
+        )
+
+
+def _plain_text_or_raw(content: str, content_format: int):
+    try:
+        return extract_plain_text(decode_content(content, content_format))
+    except (ValueError, SyntaxError):
+        # 无法解析的内容按纯文本保存（与 convert_legacy_content 一致）
+        return content
+
+
+def _migrate_add_backup_stats():
+    """版本 5 -> 6：创建精华统计表，并为每个群聊的当前备份计算统计。"""
+    if not BackupRecord.table_exists():
+        return
+    db.create_tables([EssenceStat])
+    for backup_id, in BackupRecord.select(BackupRecord.id).where(BackupRecord.is_current == 1).tuples():
+        rebuild_backup_stats(backup_id)
+
+
+def _migrate_add_backup_expired():
+    """版本 6 -> 7：备份记录增加 expired 列，已有的备份都未过期。"""
+    if not BackupRecord.table_exists():
+        return
+    columns = [column.name for column in db.get_columns("backuprecord")]
+    if "expired" not in columns:
+        db.execute_sql('ALTER TABLE "backuprecord" ADD COLUMN "expired" INTEGER NOT NULL DEFAULT 0')
+
+
+def convert_legacy_content(batch_size=500):
+    """将一批旧格式的消息内容转换为 JSON（在数据库写线程中执行）。
+    
+    Returns:
+        int: 本批转换的消息数，为 0 时表示已全部转换完成
+    """
+    rows = list(EssenceMessage.select(EssenceMessage.id, EssenceMessage.content).where(
+        EssenceMessage.content_format == CONTENT_FORMAT_LEGACY
+    ).limit(batch_size).tuples())
+    
+    updates = []
+    for message_pk, content in rows:
+        try:
+            decoded_content = ast.literal_eval(content)
+        except (ValueError, SyntaxError):
+            # 无法解析的内容按纯文本保存
+            decoded_content = content
+        updates.append((encode_content(decoded_content), CONTENT_FORMAT_JSON, message_pk))
+    
+    db.cursor().executemany(
+        'UPDATE "essencemessage" SET "content" = ?, "content_format" = ? WHERE "id" = ?', updates
+    )
+    return len(rows)
+
+
+# 数据库迁移，第 i 项把数据库从版本 i 升级到版本 i + 1
+_MIGRATIONS = [
+    _migrate_to_deduplicated_messages,
+    _migrate_add_query_indexes,
+    _migrate_add_content_format,
+    _migrate_add_in_essence_list,
+    _migrate_add_search_index,
+    _migrate_add_backup_stats,
+    _migrate_add_backup_expired,
+]
+
+# 所有精华数据库操作都通过该执行器执行，第一次执行数据库操作时在工作线程中运行 init_database
+db_executor = DatabaseExecutor(db, initializer=init_database)
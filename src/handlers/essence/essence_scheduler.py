@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Essence backup scheduler module.
+
+This module periodically backs up the essence messages of every group the bot is in.
+"""
+
+import asyncio
+import datetime
+import random
+
+from handlers.base.command_handler_common import *
+from handlers.essence.essence_handler import EssenceHandler
+
+# 两次检查之间的最短和最长等待时间（秒）
+SCHEDULER_MIN_SLEEP = 60
+SCHEDULER_MAX_SLEEP = 3600
+
+
+class EssenceBackupScheduler:
+    """定时备份所有群聊的精华消息。
+
+    每个群聊距离上次备份（包括手动执行的备份精华）超过 interval 秒后重新备份，
+    备份时间保存在数据库中，重启后不会立即把所有群聊重新备份一遍。
+    每个群聊在 jitter 秒内随机错开开始时间，同时最多备份 max_concurrency 个群聊。
+    精华列表没有变化的群聊不会创建新的备份。
+    """
+
+    def __init__(self, interval, max_concurrency=4, jitter=300, group_filter=None):
+        """初始化定时备份。
+
+        Args:
+            interval: 每个群聊的备份间隔（秒）
+            max_concurrency: 同时备份的群聊数
+            jitter: 开始时间随机错开的范围（秒）
+            group_filter: 只备份 group_filter(group_id) 为真的群聊（例如多进程模式下只备份分配给本进程的群聊），为 None 时备份所有群聊
+        """
+        self._interval = interval
+        self._max_concurrency = max_concurrency
+        self._jitter = jitter
+        self._group_filter = group_filter
+        self._metrics = CommandMetrics()
+
+    async def run(self):
+        """持续运行，直到任务被取消。"""
+        while True:
+            try:
+                next_due = await self.run_once()
+            except Exception as e:
+                print(f"定时备份精华消息时出错: {e}")
+                next_due = SCHEDULER_MIN_SLEEP
+            await asyncio.sleep(min(max(next_due, SCHEDULER_MIN_SLEEP), SCHEDULER_MAX_SLEEP))
+
+    async def run_once(self):
+        """备份所有到期的群聊。
+
+        Returns:
+            float: 距离下一个群聊到期的秒数
+        """
+        handler = CommandCache().get_handler_instance(EssenceHandler)
+        group_list = await NapCatApi().get_group_list()
+        group_ids = [str(group["group_id"]) for group in group_list]
+        if self._group_filter is not None:
+            group_ids = [group_id for group_id in group_ids if self._group_filter(group_id)]
+        last_run_times = await handler.get_last_backup_times(group_ids)
+
+        now = datetime.datetime.now()
+        due_group_ids = []
+        next_due = self._interval
+        for group_id in group_ids:
+            last_run_time = last_run_times.get(group_id)
+            elapsed = (now - last_run_time).total_seconds() if last_run_time else self._interval
+            if elapsed >= self._interval:
+                due_group_ids.append(group_id)
+            else:
+                next_due = min(next_due, self._interval - elapsed)
+
+        if not due_group_ids:
+            return next_due
+
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        results = await asyncio.gather(*(
+            self._backup_group(handler, group_id, semaphore) for group_id in due_group_ids
+        ))
+
+        created = sum(1 for result in results if result == "created")
+        unchanged = sum(1 for result in results if result == "unchanged")
+        failed = sum(1 for result in results if result == "failed")
+        print(f"定时备份完成：{len(due_group_ids)} 个群聊，{created} 个创建了新备份，"
+              f"{unchanged} 个没有变化，{failed} 个失败")
+        return next_due
+
+    async def _backup_group(self, handler, group_id, semaphore):
+        # 随机错开开始时间，避免同时向 NapCat 发出大量请求
+        await asyncio.sleep(random.uniform(0, self._jitter))
+        async with semaphore:
+            try:
+                result = await handler.backup_group(int(group_id))
+            except Exception as e:
+                print(f"定时备份群聊 {group_id} 的精华消息失败: {e}")
+                self._metrics.increment("auto_backup_failed")
+                await handler.record_backup_run(group_id, str(e))
+                return "failed"
+
+        if result is None or not result["created"]:
+            self._metrics.increment("auto_backup_unchanged")
+            if result is None:
+                # 没有精华消息的群聊也记录备份时间，下个周期再检查
+                await handler.record_backup_run(group_id)
+            return "unchanged"
+        self._metrics.increment("auto_backup_created")
+        return "created"
@@ -7,63 +7,84 @@ from napcat import Text, GroupMessageEvent, PrivateMessageEvent
 class HelpHandler(CommandHandlerBase):
     def __init__(self):
         super().__init__()
+        # 指令在 CommandCache 初始化后不再变化，帮助文本按聊天类型在第一次使用时生成并缓存
+        # 格式: {chat_type: {"all": 全部指令的帮助, "categories": {category: 该类别的帮助}, "category_list": 可用类别列表}}
+        self._help_texts = {}
 
     @CommandHandlerBase.command("help", 
                                usage="help [类别]",
                                description="查看帮助信息，可以指定类别查询特定类别的指令")
     async def _handle_help(self, event, args: list):
-        # 使用CommandCache单例获取所有指令
-        from command_dispatch.command_ctx import CommandCache
-        command_cache = CommandCache()
-        
         try:
-            all_commands = command_cache.get_all_commands()
-            
             # 确定当前聊天类型
             if isinstance(event, GroupMessageEvent):
                 current_chat_type = "group"
             elif isinstance(event, PrivateMessageEvent):
                 current_chat_type = "private"
             
-            # 过滤出当前聊天类型可用的命令
-            available_commands = {}
-            for cmd, info in all_commands.items():
-                chat_type = info["chat_type"]
-                if chat_type == "both" or chat_type == current_chat_type:
-                    if info["category"] not in available_commands:
-                        available_commands[info["category"]] = []
-                    available_commands[info["category"]].append((cmd, info))
+            help_texts = self._get_help_texts(current_chat_type)
             
             # 处理类别查询
             if args:
                 query_category = args[0]
-                if query_category in available_commands:
-                    help_text = f"{query_category} 类指令：\n"
-                    for cmd, info in sorted(available_commands[query_category]):
-                        help_text += f"- {cmd}"
-                        if info["usage"]:
-                            help_text += f" (用法：{info['usage']})"
-                        if info["description"]:
-                            help_text += f"：{info['description']}"
-                        help_text += "\n"
-                else:
-                    help_text = f"未找到类别：{query_category}\n"
-                    help_text += "可用类别：\n"
-                    for category in sorted(available_commands.keys()):
-                        help_text += f"- {category}\n"
+                help_text = help_texts["categories"].get(query_category)
+                if help_text is None:
+                    help_text = f"未找到类别：{query_category}\n" + help_texts["category_list"]
             else:
-                # 生成所有类别的帮助信息
-                help_text = "可用指令：\n"
-                for category in sorted(available_commands.keys()):
-                    help_text += f"\n【{category}】\n"
-                    for cmd, info in sorted(available_commands[category]):
-                        help_text += f"- {cmd}"
-                        if info["usage"]:
-                            help_text += f" (用法：{info['usage']})"
-                        if info["description"]:
-                            help_text += f"：{info['description']}"
-                        help_text += "\n"
+                help_text = help_texts["all"]
         except Exception as e:
             help_text = f"获取帮助信息时出错: {e}\n"
         
-        await event.reply([Text(text=help_text)])
\ No newline at end of file
+        await event.reply([Text(text=help_text)])
+    
+    def _get_help_texts(self, chat_type: str):
+        help_texts = self._help_texts.get(chat_type)
+        if help_texts is None:
+            help_texts = self._render_help_texts(chat_type)
+            self._help_texts[chat_type] = help_texts
+        return help_texts
+    
+    def _render_help_texts(self, chat_type: str):
+        # 使用CommandCache单例获取所有指令
+        command_cache = CommandCache()
+        
+        # 过滤出当前聊天类型可用的命令
+        available_commands = {}
+        for category in sorted(command_cache.get_categories()):
+            commands = [
+                (cmd, info) for cmd, info in command_cache.get_commands_by_category(category).items()
+                if info["chat_type"] == "both" or info["chat_type"] == chat_type
+            ]
+            if commands:
+                available_commands[category] = sorted(commands)
+        
+        category_texts = {
+            category: self._render_command_lines(commands)
+            for category, commands in available_commands.items()
+        }
+        
+        # 生成所有类别的帮助信息
+        all_lines = ["可用指令：\n"]
+        for category, text in category_texts.items():
+            all_lines.append(f"\n【{category}】\n")
+            all_lines.append(text)
+        
+        return {
+            "all": "".join(all_lines),
+            "categories": {
+                category: f"{category} 类指令：\n" + text
+                for category, text in category_texts.items()
+            },
+            "category_list": "可用类别：\n" + "".join(f"- {category}\n" for category in available_commands),
+        }
+    
+    def _render_command_lines(self, commands: list):
+        lines = []
+        for cmd, info in commands:
+            line = f"- {cmd}"
+            if info["usage"]:
+                line += f" (用法：{info['usage']})"
+            if info["description"]:
+                line += f"：{info['description']}"
+            lines.append(line + "\n")
+        return "".join(lines)
@@ -8,34 +8,145 @@ import asyncio
 from napcat import NapCatClient, GroupMessageEvent, PrivateMessageEvent
 from command_dispatch.command_dispatcher import CommandDispatcher
 from command_dispatch.command_ctx import CommandContext
+from command_dispatch.event_worker_pool import EventWorkerPool
+from command_dispatch.metrics import dump_metrics_periodically
 
 client = NapCatClient(
     ws_url="ws://127.0.0.1:3000",
     token="your_token"
 )
 
+# 机器人管理员的 QQ 号，可以在任意聊天中使用管理指令（群主和群管理员可以在群内使用）
+ADMIN_USER_IDS = []
+# 定期将指标以 Prometheus 文本格式写入该文件（可配合 node_exporter 的 textfile collector），为 None 时不写入
+# 多进程模式下每个工作进程写入各自的文件，例如 metrics.prom 对应 metrics.worker0.prom、metrics.worker1.prom
+METRICS_DUMP_PATH = None
+METRICS_DUMP_INTERVAL = 60
+
+# 定时备份所有群聊精华消息的间隔（秒），为 None 时不自动备份
+AUTO_BACKUP_INTERVAL = None
+# 定时备份时同时备份的群聊数，以及各群聊开始时间随机错开的范围（秒）
+AUTO_BACKUP_CONCURRENCY = 4
+AUTO_BACKUP_JITTER = 300
+
+# 精华备份数据库的维护间隔（秒），为 None 时不定期维护（管理员可以用“数据库状态 整理”手动执行）
+# 每次维护时分步回收删除数据后的空闲页；数据库占用超过 DB_MAX_SIZE（字节）时，先把最早的旧备份移到冷归档
+DB_MAINTENANCE_INTERVAL = 3600
+DB_MAX_SIZE = None
+# 每个群聊最多保留的冷归档文件数，超过后删除最早的归档文件（每次删除都会打印日志），为 None 时不删除
+COLD_ARCHIVE_MAX_PER_GROUP = None
+
+# 同时处理的指令数上限（同一群聊/用户的消息始终按顺序处理）
+MAX_CONCURRENT_COMMANDS = 8
+# 等待处理的消息数上限，达到上限后暂停读取新消息
+MAX_PENDING_EVENTS = 1000
+# 退出时等待未完成指令的最长时间（秒）
+SHUTDOWN_DRAIN_TIMEOUT = 30
+
+# 工作进程数。大于 0 时主进程只接收事件，按群号（私聊按 QQ 号）分发给多个工作进程处理，
+# 工作进程的 NapCat API 调用转发回主进程执行；为 0 时所有指令都在主进程中处理
+WORKER_PROCESSES = 0
+
 
 async def main():
     """Main function to run the bot.
     
     Initializes the client, sets up the command context and dispatcher,
-    and handles incoming events.
+    and handles incoming events concurrently through the event worker pool.
     """
     async with client:
         print(f"Bot {client.self_id} is connected")
 
         user_info = await client.get_login_info() 
 
+        if WORKER_PROCESSES > 0:
+            await run_with_worker_processes(user_info)
+            return
+
         command_ctx = CommandContext()
-        command_ctx.initialize(user_info, client)
+        command_ctx.initialize(user_info, client, admin_user_ids=ADMIN_USER_IDS)
         
         command_dispatcher = CommandDispatcher()
+        event_pool = EventWorkerPool(
+            command_dispatcher._try_handle_command_msg,
+            max_concurrency=MAX_CONCURRENT_COMMANDS,
+            max_pending=MAX_PENDING_EVENTS,
+            coalesce_key=command_dispatcher.coalesce_key,
+            on_coalesced=command_dispatcher.reply_coalesced
+        )
+        metrics_task = None
+        if METRICS_DUMP_PATH:
+            metrics_task = asyncio.create_task(
+                dump_metrics_periodically(METRICS_DUMP_PATH, METRICS_DUMP_INTERVAL)
+            )
+        
+        auto_backup_task = None
+        if AUTO_BACKUP_INTERVAL:
+            # 只在开启定时备份时导入，避免启动时加载数据库
+            from handlers.essence.essence_scheduler import EssenceBackupScheduler
+            scheduler = EssenceBackupScheduler(
+                AUTO_BACKUP_INTERVAL,
+                max_concurrency=AUTO_BACKUP_CONCURRENCY,
+                jitter=AUTO_BACKUP_JITTER
+            )
+            auto_backup_task = asyncio.create_task(scheduler.run())
         
+        maintenance_task = None
+        if DB_MAINTENANCE_INTERVAL:
+            maintenance_task = asyncio.create_task(run_db_maintenance())
+        
+        try:
+            async for event in client:
+                if isinstance(event, (GroupMessageEvent, PrivateMessageEvent)):
+                    await event_pool.submit(event)
+        finally:
+            # 先等待已接收的指令处理完成，再清理上下文
+            await event_pool.drain(timeout=SHUTDOWN_DRAIN_TIMEOUT)
+            if metrics_task is not None:
+                metrics_task.cancel()
+            if auto_backup_task is not None:
+                auto_backup_task.cancel()
+            if maintenance_task is not None:
+                maintenance_task.cancel()
+            command_ctx.cleanup()
+
+
+async def run_db_maintenance():
+    """等待一个维护间隔后再导入数据库模块并开始定期维护，启动时不加载 peewee 和数据库。"""
+    await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+    from handlers.essence.essence_maintenance import EssenceMaintenance
+    maintenance = EssenceMaintenance(
+        DB_MAINTENANCE_INTERVAL,
+        max_db_size=DB_MAX_SIZE,
+        max_archives_per_group=COLD_ARCHIVE_MAX_PER_GROUP
+    )
+    await maintenance.run(initial_delay=0)
+
+
+async def run_with_worker_processes(user_info):
+    """多进程模式：主进程接收事件并分发给工作进程，指标导出、定时备份和数据库维护在工作进程中执行。"""
+    # 只在多进程模式下导入
+    from command_dispatch.process_worker_pool import ProcessWorkerPool
+    event_pool = ProcessWorkerPool(client, user_info, WORKER_PROCESSES, max_pending=MAX_PENDING_EVENTS, worker_options={
+        "admin_user_ids": ADMIN_USER_IDS,
+        "max_concurrency": MAX_CONCURRENT_COMMANDS,
+        "max_pending": MAX_PENDING_EVENTS,
+        "metrics_dump_path": METRICS_DUMP_PATH,
+        "metrics_dump_interval": METRICS_DUMP_INTERVAL,
+        "auto_backup_interval": AUTO_BACKUP_INTERVAL,
+        "auto_backup_concurrency": AUTO_BACKUP_CONCURRENCY,
+        "auto_backup_jitter": AUTO_BACKUP_JITTER,
+        "db_maintenance_interval": DB_MAINTENANCE_INTERVAL,
+        "db_max_size": DB_MAX_SIZE,
+        "cold_archive_max_per_group": COLD_ARCHIVE_MAX_PER_GROUP,
+    })
+    await event_pool.start()
+    try:
         async for event in client:
             if isinstance(event, (GroupMessageEvent, PrivateMessageEvent)):
-                await command_dispatcher._try_handle_command_msg(event)
-
-        command_ctx.cleanup()
+                await event_pool.submit(event)
+    finally:
+        await event_pool.drain(timeout=SHUTDOWN_DRAIN_TIMEOUT)
 
 
 if __name__ == "__main__":
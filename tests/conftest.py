@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 测试直接导入 src 下的模块，与 python src/main.py 运行时的导入方式一致；
+# 合成数据和 NapCat 替身与基准测试共用 benchmarks/fake_napcat.py
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
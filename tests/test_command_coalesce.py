@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""通过 EventWorkerPool 提交相同指令的合并执行测试。
+
+同一群聊的事件在 EventWorkerPool 中串行处理，合并必须在事件排队之前进行：
+第二个相同的请求不再排队，也不会被冷却拒绝，第一个请求完成后收到一条合并提示。
+最后检查同一范围的多条限流规则各自使用一个令牌桶。
+"""
+
+import asyncio
+
+import pytest
+from napcat import Text
+
+from fake_napcat import FakeNapCatClient
+from command_dispatch.command_ctx import CommandCache, CommandContext
+from command_dispatch.command_dispatcher import CommandDispatcher
+from command_dispatch.command_throttle import CommandThrottle, COALESCED_MESSAGE
+from command_dispatch.event_worker_pool import EventWorkerPool
+from handlers.base.command_handler_base import CommandHandlerBase
+
+COMMAND = "慢查询"
+RESULT_TEXT = "查询结果"
+
+
+class SlowCommand:
+    """模拟一个耗时的指令，记录执行次数。"""
+
+    def __init__(self):
+        self.runs = 0
+
+    @CommandHandlerBase.command(COMMAND, cooldown=60, coalesce=True)
+    async def handle(self, event, args):
+        self.runs += 1
+        await asyncio.sleep(0.05)
+        await event.reply([Text(text=RESULT_TEXT)])
+
+
+@pytest.fixture
+def client():
+    return FakeNapCatClient()
+
+
+@pytest.fixture
+def slow_command(client, monkeypatch):
+    CommandContext().initialize({"user_id": client.self_id, "nickname": "bot"}, client)
+    CommandThrottle().set_enabled(True)
+    command = SlowCommand()
+    dispatcher = CommandDispatcher()
+    monkeypatch.setitem(CommandCache()._routes, (COMMAND, "group"), command.handle)
+    pool = EventWorkerPool(
+        dispatcher._try_handle_command_msg,
+        coalesce_key=dispatcher.coalesce_key,
+        on_coalesced=dispatcher.reply_coalesced
+    )
+    yield command, pool
+    CommandContext().cleanup()
+
+
+def sent_texts(client):
+    return [segment.text for _, _, message in client.sent for segment in message if isinstance(segment, Text)]
+
+
+def test_identical_requests_are_coalesced(client, slow_command):
+    command, pool = slow_command
+
+    async def run():
+        await pool.submit(client.group_event(f"{COMMAND} 1", user_id=20001))
+        await pool.submit(client.group_event(f"{COMMAND} 1", user_id=20002))
+        await pool.drain()
+
+    asyncio.run(run())
+    assert command.runs == 1
+    # 第二个请求没有被冷却拒绝，在结果发送后收到合并提示
+    assert sent_texts(client) == [RESULT_TEXT, COALESCED_MESSAGE]
+
+
+def test_different_requests_are_not_coalesced(client, slow_command):
+    command, pool = slow_command
+
+    async def run():
+        await pool.submit(client.group_event(f"{COMMAND} 1"))
+        await pool.submit(client.group_event(f"{COMMAND} 1", group_id=100001))
+        await pool.submit(client.group_event(f"{COMMAND} 2", group_id=100002))
+        await pool.drain()
+
+    asyncio.run(run())
+    assert command.runs == 3
+    assert COALESCED_MESSAGE not in sent_texts(client)
+
+
+def test_request_after_completion_runs_again(client, slow_command):
+    command, pool = slow_command
+
+    async def run():
+        await pool.submit(client.group_event(f"{COMMAND} 1"))
+        while pool.pending_count():
+            await asyncio.sleep(0.01)
+        await pool.submit(client.group_event(f"{COMMAND} 1"))
+        await pool.drain()
+
+    asyncio.run(run())
+    # 第一个请求完成后不再合并，第二个请求由冷却拒绝
+    assert command.runs == 1
+    texts = sent_texts(client)
+    assert texts[0] == RESULT_TEXT and COALESCED_MESSAGE not in texts and len(texts) == 2
+
+
+def test_rules_with_the_same_scope_have_separate_buckets(client):
+    async def handler(event, args):
+        pass
+
+    rules = CommandHandlerBase.command("测试", group_rate_limit=(5, 60), cooldown=10)(handler)
+    throttle = CommandThrottle()
+    throttle.set_enabled(True)
+    event = client.group_event("测试")
+    assert throttle.acquire("测试", rules, event)[0] == 0
+    # 群聊限流还有剩余次数，但冷却规则单独计算，第二次调用被冷却拒绝
+    retry_after, _ = throttle.acquire("测试", rules, event)
+    assert 0 < retry_after <= 10
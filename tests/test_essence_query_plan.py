@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""查看精华、搜索精华和当前备份查询的 EXPLAIN QUERY PLAN 测试。
+
+在临时数据库中写入多个群聊的多份备份并 ANALYZE 后，检查每种查询都使用了对应的索引，没有全表扫描。
+"""
+
+import pytest
+
+from handlers.essence.essence_models import db, db_pragmas, init_database, BackupRecord
+from handlers.essence.essence_handler import EssenceHandler
+from fake_napcat import make_essence_list
+
+GROUP_ID = "123456"
+
+MEMBERSHIP_INDEX = "backupmembership_backup_id_message_id"
+TIME_INDEX = "essencemessage_group_id_operator_time"
+SENDER_INDEX = "essencemessage_group_id_sender_id_operator_time"
+
+# 查看精华的参数和必须使用的索引
+LIST_QUERIES = {
+    "查看精华": ([], [TIME_INDEX, MEMBERSHIP_INDEX]),
+    "查看精华 <数量>": (["20"], [TIME_INDEX, MEMBERSHIP_INDEX]),
+    "查看精华 <QQ号>": (["20001"], [SENDER_INDEX, MEMBERSHIP_INDEX]),
+    "查看精华 <QQ号> -1": (["20001", "-1"], [SENDER_INDEX, MEMBERSHIP_INDEX]),
+    "查看精华 <日期>": (["2023.11.15"], [TIME_INDEX, MEMBERSHIP_INDEX]),
+    "查看精华 <年月>": (["2023.11"], [TIME_INDEX, MEMBERSHIP_INDEX]),
+    "查看精华 <年份>": (["2023"], [TIME_INDEX, MEMBERSHIP_INDEX]),
+}
+
+# 搜索精华的关键词和必须使用的索引
+SEARCH_QUERIES = {
+    "搜索精华 <关键词>": (("精华消息",), [MEMBERSHIP_INDEX]),
+    "搜索精华 <短关键词>": (("12",), [MEMBERSHIP_INDEX]),
+    "搜索精华 <关键词> <短关键词>": (("精华消息", "12"), [MEMBERSHIP_INDEX]),
+}
+
+
+def explain(query):
+    sql, params = query.sql()
+    return [row[-1] for row in db.execute_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def assert_uses_indexes(plan, indexes):
+    for index in indexes:
+        assert any(index in step for step in plan), f"未使用索引 {index}: {plan}"
+    for step in plan:
+        # 使用索引时为 "SCAN t USING INDEX ..." 或 "SEARCH t USING ..."，裸 "SCAN t" 表示全表扫描
+        # FTS5 表为 "SCAN t VIRTUAL TABLE INDEX 0:<约束>"，没有约束（"0:"）时表示全表扫描
+        if "VIRTUAL TABLE INDEX" in step:
+            assert not step.endswith(":"), f"全文索引没有使用约束: {plan}"
+        elif step.startswith("SCAN"):
+            assert "USING" in step, f"全表扫描: {plan}"
+
+
+@pytest.fixture(scope="module")
+def handler(tmp_path_factory):
+    db.init(str(tmp_path_factory.mktemp("essence") / "essence_backup.db"), pragmas=db_pragmas)
+    init_database()
+    handler = EssenceHandler()
+    for group_index in range(10):
+        for generation in range(3):
+            with db.atomic():
+                handler._backup_essence_messages(
+                    str(int(GROUP_ID) + group_index),
+                    make_essence_list(300, start=generation * 20)
+                )
+    db.execute_sql("ANALYZE")
+    yield handler
+    db.close()
+
+
+def test_current_backup_uses_index(handler):
+    query = BackupRecord.select().where(
+        (BackupRecord.group_id == GROUP_ID) & (BackupRecord.is_current == 1)
+    ).order_by(BackupRecord.backup_time.desc()).limit(1)
+    assert_uses_indexes(explain(query), ["backuprecord_group_id_is_current_backup_time"])
+
+
+@pytest.mark.parametrize("name", list(LIST_QUERIES))
+def test_essence_list_uses_indexes(handler, name):
+    args, indexes = LIST_QUERIES[name]
+    backup = handler._get_current_backup(GROUP_ID)
+    query = handler._build_essence_query(GROUP_ID, backup, handler._parse_query_params(args))
+    assert_uses_indexes(explain(query), indexes)
+
+
+def test_date_filter_is_a_timestamp_range(handler):
+    backup = handler._get_current_backup(GROUP_ID)
+    query = handler._build_essence_query(GROUP_ID, backup, handler._parse_query_params(["2023.11.15"]))
+    plan = explain(query)
+    assert any(TIME_INDEX in step and "operator_time>" in step and "operator_time<" in step for step in plan), plan
+
+
+@pytest.mark.parametrize("name", list(SEARCH_QUERIES))
+def test_essence_search_uses_indexes(handler, name):
+    keywords, indexes = SEARCH_QUERIES[name]
+    backup = handler._get_current_backup(GROUP_ID)
+    assert_uses_indexes(explain(handler._build_search_query(backup, keywords)), indexes)
+
+
+@pytest.mark.parametrize("name", list(SEARCH_QUERIES))
+def test_essence_search_without_index(handler, name, monkeypatch):
+    # SQLite 不支持 trigram 分词时逐条比较纯文本，结果应与使用搜索索引时相同
+    keywords, indexes = SEARCH_QUERIES[name]
+    backup = handler._get_current_backup(GROUP_ID)
+    expected = set(handler._build_search_query(backup, keywords))
+    monkeypatch.setattr("handlers.essence.essence_handler.SEARCH_INDEX_AVAILABLE", False)
+    query = handler._build_search_query(backup, keywords)
+    assert_uses_indexes(explain(query), indexes)
+    assert expected and set(query) == expected